@@ -0,0 +1,85 @@
+import bisect
+import difflib
+from logger_manager import LoggerManager
+
+
+class AgentIndex:
+    """agent昵称索引,在配置加载或agent变化时构建一次
+
+    小写昵称排序后用二分查找做前缀匹配,前缀匹配不足时再按子序列和编辑相似度做模糊匹配。
+    """
+
+    def __init__(self, agents):
+        self.agents = set(agents)
+        # 小写昵称 -> 配置中的昵称,匹配时不区分大小写;只有大小写不同的昵称保留配置中靠前的一个
+        self.names = {}
+        for name in agents:
+            key = name.lower()
+            if key in self.names:
+                LoggerManager.get_logger().warning(
+                    f"agent昵称 {self.names[key]} 与 {name} 只有大小写不同,"
+                    f"不区分大小写匹配和补全时使用 {self.names[key]},{name} 需按原大小写输入"
+                )
+                continue
+            self.names[key] = name
+        self.keys = sorted(self.names)
+
+    @staticmethod
+    def parse(message):
+        """拆分@nickname指令,返回(昵称, 其余内容);消息不以@开头时昵称为None
+
+        以@@开头的消息是转义,去掉一个@后作为普通内容,不切换agent。
+        """
+        if message.startswith('@@'):
+            return None, message[1:]
+        if not message.startswith('@'):
+            return None, message
+        parts = message.split(None, 1)
+        return parts[0][1:], parts[1] if len(parts) > 1 else ""
+
+    def resolve(self, nickname):
+        """返回昵称对应的agent名称,大小写完全一致的昵称优先,不存在时返回None"""
+        if nickname in self.agents:
+            return nickname
+        return self.names.get(nickname.lower())
+
+    def complete(self, prefix, limit=8):
+        """补全候选: 先按前缀匹配,不足limit个时补充模糊匹配"""
+        key = prefix.lower()
+        matches = []
+        for name in self.keys[bisect.bisect_left(self.keys, key):]:
+            if len(matches) >= limit or not name.startswith(key):
+                break
+            matches.append(name)
+        if key and len(matches) < limit:
+            matches += self.fuzzy(key, limit - len(matches), set(matches))
+        return [self.names[name] for name in matches]
+
+    def fuzzy(self, key, limit, exclude):
+        """模糊匹配: 输入是昵称的子序列(如"cr"匹配"code-review")优先,其次是拼写相近的昵称"""
+        scored = []
+        for name in self.keys:
+            if name in exclude:
+                continue
+            span = self.subsequence_span(key, name)
+            if span is not None:
+                # 匹配的字符越集中、越靠前越好
+                scored.append((span, name))
+        scored.sort()
+        matches = [name for _, name in scored[:limit]]
+        if len(matches) < limit:
+            candidates = [name for name in self.keys if name not in exclude and name not in matches]
+            matches += difflib.get_close_matches(key, candidates, n=limit - len(matches), cutoff=0.6)
+        return matches
+
+    @staticmethod
+    def subsequence_span(key, name):
+        """key按顺序出现在name中时返回(跨度, 起始位置),否则返回None"""
+        start = position = name.find(key[0])
+        if start < 0:
+            return None
+        for char in key[1:]:
+            position = name.find(char, position + 1)
+            if position < 0:
+                return None
+        return position - start, start
@@ -0,0 +1,128 @@
+import argparse
+import random
+import sys
+import time
+
+# 性能基准测试工具,可在Linux上运行,不需要图形界面:
+#   python src/benchmark.py hotkey
+#   python src/benchmark.py stream
+
+
+def synthetic_key_events(count, seed=0):
+    """生成模拟打字的按键事件序列: 字母按下/松开,偶尔夹杂修饰键组合"""
+    rng = random.Random(seed)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    events = []
+    while len(events) < count:
+        letter = rng.choice(letters)
+        if rng.random() < 0.05:
+            modifier = rng.choice(('ctrl', 'shift', 'alt'))
+            events.extend([(modifier, True), (letter, True), (letter, False), (modifier, False)])
+        else:
+            events.extend([(letter, True), (letter, False)])
+    return events[:count]
+
+
+def measure(handler, events, repeat=5):
+    """多次运行取最快的一次,返回每个事件的平均耗时(微秒)
+
+    handler带有flush()时计入等待后台线程处理完所有事件的时间。
+    """
+    flush = getattr(handler, 'flush', None)
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for name, down in events:
+            handler(name, down)
+        if flush is not None:
+            flush()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(events) * 1e6
+
+
+def bench_hotkey(args):
+    """测量各热键后端在每个按键事件上的Python处理开销"""
+    from hotkey_backends import BACKENDS
+
+    events = synthetic_key_events(args.events)
+    hits = []
+
+    def callback():
+        hits.append(1)
+
+    print(f"热键: {args.hotkey}, 模拟按键事件: {len(events)}")
+    baseline = measure(lambda name, down: None, events)
+    print(f"{'空函数调用(基准)':<20} {baseline:8.3f} us/事件")
+
+    for name, backend_class in BACKENDS.items():
+        backend = backend_class()
+        try:
+            handler = backend.benchmark_handler(args.hotkey, callback)
+        except Exception as e:
+            print(f"{name:<20} 不可用: {type(e).__name__}: {e}")
+            continue
+        if handler is None:
+            print(f"{name:<20} {'未测量':>8} (系统原生注册,普通按键不进入Python)")
+            continue
+        cost = measure(handler, events)
+        print(f"{name:<20} {cost:8.3f} us/事件 (扣除基准 {max(cost - baseline, 0):.3f} us), 热键触发 {len(hits)} 次")
+        hits.clear()
+
+
+def bench_stream(args):
+    """对比SDK流式解析与快速SSE解析的吞吐量,并校验两者输出一致"""
+    from openai import OpenAI
+    from chat_client import ChatClient
+    from diagnostics import MockChatServer
+
+    # 每块一个短片段,模拟本地高速端点每秒产出大量小块的情况
+    reply = "".join(f"词{i % 10}" for i in range(args.chunks))
+    server = MockChatServer(reply=reply, chunk_size=2)
+    messages = [{"role": "user", "content": "benchmark"}]
+    client = OpenAI(api_key="mock", base_url=server.base_url)
+
+    try:
+        results = {}
+        for name, fast_stream in (("SDK", False), ("快速SSE", True)):
+            chat_client = ChatClient(client, fast_stream=fast_stream)
+            best = None
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                response = chat_client.get_chat_completion(messages, "mock")
+                text = chat_client.process_stream_response(response, lambda text: None)
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            results[name] = (best, text)
+            print(f"{name:<10} {best * 1000:8.1f} ms, {args.chunks / best:10.0f} 块/秒")
+    finally:
+        server.close()
+
+    (sdk_time, sdk_text), (fast_time, fast_text) = results.values()
+    if sdk_text != fast_text:
+        print("输出不一致!")
+        return 1
+    print(f"输出一致, 快速路径加速 {sdk_time / fast_time:.2f} 倍")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="性能基准测试")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    hotkey_parser = subparsers.add_parser('hotkey', help="全局热键后端的逐键开销")
+    hotkey_parser.add_argument('--hotkey', default='alt+z')
+    hotkey_parser.add_argument('--events', type=int, default=200000)
+    hotkey_parser.set_defaults(func=bench_hotkey)
+
+    stream_parser = subparsers.add_parser('stream', help="流式响应解析吞吐量")
+    stream_parser.add_argument('--chunks', type=int, default=20000)
+    stream_parser.add_argument('--repeat', type=int, default=3)
+    stream_parser.set_defaults(func=bench_stream)
+
+    args = parser.parse_args()
+    return args.func(args) or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
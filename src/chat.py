@@ -1,20 +1,47 @@
-import wx
-from chat_frame import ChatFrame
+import sys
+import multiprocessing
 from logger_manager import LoggerManager
+from instance_server import forward_to_running_instance
 
 def main():
     # 初始化日志系统
     logger = LoggerManager.get_logger()
+    
+    # --diagnostics 开启内存诊断菜单, --watchdog 开启UI卡顿看门狗, --trace 开启请求追踪,其余参数作为问题内容
+    flags = {'--diagnostics', '--watchdog', '--trace'}
+    args = [arg for arg in sys.argv[1:] if arg not in flags]
+    diagnostics = '--diagnostics' in sys.argv[1:]
+    watchdog = '--watchdog' in sys.argv[1:]
+    trace = '--trace' in sys.argv[1:]
+    
+    # 已有实例在运行时,把参数转发给它后直接退出,避免重复加载wx和注册热键
+    if forward_to_running_instance(args):
+        logger.info("已将启动参数转发给正在运行的实例")
+        return
+    
     logger.info("=== 程序启动 ===")
     
+    # 仅在真正启动时才加载wx等较重的依赖
+    import wx
+    from chat_frame import ChatFrame
+    
     try:
         app = wx.App()
         logger.info("wxPython应用程序初始化成功")
         
-        frame = ChatFrame()
+        frame = ChatFrame(diagnostics=diagnostics, watchdog=watchdog, trace=trace)
+        
+        # 两个实例几乎同时启动时,启动前的转发检查都会失败,后完成初始化的实例转发给先启动的实例后退出
+        if not frame.instance_started and forward_to_running_instance(args):
+            logger.info("另一个实例已先启动,已将启动参数转发给它")
+            frame.force_exit(None)
+            return
+        
         frame.Show()
         logger.info("主窗口创建并显示成功")
         
+        frame.activate_from_args(args)
+        
         app.MainLoop()
     except Exception as e:
         logger.error(f"程序运行时发生错误: {str(e)}")
@@ -22,4 +49,6 @@ def main():
         logger.info("=== 程序退出 ===")
 
 if __name__ == '__main__':
+    # 打包后的程序在启动图片编码子进程时需要
+    multiprocessing.freeze_support()
     main()
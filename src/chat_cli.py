@@ -0,0 +1,42 @@
+import argparse
+import sys
+from instance_server import send_request
+
+# 轻量命令行客户端: 不加载wx/openai,把问题交给常驻实例处理并把回答流式输出到终端
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向正在运行的聊天程序发送问题")
+    parser.add_argument('prompt', nargs='*', help="问题内容,省略时从标准输入读取")
+    parser.add_argument('-a', '--agent', default='default', help="使用的agent昵称")
+    args = parser.parse_args()
+
+    prompt = ' '.join(args.prompt) if args.prompt else sys.stdin.read()
+    prompt = prompt.strip()
+    if not prompt:
+        parser.error("问题内容不能为空")
+
+    try:
+        for reply in send_request({'command': 'chat', 'prompt': prompt, 'agent': args.agent}):
+            if 'delta' in reply:
+                sys.stdout.write(reply['delta'])
+                sys.stdout.flush()
+            elif 'error' in reply:
+                sys.stderr.write(f"错误: {reply['error']}\n")
+                return 1
+            elif reply.get('done'):
+                break
+    except OSError:
+        sys.stderr.write("没有正在运行的聊天程序,请先运行 chat.py\n")
+        return 1
+    except ValueError as e:
+        # 端口文件或回复内容损坏
+        sys.stderr.write(f"无法与正在运行的聊天程序通信: {str(e)}\n")
+        return 1
+
+    sys.stdout.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
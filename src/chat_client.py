@@ -1,31 +1,244 @@
+import json
+import threading
 import time
+import openai
+from file_attachment import estimate_tokens
+from logger_manager import LoggerManager
+from tracing import Tracer
+
+def transport_errors():
+    """底层HTTP库的传输错误类型;不同版本的SDK分别基于httpx和httpx2"""
+    errors = ()
+    for module_name in ('httpx', 'httpx2'):
+        try:
+            errors += (__import__(module_name).TransportError,)
+        except ImportError:
+            pass
+    return errors
+
+
+# 流式接收过程中可以通过续写恢复的网络错误;SDK只包装发出请求时的错误,
+# 读取流的过程中传输错误(连接被重置、读取超时等)会原样抛出
+RESUMABLE_ERRORS = (openai.APIConnectionError,) + transport_errors()
+
+# 续写请求中追加的用户指令
+CONTINUE_PROMPT = "你的上一条回复因网络中断被截断,请从中断处直接继续输出,不要重复已输出的内容,也不要添加任何说明。"
+
+
+class StreamFailed(Exception):
+    """流式接收中途出错,text为本次已收到的内容"""
+
+    def __init__(self, error, text):
+        super().__init__(str(error))
+        self.text = text
+
+
+class StreamInterrupted(StreamFailed):
+    """流式接收中途断线,可以发起续写恢复"""
+
+
+def splice_continuation(partial, continuation, max_overlap=200, min_overlap=8):
+    """把续写内容拼接到部分回复之后,去掉续写开头与部分回复末尾重复的内容
+
+    只去掉恰好在断点处结束的重复: 重复的片段在部分回复末尾附近还出现在更早的位置时(本身就是重复的文本),
+    无法区分模型是在重复已输出的内容还是确实在继续输出相同的内容,此时保留全部续写,避免丢掉真实内容。
+    """
+    window = partial[-2 * max_overlap:]
+    for size in range(min(len(partial), len(continuation), max_overlap), min_overlap - 1, -1):
+        overlap = continuation[:size]
+        if partial.endswith(overlap):
+            if window.find(overlap) != len(window) - size:
+                break
+            return partial + continuation[size:]
+    return partial + continuation
+
+
+def parse_sse_delta(line):
+    """从一行SSE数据中只提取delta.content和usage,不构造SDK模型对象
+
+    返回(是否结束, 内容, 用量);非数据行或没有内容时内容为None,用量只在最后一块中出现。
+    """
+    if not line.startswith('data:'):
+        return False, None, None
+    payload = line[5:].strip()
+    if payload == '[DONE]':
+        return True, None, None
+    data = json.loads(payload)
+    if data.get('error'):
+        error = data['error']
+        raise RuntimeError(error.get('message', str(error)) if isinstance(error, dict) else str(error))
+    choices = data.get('choices')
+    if not choices:
+        return False, None, data.get('usage')
+    return False, (choices[0].get('delta') or {}).get('content'), data.get('usage')
+
+
+class FastStream:
+    """快速流式模式的响应: 迭代产出内容字符串和用量字典
+
+    读完、出错或调用close()时关闭HTTP响应;与生成器的finally不同,即使从未迭代,close()也会释放连接。
+    close()可以在另一个线程中调用,用于取消阻塞在读取上的请求。
+    """
+
+    def __init__(self, manager, chunks):
+        self.manager = manager
+        self.chunks = chunks
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.chunks)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        self.manager.__exit__(None, None, None)
+
 
 class ChatClient:
-    def __init__(self, openai_client):
+    def __init__(self, openai_client, fast_stream=False, stream_usage=False, max_resumes=2):
         self.client = openai_client
+        self.logger = LoggerManager.get_logger()
+        self.tracer = Tracer.get_tracer()
+        # 开启后流式请求直接解析HTTP的SSE数据,跳过SDK逐块构造模型对象
+        self.fast_stream = fast_stream
+        # 开启后流式请求要求服务端在最后一块中返回token用量
+        self.stream_usage = stream_usage
+        # 中途断线时最多发起的续写请求次数
+        self.max_resumes = max_resumes
         
-    def get_chat_completion(self, messages, model, stream=True):
-        """获取聊天完成结果"""
+    def create_completion(self, client, messages, model, stream):
+        """发起请求;快速流式模式下返回逐段产出内容字符串(及最后的用量字典)的生成器
+
+        服务端以400拒绝stream_options时去掉它重试一次,成功后之后的请求不再要求返回用量,改为本地估算。
+        """
+        if not (stream and self.stream_usage):
+            return self._create_completion(client, messages, model, stream, {})
         try:
-            return self.client.chat.completions.create(
+            return self._create_completion(
+                client, messages, model, stream, {'stream_options': {"include_usage": True}}
+            )
+        except openai.BadRequestError as e:
+            response = self._create_completion(client, messages, model, stream, {})
+            self.stream_usage = False
+            self.logger.warning(f"服务端不支持stream_options,之后的用量改为本地估算: {str(e)}")
+            return response
+            
+    def _create_completion(self, client, messages, model, stream, options):
+        if not (stream and self.fast_stream):
+            return client.chat.completions.create(
                 model=model,
                 messages=messages,
-                stream=stream
+                stream=stream,
+                **options
             )
-        except Exception as e:
-            return f"错误: {str(e)}"
+        manager = client.chat.completions.with_streaming_response.create(
+            model=model,
+            messages=messages,
+            stream=True,
+            **options
+        )
+        # 进入上下文时发出请求,连接错误和HTTP错误在这里抛出
+        raw_response = manager.__enter__()
+        return FastStream(manager, self.iter_fast_stream(raw_response))
+        
+    @staticmethod
+    def iter_fast_stream(raw_response):
+        """逐行读取SSE流并产出delta内容,用量以字典形式产出;响应由FastStream负责关闭"""
+        lines = raw_response.iter_lines()
+        while True:
+            try:
+                line = next(lines)
+            except StopIteration:
+                break
+            except Exception as e:
+                # 与SDK流一致,读取过程中的网络错误统一为APIConnectionError
+                raise openai.APIConnectionError(request=raw_response.http_request) from e
+            done, content, usage = parse_sse_delta(line)
+            if done:
+                break
+            if content is not None:
+                yield content
+            if usage:
+                yield usage
+            
+    def get_chat_completion(self, messages, model, stream=True, pool=None):
+        """获取聊天完成结果,传入pool时在多个端点间负载均衡并在连接失败时切换端点"""
+        with self.tracer.span("get_chat_completion", model=model, messages=len(messages)):
+            return self._get_chat_completion(messages, model, stream, pool)
             
-    def process_stream_response(self, response, message_callback):
-        """处理流式响应"""
+    def _get_chat_completion(self, messages, model, stream, pool):
+        if not pool:
+            try:
+                return self.create_completion(self.client, messages, model, stream)
+            except Exception as e:
+                return f"错误: {str(e)}"
+                
+        error = None
+        tried = set()
+        for _ in range(len(pool.endpoints)):
+            # 连接失败后换一个本次尚未尝试过的端点
+            endpoint = pool.acquire(exclude=tried)
+            tried.add(endpoint)
+            started = time.perf_counter()
+            try:
+                response = self.create_completion(endpoint.client, messages, model, stream)
+            except Exception as e:
+                pool.release(endpoint, error=True)
+                error = e
+                continue
+                
+            if stream:
+                return pool.track_stream(endpoint, response, started)
+            pool.report_first_token(endpoint, time.perf_counter() - started)
+            pool.release(endpoint)
+            return response
+        return f"错误: {str(error)}"
+            
+    @staticmethod
+    def iter_deltas(response):
+        """统一SDK流和快速流: 逐块产出(delta内容, 用量),两者都可能为None"""
+        for chunk in response:
+            if isinstance(chunk, str):
+                yield chunk, None
+            elif isinstance(chunk, dict):
+                yield None, chunk
+            else:
+                content = chunk.choices[0].delta.content if chunk.choices else None
+                yield content, getattr(chunk, 'usage', None)
+                
+    def read_stream(self, response, message_callback, cancel_event=None, usage_callback=None):
+        """读取流式响应,返回收到的全部内容
+
+        中途断线时抛出StreamInterrupted,其他错误抛出StreamFailed,两者都带上已收到的内容;
+        usage_callback(usage, text)在结束时调用一次,服务端未返回用量(如提前取消或中途出错)时usage为None,
+        text为已收到的部分内容,调用方据此估算。
+        """
+        usage = None
+        full_response = ""
+        tracer = self.tracer
         try:
-            full_response = ""
             buffer = ""
             last_update = time.time()
             update_interval = 0.1  # 100ms更新一次UI
             
-            for chunk in response:
-                if chunk.choices[0].delta.content is not None:
-                    content = chunk.choices[0].delta.content
+            for content, chunk_usage in self.iter_deltas(response):
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+                if chunk_usage:
+                    usage = chunk_usage
+                if content is not None:
+                    if tracer.enabled and not full_response:
+                        tracer.instant("first_token")
                     full_response += content
                     buffer += content
                     
@@ -33,14 +246,96 @@ class ChatClient:
                     current_time = time.time()
                     if current_time - last_update >= update_interval:
                         if buffer:
-                            message_callback(full_response)
+                            with tracer.span("stream_flush", chars=len(full_response)):
+                                message_callback(full_response)
                             buffer = ""
                             last_update = current_time
                             
             # 确保最后的内容被显示
             if buffer:
-                message_callback(full_response)
+                with tracer.span("stream_flush", chars=len(full_response)):
+                    message_callback(full_response)
                 
             return full_response
+        except RESUMABLE_ERRORS as e:
+            raise StreamInterrupted(e, full_response) from e
+        except Exception as e:
+            raise StreamFailed(e, full_response) from e
+        finally:
+            # 取消或出错时也关闭响应,释放连接和负载均衡池中的进行中计数
+            close = getattr(response, 'close', None)
+            if close is not None:
+                close()
+            if usage_callback is not None:
+                usage_callback(usage, full_response)
+                
+    def process_stream_response(self, response, message_callback, cancel_event=None, usage_callback=None):
+        """处理流式响应,cancel_event被设置时提前结束"""
+        try:
+            return self.read_stream(response, message_callback, cancel_event, usage_callback)
         except Exception as e:
             return f"错误: {str(e)}"
+            
+    def complete_with_resume(self, messages, model, message_callback, pool=None, cancel_event=None,
+                             usage_recorder=None, resume_callback=None, response_callback=None):
+        """发送请求并流式接收回复;中途断线时带上已收到的部分回复发起续写请求,拼接到同一条回复之后
+
+        usage_recorder(messages)返回记录每次请求用量的回调;
+        resume_callback(saved_tokens)在每次续写时调用,saved_tokens为无需重新生成的token数;
+        response_callback(response)在每次得到流式响应后调用,调用方可在取消时关闭它。
+        """
+        partial = ""
+        request_messages = messages
+        for attempt in range(self.max_resumes + 1):
+            if attempt and partial:
+                # 续写请求: 已收到的部分作为assistant消息,再要求从中断处继续
+                saved_tokens = estimate_tokens(partial)
+                self.logger.info(f"流式回复中断,第{attempt}次续写,已保留约 {saved_tokens} tokens")
+                if resume_callback is not None:
+                    resume_callback(saved_tokens)
+                request_messages = messages + [
+                    {"role": "assistant", "content": partial},
+                    {"role": "user", "content": CONTINUE_PROMPT}
+                ]
+                
+            response = self.get_chat_completion(request_messages, model, pool=pool)
+            if isinstance(response, str):
+                return self.keep_partial(partial, response, message_callback)
+            if response_callback is not None:
+                response_callback(response)
+                
+            def update(text, partial=partial, resuming=bool(partial)):
+                # 续写开头先攒够可能重复的长度再显示,避免已显示的内容被去重后回退
+                if resuming and len(text) < 200:
+                    return
+                message_callback(splice_continuation(partial, text))
+                
+            usage_callback = usage_recorder(request_messages) if usage_recorder else None
+            try:
+                text = self.read_stream(response, update, cancel_event, usage_callback)
+            except StreamFailed as e:
+                # 先保存本次已收到的内容,再区分是否可以续写
+                partial = splice_continuation(partial, e.text)
+                if cancel_event is not None and cancel_event.is_set():
+                    return partial
+                if not isinstance(e, StreamInterrupted):
+                    return self.keep_partial(partial, f"错误: {str(e)}", message_callback)
+                error = e
+                continue
+                
+            full_response = splice_continuation(partial, text)
+            if partial:
+                message_callback(full_response)
+            return full_response
+            
+        self.logger.error(f"续写{self.max_resumes}次后仍然中断: {str(error)}")
+        return self.keep_partial(partial, f"错误: {str(error)}", message_callback)
+        
+    @staticmethod
+    def keep_partial(partial, error, message_callback):
+        """请求失败时保留已收到的部分回复,并在末尾附上错误信息"""
+        if not partial:
+            return error
+        text = f"{partial}\n\n[{error}]"
+        message_callback(text)
+        return text
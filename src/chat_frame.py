@@ -1,28 +1,69 @@
 import wx
 import json
 import os
+import tempfile
 import threading
-from concurrent.futures import ThreadPoolExecutor
 from config_manager import ConfigManager
 from hotkey_manager import HotkeyManager
 from chat_client import ChatClient
 from message_panel import MessagePanel
-from ui import ChatTrayIcon, ConfigDialog, AgentConfigDialog
+from retrieval_index import RetrievalIndex
+from instance_server import InstanceServer
+from logger_manager import LoggerManager
+from diagnostics import MemoryDiagnostics
+from stall_watchdog import StallWatchdog
+from send_queue import SendQueue
+from image_attachment import ImageEncoder, is_image_file
+from file_attachment import FileAttachment, estimate_tokens, is_text_file, map_file_chunks
+from turn_tree import TurnTree, content_to_text, content_tokens
+from history_store import HistoryStore
+from usage_ledger import UsageLedger, usage_counts
+from tracing import Tracer
+from agent_index import AgentIndex
+from ui import ChatTrayIcon, ConfigDialog, AgentConfigDialog, AttachmentDropTarget
 
 class ChatFrame(wx.Frame):
-    def __init__(self):
+    def __init__(self, diagnostics=False, watchdog=False, trace=False):
         super().__init__(None, title="Quick Chat Launcher", size=(400, 600),
                         style=wx.DEFAULT_FRAME_STYLE)
         
+        self.logger = LoggerManager.get_logger()
+        
         # 初始化配置管理器
         self.config_manager = ConfigManager()
         self.config = self.config_manager.get_config()
         
+        # 请求生命周期追踪(通过--trace参数或配置开启),需要在创建热键和发送队列之前开启
+        self.tracer = Tracer.get_tracer()
+        tracing_config = self.config.get('tracing', {})
+        if trace or tracing_config.get('enabled', False):
+            self.tracer.start(tracing_config.get('dir', 'traces'))
+        
+        # 内存诊断(通过--diagnostics参数或配置开启)
+        self.memory_diagnostics = None
+        if diagnostics or self.config.get('diagnostics', {}).get('enabled', False):
+            self.memory_diagnostics = MemoryDiagnostics()
+            
+        # UI卡顿看门狗(通过--watchdog参数或配置开启)
+        self.stall_watchdog = StallWatchdog.from_config(self.config, wx.CallAfter, enabled=watchdog)
+        
+        # 待发送的附件,以及在后台进程池中编码图片的编码器
+        self.attachments = []
+        self.image_encoder = ImageEncoder()
+        # 尚未删除的临时附件文件,退出时清理(包括排队中被取消、未经发送的)
+        self.temp_attachments = set()
+        
+        # 有内存预算的历史存储,较早的轮次和屏幕外的消息文本写入磁盘(预算为0时不启用)
+        self.history_store = HistoryStore.from_config(self.config)
+        
         # 初始化UI
         self.InitUI()
         
-        # 创建线程池
-        self.thread_pool = ThreadPoolExecutor(max_workers=1)
+        # 创建发送队列,按顺序处理用户消息
+        self.send_queue = SendQueue(
+            self.async_send_message,
+            merge=self.config.get('send_queue', {}).get('merge_queued', False)
+        )
         
         # 创建系统托盘图标
         self.tray_icon = ChatTrayIcon(self)
@@ -41,14 +82,39 @@ class ChatFrame(wx.Frame):
         self.hotkey_manager = HotkeyManager(self.config, self.safe_toggle_window)
         self.hotkey_manager.setup_global_hotkey()
         
-        # 初始化聊天客户端
-        self.chat_client = ChatClient(self.config_manager.get_client())
+        # token用量账本(未启用时为None)
+        self.usage_ledger = UsageLedger.from_config(self.config)
         
-        # 初始化聊天历史
+        # 初始化聊天客户端
+        self.chat_client = ChatClient(
+            self.config_manager.get_client(),
+            fast_stream=self.config['openai'].get('fast_stream', False),
+            stream_usage=bool(self.usage_ledger) and self.config.get('usage', {}).get('stream_usage', True),
+            max_resumes=self.config['openai'].get('max_resumes', 2)
+        )
+        
+        # 初始化本地检索索引(未启用时为None)
+        self.retrieval_index = RetrievalIndex.from_config(self.config)
+        
+        # 启动单实例通信服务,供后续启动的实例和命令行客户端使用;
+        # 返回False表示另一个同时启动的实例已先占用了通信地址,由chat.py转发参数后退出
+        self.instance_server = InstanceServer()
+        self.instance_server.register('activate', self.handle_instance_activate)
+        self.instance_server.register('chat', self.handle_instance_chat)
+        self.instance_started = self.instance_server.start()
+        
+        # 事件循环开始运行后再启动看门狗,避免把启动过程误判为卡顿
+        if self.stall_watchdog:
+            wx.CallAfter(self.stall_watchdog.start)
+        
+        # 初始化聊天历史(以共享前缀的对话树保存,支持编辑后重新生成分支);
+        # 历史只在UI线程中修改,对话编号在新建对话时递增,之前提交的请求不再写入新的历史
         self.current_agent = "default"
-        self.chat_history = [
-            ("system", self.config['agents']['default']['role_system'])
-        ]
+        self.history = TurnTree(self.config['agents']['default']['role_system'], store=self.history_store)
+        self.conversation_id = 0
+        
+        # 正在编辑的历史轮次
+        self.editing_turn = None
 
         # 设置初始窗口位置为屏幕中央
         self.Center()
@@ -70,6 +136,10 @@ class ChatFrame(wx.Frame):
             
     def show_window(self):
         """显示窗口"""
+        with self.tracer.span("show_window"):
+            self._show_window()
+            
+    def _show_window(self):
         # 确保在主线程中执行
         self.Show(True)
         self.Raise()
@@ -94,15 +164,69 @@ class ChatFrame(wx.Frame):
         """最小化到系统托盘"""
         self.Hide()
         
+    def activate_from_args(self, args):
+        """根据命令行参数激活窗口,参数不为空时作为问题直接发送"""
+        self.show_window()
+        message = ' '.join(args).strip()
+        if message:
+            self.input_text.SetValue(message)
+            self.OnSend(None)
+            
+    def handle_instance_activate(self, request, reply):
+        """处理其他实例转发过来的启动参数"""
+        wx.CallAfter(self.activate_from_args, request.get('args', []))
+        reply({'ok': True})
+        
+    def handle_instance_chat(self, request, reply):
+        """处理命令行客户端的单轮提问,在连接线程中复用已建立的客户端流式回答"""
+        agent_name = request.get('agent', 'default')
+        if agent_name not in self.config['agents']:
+            reply({'error': f"未找到agent: {agent_name}"})
+            return
+        agent = self.config['agents'][agent_name]
+        allowed, warning = self.check_usage_budget(agent_name)
+        if not allowed:
+            reply({'error': warning})
+            return
+        messages = [
+            {"role": "system", "content": agent['role_system']},
+            {"role": "user", "content": request.get('prompt', '')}
+        ]
+        
+        pool = self.config_manager.get_endpoint_pool(agent_name)
+        sent_length = 0
+        def send_delta(text):
+            nonlocal sent_length
+            reply({'delta': text[sent_length:]})
+            sent_length = len(text)
+            
+        full_response = self.chat_client.complete_with_resume(
+            messages, agent['model'], send_delta, pool=pool,
+            usage_recorder=lambda messages: self.usage_recorder(agent_name, agent['model'], messages),
+            resume_callback=self.resume_recorder(agent_name, agent['model'])
+        )
+        if full_response.startswith("错误: ") and sent_length == 0:
+            reply({'error': full_response[len("错误: "):]})
+            return
+        reply({'done': True})
+        
     def force_exit(self, event):
         """强制退出程序"""
+        self.instance_server.close()
+        self.image_encoder.shutdown()
+        self.discard_attachments(list(self.temp_attachments))
+        if self.history_store:
+            self.history_store.close()
+        self.tracer.stop()
+        if self.stall_watchdog:
+            self.stall_watchdog.stop()
         self.hotkey_manager.cleanup()
         self.tray_icon.Destroy()
         self.Destroy()
         wx.GetApp().ExitMainLoop()
         
     def OnConfig(self, event):
-        dlg = ConfigDialog(self, self.config)
+        dlg = ConfigDialog(self, self.config, usage_ledger=self.usage_ledger)
         if dlg.ShowModal() == wx.ID_OK:
             self.config = self.config_manager.get_config()
             # 重新设置全局热键
@@ -111,114 +235,546 @@ class ChatFrame(wx.Frame):
 
     def OnAgentConfig(self, event):
         dlg = AgentConfigDialog(self, self.config)
-        if dlg.ShowModal() == wx.ID_OK:
-            self.config = self.config_manager.get_config()
-            # 重置聊天历史为当前agent的system role
-            self.chat_history = [
-                ("system", self.config['agents'][self.current_agent]['role_system'])
-            ]
+        result = dlg.ShowModal()
         dlg.Destroy()
+        # 对话框直接修改配置,取消时已做的增删改同样生效,因此无论结果如何都重建索引
+        self.config = self.config_manager.get_config()
+        self.config_manager.rebuild_agent_index()
+        # 当前agent被删除时回到default
+        agent_removed = self.current_agent not in self.config['agents']
+        if agent_removed:
+            self.current_agent = "default"
+        if result == wx.ID_OK or agent_removed:
+            # 重置聊天历史为当前agent的system role
+            self.reset_history()
+            self.conversation_id += 1
+        
+    def OnDiagnostics(self, event):
+        """显示内存诊断报告"""
+        # 只统计内存中的轮次,已写入磁盘的内容不读回
+        report = self.memory_diagnostics.report(self.history_panel, self.history.resident_messages())
+        if self.history_store:
+            report += f"\n\n历史存储: {self.history_store.stats_text()}"
+        wx.MessageBox(report, "内存诊断", wx.OK | wx.ICON_INFORMATION)
+        
+    def OnStallSummary(self, event):
+        """显示本次会话的UI卡顿汇总"""
+        wx.MessageBox(self.stall_watchdog.summary(), "卡顿统计", wx.OK | wx.ICON_INFORMATION)
         
     def OnClose(self, event):
         self.minimize_to_tray()
 
     def check_for_agent(self, message):
-        """检查消息是否包含@nickname指令"""
-        if message.startswith('@'):
-            parts = message.split(' ', 1)
-            nickname = parts[0][1:]  # 去掉@
-            if nickname in self.config['agents']:
-                self.current_agent = nickname
-                # 重置聊天历史
-                self.chat_history = [
-                    ("system", self.config['agents'][nickname]['role_system'])
-                ]
-                return parts[1] if len(parts) > 1 else ""
+        """解析@nickname指令,返回(其余内容, 要切换到的agent);不切换时agent为None"""
+        nickname, rest = AgentIndex.parse(message)
+        if nickname is None:
+            return rest, None
+        agent_name = self.config_manager.agent_index.resolve(nickname)
+        if agent_name is None:
+            # 与任何agent都不相近的@开头内容(或排队期间agent被删除)作为普通内容发送,保留当前agent和历史
+            self.logger.info(f"未找到agent: {nickname},作为普通内容发送给 {self.current_agent}")
+            return message, None
+        return rest, agent_name
+        
+    def validate_agent(self, message):
+        """发送前校验@nickname
+
+        未知昵称与某些agent相近时可能是拼错,提示候选并返回False,不会重置历史;
+        没有相近的agent时(如"@property 是什么")作为普通内容发送。以@@开头可强制按普通内容发送。
+        """
+        nickname, _ = AgentIndex.parse(message)
+        agent_index = self.config_manager.agent_index
+        if nickname is None or agent_index.resolve(nickname) is not None:
+            return True
+        suggestions = agent_index.complete(nickname, limit=3)
+        if not suggestions:
+            return True
+        self.history_panel.add_message(
+            "System",
+            f"未找到agent @{nickname}, 是否是: {', '.join('@' + name for name in suggestions)}"
+            f"\n如需发送以@开头的普通内容, 请以@@开头"
+        )
+        return False
+        
+    def update_agent_suggestions(self, event=None):
+        """输入@nickname时在输入框上方显示补全候选"""
+        if event is not None:
+            event.Skip()
+        # 每次输入都会触发,先只取前两个字符判断,不以@开头时不读取整个输入
+        head = self.input_text.GetRange(0, 2)
+        candidates = []
+        if head.startswith('@') and not head.startswith('@@'):
+            typed = self.input_text.GetRange(0, self.input_text.GetInsertionPoint())
+            if not any(char.isspace() for char in typed):
+                prefix = typed[1:]
+                candidates = self.config_manager.agent_index.complete(prefix)
+                if candidates == [prefix]:
+                    candidates = []
+        shown = bool(candidates)
+        if candidates:
+            self.agent_suggestions.Set(candidates)
+            self.agent_suggestions.SetSelection(0)
+        if shown != self.input_panel.GetSizer().IsShown(self.agent_suggestions):
+            self.input_panel.GetSizer().Show(self.agent_suggestions, shown)
+            self.input_panel.Layout()
+            self.Layout()
+            
+    def accept_agent_suggestion(self):
+        """用选中的候选替换输入中的@nickname"""
+        name = self.agent_suggestions.GetStringSelection()
+        _, rest = AgentIndex.parse(self.input_text.GetValue())
+        self.input_text.SetValue(f"@{name} {rest}")
+        self.input_text.SetInsertionPoint(len(name) + 2)
+        self.hide_agent_suggestions()
+        
+    def hide_agent_suggestions(self):
+        if self.input_panel.GetSizer().IsShown(self.agent_suggestions):
+            self.input_panel.GetSizer().Show(self.agent_suggestions, False)
+            self.input_panel.Layout()
+            self.Layout()
+
+    def check_usage_budget(self, agent_name):
+        """发送前检查agent的token预算,返回(是否允许发送, 提示文本)"""
+        if not self.usage_ledger:
+            return True, None
+        budget = self.config['agents'][agent_name].get('token_budget')
+        return self.usage_ledger.check_budget(agent_name, budget)
+        
+    def usage_recorder(self, agent_name, model, messages, base=None):
+        """返回记录本次请求用量的回调;服务端未返回用量时按请求和回复文本估算
+
+        base为(消息数, token数)时,messages的前这些条来自对话树,直接使用轮次上已算好的累计token数,
+        只对之后追加的消息(如续写请求带上的部分回复)单独估算。
+        """
+        if not self.usage_ledger:
+            return None
+        base_count, base_tokens = base or (0, 0)
+            
+        def record(usage, reply):
+            if usage:
+                self.usage_ledger.record(agent_name, model, *usage_counts(usage))
             else:
-                # 如果找不到指定的agent，使用default
-                self.current_agent = "default"
-                self.chat_history = [
-                    ("system", self.config['agents']['default']['role_system'])
-                ]
-        return message
+                # 取消或中途出错的流同样计入: 服务端已处理请求,按已收到的部分估算
+                prompt_tokens = base_tokens + sum(
+                    content_tokens(message['content']) for message in messages[base_count:]
+                )
+                self.usage_ledger.record(agent_name, model, prompt_tokens, estimate_tokens(reply), estimated=True)
+        return record
+        
+    def resume_recorder(self, agent_name, model):
+        """返回记录续写次数和节省token数的回调"""
+        if not self.usage_ledger:
+            return None
+        return lambda saved_tokens: self.usage_ledger.record_resume(agent_name, model, saved_tokens)
+        
+    def inject_retrieved_context(self, messages, query):
+        """检索过去对话中的相关片段,作为system消息插入到用户消息之前,返回插入内容的token估算"""
+        if not self.retrieval_index:
+            return 0
+        retrieval_config = self.config.get('retrieval', {})
+        max_chars = retrieval_config.get('max_snippet_chars', 500)
+        try:
+            results = self.retrieval_index.search(query, retrieval_config.get('top_k', 3))
+        except Exception as e:
+            self.logger.warning(f"检索历史对话失败: {str(e)}")
+            return 0
+        if not results:
+            return 0
+        snippets = "\n---\n".join(text[:max_chars] for _, text in results)
+        content = f"以下是过去对话中可能相关的内容,仅供参考:\n{snippets}"
+        messages.insert(len(messages) - 1, {"role": "system", "content": content})
+        return content_tokens(content)
+
+    def inline_file_text(self, attachment):
+        """返回可以整体作为上下文发送的文件文本;需要分段逐一请求时返回None
+
+        文件最多只读取一次,读到的文本直接用于构建消息。
+        """
+        file_config = self.config.get('file_attachments', {})
+        mode = file_config.get('mode', 'auto')
+        if mode != 'auto':
+            return None if mode == 'map' else attachment.read_text()
+        # 每个token至多约4字节,超过该大小的文件无需读取即可判定超出上下文预算
+        context_tokens = file_config.get('context_tokens', 8000)
+        if attachment.size > context_tokens * 4:
+            return None
+        text = attachment.read_text()
+        return text if estimate_tokens(text) <= context_tokens else None
+        
+    def build_user_content(self, message, attachments):
+        """构建用户消息内容,有附件时等待编码完成并组合为多段内容
+
+        返回(内容, 需要分段处理的文件附件列表)。
+        """
+        if not attachments:
+            return message, []
+        text = message
+        images = []
+        map_files = []
+        for attachment in attachments:
+            if isinstance(attachment, FileAttachment):
+                file_text = self.inline_file_text(attachment)
+                if file_text is None:
+                    map_files.append(attachment)
+                    text += f"\n\n[文件 {attachment.describe()} 已分段处理]"
+                else:
+                    text += f"\n\n以下是文件 {attachment.name} 的内容:\n{file_text}"
+            else:
+                images.append(attachment.result().to_content_part())
+        text = text.strip()
+        if not images:
+            return text, map_files
+        return ([{"type": "text", "text": text}] if text else []) + images, map_files
+
+    def map_file_attachments(self, attachments, question, history, agent_name, model, pool, message_callback,
+                             cancel_event):
+        """对需要分段的文件逐一执行分段请求,每段都带上之前的对话,返回合并后的回复"""
+        file_config = self.config.get('file_attachments', {})
+        finished = []
+        
+        def update(text):
+            message_callback("\n\n".join(finished + [text]))
+            
+        for attachment in attachments:
+            finished.append(map_file_chunks(
+                self.chat_client, attachment, question or "请总结这段内容", history, model, pool,
+                file_config.get('chunk_tokens', 2000), file_config.get('max_concurrency', 3),
+                update, cancel_event,
+                usage_recorder=lambda messages: self.usage_recorder(agent_name, model, messages),
+                resume_callback=self.resume_recorder(agent_name, model)
+            ))
+        return "\n\n".join(finished)
+
+    def discard_attachments(self, attachments):
+        """删除附件中由程序生成的临时文件"""
+        for attachment in attachments:
+            if isinstance(attachment, FileAttachment) and attachment.temporary:
+                attachment.cleanup()
+                self.temp_attachments.discard(attachment)
+
+    def call_in_ui(self, function, *args):
+        """在UI线程中执行function并等待返回值,供发送线程读写只在UI线程中修改的状态"""
+        done = threading.Event()
+        result = {}
+        def run():
+            try:
+                result['value'] = function(*args)
+            except Exception as e:
+                result['error'] = e
+            finally:
+                done.set()
+        wx.CallAfter(run)
+        done.wait()
+        if 'error' in result:
+            raise result['error']
+        return result['value']
+        
+    def set_message_value(self, message_text, text):
+        """在UI线程中更新消息文本和大小;面板已被清空(如新建对话)时忽略"""
+        if message_text:
+            message_text.SetValue(text)
+            self.history_panel.update_message_text_size(message_text, text)
+            
+    def reset_history(self):
+        """以当前agent的system role开始新的对话树;界面上保留的旧消息解除与旧轮次的关联,正在进行的编辑取消"""
+        self.history.reset(self.config['agents'][self.current_agent]['role_system'])
+        self.history_panel.unbind_turns()
+        if self.editing_turn is not None:
+            self.editing_turn = None
+            self.input_label.SetLabel(self.input_label_text)
+            
+    def append_user_turn(self, request, agent_name, content):
+        """在UI线程中切换agent并写入用户轮次,返回(轮次, 请求消息);对话已被重置时返回(None, None)"""
+        if request.conversation != self.conversation_id or request.cancelled:
+            return None, None
+        if agent_name is not None:
+            # 切换agent时重置历史
+            self.current_agent = agent_name
+            self.reset_history()
+        elif request.edit_of is not None and self.history.contains(request.edit_of):
+            # 编辑重发: 从被编辑轮次的上一轮开始新的分支;排队期间历史已被重置时作为新消息追加
+            self.history.rewind_to(request.edit_of.parent)
+        user_turn = self.history.append("user", content)
+        self.bind_turn([part.message_text for part in request.parts], user_turn)
+        return user_turn, self.history.messages()
+        
+    def append_assistant_turn(self, request, full_response):
+        """在UI线程中写入回复轮次;对话已被重置时丢弃"""
+        if request.conversation != self.conversation_id or request.cancelled:
+            return
+        assistant_turn = self.history.append("assistant", full_response)
+        self.bind_turn([request.reply_text], assistant_turn)
+        self.logger.debug(f"当前分支累计约 {self.history.tokens()} tokens")
+        # 将焦点移动到最新的回复
+        if request.reply_text:
+            request.reply_text.SetFocus()
+            
+    def async_send_message(self, request):
+        """在发送队列的工作线程中发送消息
 
-    def async_send_message(self, message):
-        """在后台线程中发送消息"""
+        回复显示在提交时创建的占位面板中;历史的修改通过CallAfter交给UI线程按顺序执行,
+        上一轮的回复总是先于下一条消息写入。
+        """
+        reply_text = request.reply_text
         try:
+            for part in request.parts[:-1]:
+                wx.CallAfter(self.set_message_value, part.reply_text, "(已与后续消息合并发送,回复见下方)")
+            wx.CallAfter(self.set_message_value, reply_text, "正在发送…")
+            
             # 检查是否有@nickname指令
-            message = self.check_for_agent(message)
-            if not message:
-                return "请输入消息内容"
-
-            # 构建包含历史记录的消息列表
-            messages = []
-            for msg in self.chat_history:
-                messages.append({"role": msg[0], "content": msg[1]})
-            messages.append({"role": "user", "content": message})
-            
-            # 在主线程中创建消息面板
-            message_text = None
-            def create_panel():
-                nonlocal message_text
-                message_text = self.history_panel.create_message_panel("AI")
-            wx.CallAfter(create_panel)
-            
-            # 等待面板创建完成
-            import time
-            time.sleep(0.1)
+            message, switch_agent = self.check_for_agent(request.message)
+            if not message and not request.attachments:
+                wx.CallAfter(self.set_message_value, reply_text, "(未发送: 请输入消息内容)")
+                return
+                
+            # 检查agent的token预算: 软限制只提示,硬限制不再发送
+            agent_name = switch_agent or self.current_agent
+            allowed, warning = self.check_usage_budget(agent_name)
+            if warning:
+                wx.CallAfter(self.history_panel.add_message, "System", warning)
+            if not allowed:
+                wx.CallAfter(self.set_message_value, reply_text, "(未发送: 超出token预算)")
+                return
+                
+            # 写入历史并构建请求,此时上一轮回复已经写入历史;共享前缀的各轮负载直接复用
+            content, map_files = self.build_user_content(message, request.attachments)
+            user_turn, messages = self.call_in_ui(self.append_user_turn, request, switch_agent, content)
+            if user_turn is None:
+                return
+            
+            # 从过去的对话中检索相关片段并注入提示;用量估算复用用户轮次上的累计token数
+            injected_tokens = self.inject_retrieved_context(messages, message)
+            prompt_base = (len(messages), user_turn.tokens + injected_tokens)
             
             # 使用当前agent的model
-            current_model = self.config['agents'][self.current_agent]['model']
+            current_model = self.config['agents'][agent_name]['model']
             
-            # 获取聊天完成结果
-            response = self.chat_client.get_chat_completion(messages, current_model)
+            pool = self.config_manager.get_endpoint_pool(agent_name)
             
             # 处理响应
             def update_message(text):
-                if message_text:
-                    wx.CallAfter(message_text.SetValue, text)
-                    wx.CallAfter(self.history_panel.update_message_text_size, message_text, text)
+                wx.CallAfter(self.set_message_value, reply_text, text)
                     
-            full_response = self.chat_client.process_stream_response(response, update_message)
-            return full_response
+            if map_files:
+                # 大文件逐段请求,每段都以之前的对话为前缀,结果按顺序合并
+                full_response = self.map_file_attachments(
+                    map_files, message, messages[:-1], agent_name, current_model, pool, update_message,
+                    request.cancel_event
+                )
+            else:
+                # 获取聊天完成结果,中途断线时自动续写到同一条消息中;取消时关闭正在接收的响应
+                full_response = self.chat_client.complete_with_resume(
+                    messages, current_model, update_message, pool=pool, cancel_event=request.cancel_event,
+                    usage_recorder=lambda request_messages: self.usage_recorder(
+                        agent_name, current_model, request_messages, prompt_base
+                    ),
+                    resume_callback=self.resume_recorder(agent_name, current_model),
+                    response_callback=request.attach_response
+                )
+            
+            # 已取消(如新建对话)时历史已被重置,不再写入
+            if request.cancelled:
+                return
+            wx.CallAfter(self.append_assistant_turn, request, full_response)
+            
+            # 把本轮问答加入检索索引
+            if self.retrieval_index and not full_response.startswith("错误: "):
+                self.retrieval_index.add_document(f"Q: {message}\nA: {full_response}")
             
         except Exception as e:
-            return f"错误: {str(e)}"
+            wx.CallAfter(self.history_panel.add_message, "System", f"错误: {str(e)}")
+        finally:
+            # 粘贴长文本生成的临时文件发送后即删除
+            self.discard_attachments(request.attachments)
 
+    def bind_turn(self, message_texts, turn):
+        """把界面上的消息与对话轮次关联,并更新分支序号"""
+        for message_text in message_texts:
+            if message_text:
+                message_text.turn = turn
+                self.update_branch_label(message_text)
+                
+    def update_branch_label(self, message_text):
+        """有多个分支时在发送者后显示当前分支序号"""
+        siblings = self.history.siblings(message_text.turn)
+        label = message_text.sender
+        if len(siblings) > 1:
+            label += f" ({siblings.index(message_text.turn) + 1}/{len(siblings)})"
+        self.history_panel.set_message_label(message_text, label)
+        
+    def begin_edit(self, message_text):
+        """把选中的历史用户消息放入输入框进行编辑"""
+        if not self.send_queue.is_idle():
+            self.history_panel.add_message("System", "正在生成回复,请稍后再编辑")
+            return
+        if not self.history.contains(message_text.turn):
+            return
+        self.editing_turn = message_text.turn
+        self.input_text.SetValue(content_to_text(self.editing_turn.content))
+        self.input_text.SetInsertionPointEnd()
+        self.input_label.SetLabel("编辑消息 (Enter重新生成, Esc取消编辑):")
+        self.input_text.SetFocus()
+        
+    def cancel_edit(self):
+        """取消编辑历史消息"""
+        self.editing_turn = None
+        self.input_text.SetValue("")
+        self.input_label.SetLabel(self.input_label_text)
+        
+    def switch_branch(self, message_text, offset):
+        """切换到相邻的兄弟分支,只重建两条分支不同的部分"""
+        turn = message_text.turn
+        if not self.history.contains(turn):
+            return
+        siblings = self.history.siblings(turn)
+        index = siblings.index(turn) + offset
+        if len(siblings) < 2 or not 0 <= index < len(siblings):
+            return
+        if not self.send_queue.is_idle():
+            self.history_panel.add_message("System", "正在生成回复,请稍后再切换分支")
+            return
+            
+        old_path = self.history.path()
+        self.history.switch_to(siblings[index])
+        new_path = self.history.path()
+        start = TurnTree.divergence(old_path, new_path)
+        
+        self.history_panel.remove_messages_from(old_path[start:])
+        first_text = None
+        for turn in new_path[start:]:
+            sender = "User" if turn.role == "user" else "AI"
+            text = content_to_text(turn.content)
+            message_text = self.history_panel.create_message_panel(sender)
+            message_text.SetValue(text)
+            self.history_panel.update_message_text_size(message_text, text)
+            self.bind_turn([message_text], turn)
+            first_text = first_text or message_text
+        if first_text:
+            first_text.SetFocus()
+            
     def OnSend(self, event):
+        with self.tracer.span("OnSend"):
+            self._send_input()
+            
+    def _send_input(self):
         message = self.input_text.GetValue().strip()
-        if not message:
+        if not message and not self.attachments:
             return
+        # 昵称不存在时保留输入内容,不发送也不重置历史
+        if not self.validate_agent(message):
+            return
+            
+        # 编辑历史消息时,先移除界面上从该轮开始的消息
+        edit_of = self.editing_turn
+        if edit_of is not None:
+            self.history_panel.remove_messages_from(self.history.path()[edit_of.depth:])
+            self.editing_turn = None
+            self.input_label.SetLabel(self.input_label_text)
             
-        # 显示用户消息
-        self.history_panel.add_message("User", message)
-        self.chat_history.append(("user", message))
+        # 显示用户消息和紧随其后的回复占位,写入历史由发送队列在轮到该消息时完成
+        display_text = "\n".join([message] + [f"[附件: {name}]" for name, _ in self.attachments]).strip()
+        message_text = self.history_panel.add_message("User", display_text)
+        reply_text = self.history_panel.create_message_panel("AI")
+        self.set_message_value(reply_text, "排队中…" if not self.send_queue.is_idle() else "正在发送…")
         self.input_text.SetValue("")
-        
-        def on_complete(future):
-            """处理异步调用完成"""
-            try:
-                ai_message = future.result()
-                self.chat_history.append(("assistant", ai_message))
-                # 将焦点移动到最新的消息文本框
-                if self.history_panel.latest_message_text:
-                    wx.CallAfter(self.history_panel.latest_message_text.SetFocus)
-            except Exception as e:
-                wx.CallAfter(self.history_panel.add_message, "System", f"错误: {str(e)}")
-        
-        # 在线程池中执行API调用
-        future = self.thread_pool.submit(self.async_send_message, message)
-        future.add_done_callback(on_complete)
+        self.send_queue.submit(
+            message, [attachment for _, attachment in self.attachments],
+            message_text=message_text, edit_of=edit_of,
+            reply_text=reply_text, conversation=self.conversation_id
+        )
+        # 附件已交给发送队列,临时文件在发送后删除
+        self.clear_attachments(discard=False)
+        
+    def attach_files(self, paths):
+        """添加拖放或粘贴的文件作为附件"""
+        model = self.config['agents'][self.current_agent]['model']
+        max_side = ImageEncoder.max_side_for_model(self.config, model)
+        folders = []
+        for path in paths:
+            if is_image_file(path):
+                self.add_attachment(os.path.basename(path), self.image_encoder.encode_file(path, max_side))
+            elif os.path.isdir(path):
+                folders.append(os.path.basename(os.path.normpath(path)))
+            elif os.path.isfile(path) and is_text_file(path):
+                # 文本文件只记录路径,发送时再通过内存映射分段读取
+                attachment = FileAttachment(path)
+                self.add_attachment(attachment.describe(), attachment)
+            else:
+                self.history_panel.add_message("System", f"不支持的附件类型: {os.path.basename(path)}")
+        if folders:
+            self.history_panel.add_message("System", f"不支持添加文件夹,已忽略: {', '.join(folders)}")
+                
+    def paste_from_clipboard(self):
+        """粘贴剪贴板中的图片、文件或超长文本,已处理时返回True"""
+        if not wx.TheClipboard.Open():
+            return False
+        try:
+            if wx.TheClipboard.IsSupported(wx.DataFormat(wx.DF_FILENAME)):
+                data = wx.FileDataObject()
+                wx.TheClipboard.GetData(data)
+                paths = data.GetFilenames()
+                if paths:
+                    self.attach_files(paths)
+                    return True
+            if wx.TheClipboard.IsSupported(wx.DataFormat(wx.DF_BITMAP)):
+                data = wx.BitmapDataObject()
+                wx.TheClipboard.GetData(data)
+                image = data.GetBitmap().ConvertToImage()
+                # 只在UI线程复制原始像素,缩放和编码交给进程池
+                model = self.config['agents'][self.current_agent]['model']
+                name = f"截图{len(self.attachments) + 1}.png"
+                future = self.image_encoder.encode_raw(
+                    name, image.GetWidth(), image.GetHeight(), bytes(image.GetData()),
+                    ImageEncoder.max_side_for_model(self.config, model)
+                )
+                self.add_attachment(name, future)
+                return True
+            if wx.TheClipboard.IsSupported(wx.DataFormat(wx.DF_UNICODETEXT)):
+                data = wx.TextDataObject()
+                wx.TheClipboard.GetData(data)
+                text = data.GetText()
+                # 超长文本转存为临时文件作为附件,避免输入框卡顿
+                if len(text) > self.config.get('file_attachments', {}).get('paste_threshold', 20000):
+                    with tempfile.NamedTemporaryFile('w', encoding='utf-8', suffix='.txt', delete=False) as f:
+                        f.write(text)
+                    attachment = FileAttachment(f.name, f"粘贴文本{len(self.attachments) + 1}.txt", temporary=True)
+                    self.temp_attachments.add(attachment)
+                    self.add_attachment(attachment.describe(), attachment)
+                    return True
+        finally:
+            wx.TheClipboard.Close()
+        return False
+        
+    def add_attachment(self, name, future):
+        """记录一个附件并更新附件提示"""
+        self.attachments.append((name, future))
+        self.update_attachment_label()
+        
+    def clear_attachments(self, event=None, discard=True):
+        """移除所有待发送的附件;discard为True时同时删除其中的临时文件"""
+        if discard:
+            self.discard_attachments([attachment for _, attachment in self.attachments])
+        self.attachments = []
+        self.update_attachment_label()
+        
+    def update_attachment_label(self):
+        """根据当前附件更新输入框上方的附件提示"""
+        names = ", ".join(name for name, _ in self.attachments)
+        self.attachment_label.SetLabel(f"📎 {names}")
+        self.input_sizer.Show(self.attachment_sizer, bool(self.attachments))
+        self.input_panel.Layout()
             
     def OnNew(self, event):
         """清空历史聊天记录"""
+        # 取消排队中和正在接收的消息
+        self.send_queue.cancel_all()
         self.history_panel.clear_history()
-        # 清空输入框
-        self.input_text.SetValue("")
-        # 重置聊天历史为当前agent的system role
-        self.chat_history = [
-            ("system", self.config['agents'][self.current_agent]['role_system'])
-        ]
+        # 清空输入框和附件
+        self.cancel_edit()
+        self.clear_attachments()
+        # 重置聊天历史为当前agent的system role,仍在进行的请求不再写入
+        self.reset_history()
+        self.conversation_id += 1
         # 更新布局
         self.UpdateLayout()
             
@@ -229,15 +785,15 @@ class ChatFrame(wx.Frame):
         # 处理Enter键
         if key_code == wx.WXK_RETURN:
             if event.ShiftDown():
-                # Shift+Enter: 插入换行
-                current_pos = self.input_text.GetInsertionPoint()
-                current_text = self.input_text.GetValue()
-                new_text = current_text[:current_pos] + '\n' + current_text[current_pos:]
-                self.input_text.SetValue(new_text)
-                self.input_text.SetInsertionPoint(current_pos + 1)
+                # Shift+Enter: 在光标处插入换行,不重新设置整个文本
+                self.input_text.WriteText('\n')
             else:
                 # Enter: 发送消息
                 self.OnSend(event)
+        elif event.ControlDown() and key_code == ord('V'):
+            # Ctrl+V: 优先粘贴图片、文件和超长文本,否则按普通文本粘贴
+            if not self.paste_from_clipboard():
+                event.Skip()
         else:
             event.Skip()
             
@@ -263,11 +819,39 @@ class ChatFrame(wx.Frame):
         """处理按键事件"""
         key_code = event.GetKeyCode()
         
-        # 处理 ESC 键
+        # 显示agent补全候选时: 上/下选择, Tab/Enter补全, Esc关闭
+        if self.input_panel.GetSizer().IsShown(self.agent_suggestions) and wx.Window.FindFocus() is self.input_text:
+            if key_code in (wx.WXK_UP, wx.WXK_DOWN):
+                count = self.agent_suggestions.GetCount()
+                offset = -1 if key_code == wx.WXK_UP else 1
+                self.agent_suggestions.SetSelection((self.agent_suggestions.GetSelection() + offset) % count)
+                return
+            if key_code in (wx.WXK_TAB, wx.WXK_RETURN) and not event.ShiftDown():
+                self.accept_agent_suggestion()
+                return
+            if key_code == wx.WXK_ESCAPE:
+                self.hide_agent_suggestions()
+                return
+                
+        # 处理 ESC 键: 编辑历史消息时取消编辑,否则最小化
         if key_code == wx.WXK_ESCAPE:
-            self.minimize_to_tray()
+            if self.editing_turn is not None:
+                self.cancel_edit()
+            else:
+                self.minimize_to_tray()
             return
             
+        # 焦点在已关联轮次的消息上时: F2编辑用户消息, Alt+左/右切换分支
+        focused = wx.Window.FindFocus()
+        turn = getattr(focused, 'turn', None)
+        if turn is not None:
+            if key_code == wx.WXK_F2 and turn.role == "user":
+                self.begin_edit(focused)
+                return
+            if event.AltDown() and key_code in (wx.WXK_LEFT, wx.WXK_RIGHT):
+                self.switch_branch(focused, -1 if key_code == wx.WXK_LEFT else 1)
+                return
+            
         # 处理 Ctrl+N 快捷键
         if event.ControlDown() and key_code == ord('N'):
             self.OnNew(event)
@@ -296,29 +880,55 @@ class ChatFrame(wx.Frame):
         fileMenu = wx.Menu()
         configItem = fileMenu.Append(-1, '配置(&S)')
         agentItem = fileMenu.Append(-1, '添加agent(&A)')
+        if self.memory_diagnostics:
+            diagnosticsItem = fileMenu.Append(-1, '内存诊断(&M)')
+            self.Bind(wx.EVT_MENU, self.OnDiagnostics, diagnosticsItem)
+        if self.stall_watchdog:
+            stallItem = fileMenu.Append(-1, '卡顿统计(&W)')
+            self.Bind(wx.EVT_MENU, self.OnStallSummary, stallItem)
         exitItem = fileMenu.Append(-1, '退出(&X)')
         menubar.Append(fileMenu, '文件(&F)')
         self.SetMenuBar(menubar)
         
         # 消息历史面板
-        self.history_panel = MessagePanel(panel)
+        self.history_panel = MessagePanel(
+            panel, store=self.history_store,
+            text_budget=int(self.config.get('history', {}).get('panel_budget_mb', 8) * 1024 * 1024)
+        )
         
         # 输入面板 - 固定高度
         self.input_panel = wx.Panel(panel)
         self.input_panel.SetMinSize((-1, 100))  # 固定输入面板高度为100像素
         input_sizer = wx.BoxSizer(wx.VERTICAL)  # 改为垂直布局以容纳标签
+        self.input_sizer = input_sizer
         
         # 创建标签和输入框的容器
         input_container = wx.BoxSizer(wx.HORIZONTAL)
         
         # 创建标签
-        input_label = wx.StaticText(self.input_panel, -1, "问题输入框 (Enter发送, Shift+Enter换行):")
+        self.input_label_text = "问题输入框 (Enter发送, Shift+Enter换行):"
+        self.input_label = wx.StaticText(self.input_panel, -1, self.input_label_text)
         
         # 创建输入框
         self.input_text = wx.TextCtrl(self.input_panel, style=wx.TE_MULTILINE)
         
         # 添加标签和输入框到容器
-        input_sizer.Add(input_label, 0, wx.EXPAND | wx.BOTTOM, 5)
+        input_sizer.Add(self.input_label, 0, wx.EXPAND | wx.BOTTOM, 5)
+        
+        # 附件提示和移除按钮,有附件时才显示
+        self.attachment_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        self.attachment_label = wx.StaticText(self.input_panel, -1, "")
+        clear_attachments_btn = wx.Button(self.input_panel, -1, '移除附件(&R)')
+        self.attachment_sizer.Add(self.attachment_label, 1, wx.ALIGN_CENTER_VERTICAL | wx.RIGHT, 5)
+        self.attachment_sizer.Add(clear_attachments_btn, 0)
+        input_sizer.Add(self.attachment_sizer, 0, wx.EXPAND | wx.BOTTOM, 5)
+        input_sizer.Show(self.attachment_sizer, False)
+        
+        # 输入@时显示的agent补全候选
+        self.agent_suggestions = wx.ListBox(self.input_panel, style=wx.LB_SINGLE)
+        self.agent_suggestions.SetMinSize((-1, 80))
+        input_sizer.Add(self.agent_suggestions, 0, wx.EXPAND | wx.BOTTOM, 5)
+        input_sizer.Show(self.agent_suggestions, False)
         
         # 创建按钮面板
         button_panel = wx.Panel(self.input_panel)
@@ -360,6 +970,12 @@ class ChatFrame(wx.Frame):
         self.send_btn.Bind(wx.EVT_BUTTON, self.OnSend)
         new_btn.Bind(wx.EVT_BUTTON, self.OnNew)
         self.input_text.Bind(wx.EVT_KEY_DOWN, self.OnKeyDown)
+        self.input_text.Bind(wx.EVT_TEXT, self.update_agent_suggestions)
+        self.agent_suggestions.Bind(wx.EVT_LISTBOX_DCLICK, lambda event: self.accept_agent_suggestion())
+        clear_attachments_btn.Bind(wx.EVT_BUTTON, self.clear_attachments)
+        
+        # 支持拖放图片和文本文件到输入框
+        self.input_text.SetDropTarget(AttachmentDropTarget(self))
         self.history_panel.Bind(wx.EVT_KEY_DOWN, self.OnHistoryKeyDown)
         
         # 绑定按键事件
@@ -1,11 +1,22 @@
 import json
 import os
+import threading
 from openai import OpenAI
+from endpoint_pool import Endpoint, EndpointPool
+from agent_index import AgentIndex
 
 class ConfigManager:
     def __init__(self):
         self.config = self.load_config()
         self.client = self.init_openai_client()
+        # 端点列表 -> 负载均衡池;api_key/base_url -> 端点,同一物理端点在所有池中共享健康统计
+        self.endpoint_pools = {}
+        self.endpoints = {}
+        # 发送线程和命令行请求线程可能同时获取池
+        self.endpoint_lock = threading.Lock()
+        # 所有池共用的锁,保护共享端点的统计数据
+        self.endpoint_health_lock = threading.Lock()
+        self.rebuild_agent_index()
         
     def load_config(self):
         """加载配置文件,如果不存在则创建默认配置"""
@@ -14,9 +25,12 @@ class ConfigManager:
                 'openai': {
                     'api_key': '',
                     'base_url': 'https://api.openai.com/v1',
+                    'fast_stream': False,
+                    'max_resumes': 2
                 },
                 'hotkeys': {
-                    'show_window': 'alt+z'
+                    'show_window': 'alt+z',
+                    'backend': 'auto'
                 },
                 'agents': {
                     'default': {
@@ -24,6 +38,50 @@ class ConfigManager:
                         'role_system': 'speak in chinese',
                         'model': 'openai/gpt-4-mini'
                     }
+                },
+                'retrieval': {
+                    'enabled': False,
+                    'top_k': 3,
+                    'max_snippet_chars': 500,
+                    'index_dir': 'retrieval_index'
+                },
+                'history': {
+                    'ram_budget_mb': 32,
+                    'panel_budget_mb': 8,
+                    'spill_dir': 'history_spill'
+                },
+                'usage': {
+                    'enabled': True,
+                    'stream_usage': True,
+                    'path': 'usage_ledger.json'
+                },
+                'tracing': {
+                    'enabled': False,
+                    'dir': 'traces'
+                },
+                'watchdog': {
+                    'enabled': False,
+                    'threshold_ms': 200,
+                    'interval_ms': 100
+                },
+                'diagnostics': {
+                    'enabled': False
+                },
+                'send_queue': {
+                    'merge_queued': False
+                },
+                'images': {
+                    'max_side': 1024,
+                    'model_max_side': {
+                        'openai/gpt-4o-mini': 2048
+                    }
+                },
+                'file_attachments': {
+                    'mode': 'auto',
+                    'context_tokens': 8000,
+                    'chunk_tokens': 2000,
+                    'max_concurrency': 3,
+                    'paste_threshold': 20000
                 }
             }
             with open('config.json', 'w', encoding='utf-8') as f:
@@ -40,6 +98,39 @@ class ConfigManager:
             base_url=self.config['openai']['base_url']
         )
         
+    def rebuild_agent_index(self):
+        """重建agent昵称索引,在加载配置和agent变化后调用"""
+        self.agent_index = AgentIndex(self.config['agents'])
+        
+    def get_endpoint_pool(self, agent_name):
+        """获取agent的多端点负载均衡池,未配置endpoints时返回None
+
+        agent的endpoints优先,其次是openai.endpoints。池按端点列表缓存,使用相同列表的agent共用一个池;
+        不同列表中相同api_key/base_url的端点也是同一个对象,首token耗时、错误率、进行中计数和剔除状态全局生效。
+        """
+        agent = self.config['agents'].get(agent_name, {})
+        endpoints = agent.get('endpoints') or self.config['openai'].get('endpoints')
+        if not endpoints:
+            return None
+            
+        key = json.dumps(endpoints, sort_keys=True)
+        with self.endpoint_lock:
+            pool = self.endpoint_pools.get(key)
+            if pool is None:
+                pool = EndpointPool(
+                    [self.get_endpoint(endpoint) for endpoint in endpoints], lock=self.endpoint_health_lock
+                )
+                self.endpoint_pools[key] = pool
+            return pool
+        
+    def get_endpoint(self, endpoint):
+        """按api_key/base_url复用端点及其OpenAI客户端,使各agent共享连接池和健康统计;在endpoint_lock内调用"""
+        key = (endpoint['api_key'], endpoint['base_url'])
+        if key not in self.endpoints:
+            client = OpenAI(api_key=endpoint['api_key'], base_url=endpoint['base_url'])
+            self.endpoints[key] = Endpoint(endpoint.get('name', endpoint['base_url']), client)
+        return self.endpoints[key]
+        
     def save_config(self):
         """保存配置到文件"""
         with open('config.json', 'w', encoding='utf-8') as f:
@@ -57,4 +148,5 @@ class ConfigManager:
         """更新配置"""
         self.config = new_config
         self.client = self.init_openai_client()
+        self.rebuild_agent_index()
         self.save_config()
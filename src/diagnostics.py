@@ -0,0 +1,269 @@
+import argparse
+import gc
+import json
+import sys
+import threading
+import tracemalloc
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logger_manager import LoggerManager
+
+
+class MemoryDiagnostics:
+    """长时间运行时的内存诊断: 控件数量、聊天历史大小和tracemalloc快照对比"""
+
+    def __init__(self, top_n=10):
+        self.top_n = top_n
+        self.logger = LoggerManager.get_logger()
+        self.last_snapshot = None
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.logger.info("已启动tracemalloc内存跟踪")
+
+    @staticmethod
+    def count_widgets(window):
+        """递归统计窗口下仍存活的子控件数量,按类型分组"""
+        counts = {}
+        stack = list(window.GetChildren())
+        while stack:
+            child = stack.pop()
+            name = type(child).__name__
+            counts[name] = counts.get(name, 0) + 1
+            stack.extend(child.GetChildren())
+        return counts
+
+    @staticmethod
+    def history_size(chat_history):
+        """估算聊天历史占用的字节数(包含容器本身)"""
+        total = sys.getsizeof(chat_history)
+        stack = list(chat_history)
+        while stack:
+            item = stack.pop()
+            total += sys.getsizeof(item)
+            if isinstance(item, (tuple, list)):
+                stack.extend(item)
+            elif isinstance(item, dict):
+                stack.extend(item.keys())
+                stack.extend(item.values())
+        return total
+
+    @staticmethod
+    def count_closures(prefix):
+        """统计限定名以prefix开头、仍然存活的函数对象(如发送消息时创建的闭包)"""
+        return sum(
+            1 for obj in gc.get_objects()
+            if isinstance(obj, types.FunctionType) and obj.__qualname__.startswith(prefix)
+        )
+
+    def snapshot_diff(self):
+        """拍摄新的快照并与上一次对比,返回增长最多的前N项"""
+        gc.collect()
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        previous, self.last_snapshot = self.last_snapshot, snapshot
+        if previous is None:
+            return []
+        return snapshot.compare_to(previous, 'lineno')[:self.top_n]
+
+    def report(self, message_panel, chat_history):
+        """生成诊断报告文本并写入日志"""
+        widgets = self.count_widgets(message_panel)
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [
+            f"消息面板控件: {sum(widgets.values())} 个 "
+            + ", ".join(f"{name}={count}" for name, count in sorted(widgets.items())),
+            f"聊天历史(内存中): {len(chat_history)} 条, {self.history_size(chat_history)} 字节",
+            f"存活的发送闭包: {self.count_closures('ChatFrame.async_send_message.<locals>')} 个",
+            f"tracemalloc: 当前 {current / 1024:.1f} KB, 峰值 {peak / 1024:.1f} KB",
+        ]
+
+        diff = self.snapshot_diff()
+        if diff:
+            lines.append(f"与上次快照相比增长最多的 {len(diff)} 项:")
+            lines.extend(f"  {stat}" for stat in diff)
+        else:
+            lines.append("已记录基准快照,再次生成报告时显示增长对比")
+
+        text = "\n".join(lines)
+        self.logger.info(f"内存诊断报告:\n{text}")
+        return text
+
+
+class MockChatServer:
+    """本地模拟的OpenAI兼容流式接口,用于诊断和基准测试"""
+
+    def __init__(self, reply="这是一条用于测试的模拟回复。" * 20, chunk_size=4, reject_stream_options=False):
+        chunks = [reply[i:i + chunk_size] for i in range(0, len(reply), chunk_size)]
+        self.body = self.build_sse_body(chunks)
+        # 模拟不支持stream_options的兼容服务端,收到时返回400
+        self.reject_stream_options = reject_stream_options
+        self.requests = []
+
+        body = self.body
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                server.requests.append(request)
+                if server.reject_stream_options and 'stream_options' in request:
+                    error = json.dumps({"error": {"message": "Unrecognized request argument: stream_options"}})
+                    self.send_response(400)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(error)))
+                    self.end_headers()
+                    self.wfile.write(error.encode('utf-8'))
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @staticmethod
+    def build_sse_body(chunks):
+        """把文本片段编码为chat.completion.chunk格式的SSE响应体"""
+        events = []
+        for content in chunks:
+            chunk = {
+                "id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": 0, "model": "mock",
+                "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": None}]
+            }
+            events.append(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+        # 与开启stream_options.include_usage时相同,最后一块没有choices,只带用量
+        usage = {
+            "id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": 0, "model": "mock",
+            "choices": [],
+            "usage": {
+                "prompt_tokens": 10, "completion_tokens": len(chunks), "total_tokens": 10 + len(chunks),
+                "prompt_tokens_details": {"cached_tokens": 0}
+            }
+        }
+        events.append(f"data: {json.dumps(usage)}\n\n")
+        events.append("data: [DONE]\n\n")
+        return "".join(events).encode('utf-8')
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def run_soak(cycles, turns_per_cycle=5, warmup=5, max_growth_kb=256, timeout=30):
+    """通过真实的ChatFrame对模拟服务反复执行发送/新建对话循环,内存持续增长或有对象未释放时返回False
+
+    在临时目录中生成指向模拟服务的配置,消息与界面操作相同地经输入框、OnSend、发送队列和
+    async_send_message发出;每轮最后一条消息在接收过程中直接新建对话(OnNew)取消。
+    每轮结束后检查残留的消息控件、发送闭包和发送队列中的请求。窗口不显示,也不注册全局热键。
+    """
+    import os
+    import shutil
+    import tempfile
+    import time
+    import wx
+    from config_manager import ConfigManager
+
+    logger = LoggerManager.get_logger()
+    server = MockChatServer()
+    app = wx.GetApp() or wx.App(False)
+    previous_dir = os.getcwd()
+    work_dir = tempfile.mkdtemp(prefix="chat_soak_")
+    os.chdir(work_dir)
+    frame = None
+    leaks = {'widgets': 0, 'closures': 0, 'requests': 0}
+    tracemalloc.start()
+
+    try:
+        # 默认配置只修改服务地址和模型,其余功能(历史存储、用量统计等)与正常运行一致
+        config_manager = ConfigManager()
+        config = config_manager.get_config()
+        config['openai'].update(api_key="mock", base_url=server.base_url)
+        for agent in config['agents'].values():
+            agent['model'] = "mock"
+        config_manager.save_config()
+
+        from chat_frame import ChatFrame
+        frame = ChatFrame()
+        frame.hotkey_manager.cleanup()
+
+        def wait_idle():
+            # 没有主循环,手动处理工作线程通过CallAfter提交的界面和历史更新
+            deadline = time.monotonic() + timeout
+            while not frame.send_queue.is_idle():
+                if time.monotonic() > deadline:
+                    raise TimeoutError("等待模拟回复超时")
+                app.ProcessPendingEvents()
+                time.sleep(0.002)
+            app.ProcessPendingEvents()
+
+        def send(text):
+            frame.input_text.SetValue(text)
+            frame.OnSend(None)
+
+        def run_cycle():
+            for turn in range(turns_per_cycle):
+                send(f"第{turn}个问题")
+                wait_idle()
+            send("接收过程中被取消的问题")
+            frame.OnNew(None)
+            wait_idle()
+            gc.collect()
+            queue = frame.send_queue
+            leaks['widgets'] = max(leaks['widgets'], sum(MemoryDiagnostics.count_widgets(frame.history_panel).values()))
+            leaks['closures'] = max(
+                leaks['closures'], MemoryDiagnostics.count_closures('ChatFrame.async_send_message.<locals>')
+            )
+            leaks['requests'] = max(leaks['requests'], len(queue.pending) + (queue.current is not None))
+
+        for _ in range(warmup):
+            run_cycle()
+        gc.collect()
+        baseline = tracemalloc.take_snapshot()
+        start_memory = tracemalloc.get_traced_memory()[0]
+
+        for _ in range(cycles):
+            run_cycle()
+        gc.collect()
+        growth = tracemalloc.get_traced_memory()[0] - start_memory
+        top_stats = tracemalloc.take_snapshot().compare_to(baseline, 'lineno')[:10]
+    finally:
+        tracemalloc.stop()
+        if frame is not None:
+            frame.force_exit(None)
+            app.ProcessPendingEvents()
+        server.close()
+        os.chdir(previous_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    logger.info(
+        f"内存浸泡测试: {cycles} 轮, 内存增长 {growth / 1024:.1f} KB, 新建对话后残留控件 {leaks['widgets']} 个, "
+        f"发送闭包 {leaks['closures']} 个, 发送请求 {leaks['requests']} 个"
+    )
+    for stat in top_stats:
+        logger.debug(f"  {stat}")
+    return growth <= max_growth_kb * 1024 and not any(leaks.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="内存诊断工具")
+    parser.add_argument('--soak', type=int, metavar='N', required=True, help="执行N轮发送/清空循环")
+    parser.add_argument('--max-growth-kb', type=int, default=256, help="允许的最大内存增长(KB)")
+    args = parser.parse_args()
+
+    if not run_soak(args.soak, max_growth_kb=args.max_growth_kb):
+        print("内存浸泡测试失败: 内存持续增长或清空后仍有消息控件未释放")
+        return 1
+    print("内存浸泡测试通过")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,168 @@
+import threading
+import time
+from logger_manager import LoggerManager
+
+
+class Endpoint:
+    """一个可用的api_key/base_url组合及其实时健康统计"""
+
+    def __init__(self, name, client):
+        self.name = name
+        self.client = client
+        self.ttft = None          # 首token耗时的指数加权平均(秒)
+        self.error_rate = 0.0     # 错误率的指数加权平均
+        self.in_flight = 0        # 正在进行的请求数
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0  # 被暂时剔除的截止时间
+        self.probing = False      # 剔除到期后是否正在进行探测请求
+
+    def describe(self):
+        ttft = f"{self.ttft * 1000:.0f}ms" if self.ttft is not None else "-"
+        return (f"{self.name}: ttft={ttft}, 错误率={self.error_rate:.2f}, "
+                f"进行中={self.in_flight}, 请求={self.requests}, 失败={self.failures}")
+
+
+class EndpointPool:
+    """按实时健康状况在多个等价端点之间做最低延迟负载均衡
+
+    得分综合首token耗时、错误率和进行中的请求数;连续失败的端点被暂时剔除,
+    到期后只放行一个探测请求,成功后重新加入。
+    """
+
+    def __init__(self, endpoints, alpha=0.3, error_penalty=5.0, eject_after=3, eject_seconds=30, stats_every=20,
+                 lock=None):
+        self.endpoints = endpoints
+        self.alpha = alpha
+        self.error_penalty = error_penalty
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.stats_every = stats_every
+        self.logger = LoggerManager.get_logger()
+        # 多个池共享同一批Endpoint对象时应传入同一把锁,保护端点的统计数据
+        self.lock = lock or threading.Lock()
+        self.total_requests = 0
+
+    def _score(self, endpoint):
+        """得分越低越优先;没有统计数据的端点优先尝试"""
+        ttft = endpoint.ttft if endpoint.ttft is not None else 0.0
+        return ttft * (1 + endpoint.in_flight) + endpoint.error_rate * self.error_penalty + endpoint.in_flight * 0.01
+
+    def acquire(self, exclude=()):
+        """选择当前最优的端点,exclude中的端点(同一请求已尝试失败的)不再选择"""
+        with self.lock:
+            now = time.monotonic()
+            available = [endpoint for endpoint in self.endpoints if endpoint not in exclude] or self.endpoints
+            candidates = []
+            for endpoint in available:
+                if endpoint.ejected_until > now:
+                    continue
+                if endpoint.ejected_until and endpoint.probing:
+                    continue
+                candidates.append(endpoint)
+
+            if not candidates:
+                # 全部被剔除时选择最早到期的端点,而不是直接失败
+                candidates = [min(available, key=lambda e: e.ejected_until)]
+
+            endpoint = min(candidates, key=self._score)
+            if endpoint.ejected_until:
+                endpoint.probing = True
+                self.logger.info(f"探测被剔除的端点: {endpoint.name}")
+
+            endpoint.in_flight += 1
+            endpoint.requests += 1
+            self.total_requests += 1
+            self.logger.debug(
+                "端点路由: 选择 " + endpoint.name + " ("
+                + ", ".join(f"{e.name}={self._score(e):.3f}" for e in candidates) + ")"
+            )
+            return endpoint
+
+    def report_first_token(self, endpoint, ttft):
+        """记录首token耗时"""
+        with self.lock:
+            if endpoint.ttft is None:
+                endpoint.ttft = ttft
+            else:
+                endpoint.ttft += self.alpha * (ttft - endpoint.ttft)
+
+    def release(self, endpoint, error=False):
+        """请求结束,更新错误率并处理剔除/恢复"""
+        with self.lock:
+            endpoint.in_flight -= 1
+            endpoint.error_rate += self.alpha * ((1.0 if error else 0.0) - endpoint.error_rate)
+
+            if error:
+                endpoint.failures += 1
+                endpoint.consecutive_failures += 1
+                if endpoint.probing or endpoint.consecutive_failures >= self.eject_after:
+                    endpoint.ejected_until = time.monotonic() + self.eject_seconds
+                    self.logger.warning(f"端点暂时剔除 {self.eject_seconds} 秒: {endpoint.describe()}")
+            else:
+                endpoint.consecutive_failures = 0
+                if endpoint.ejected_until:
+                    self.logger.info(f"端点探测成功,重新加入: {endpoint.name}")
+                endpoint.ejected_until = 0.0
+            endpoint.probing = False
+
+            if self.total_requests % self.stats_every == 0:
+                self.logger.info(f"端点统计:\n{self.stats_text()}")
+
+    def stats_text(self):
+        """返回所有端点的统计信息"""
+        return "\n".join(endpoint.describe() for endpoint in self.endpoints)
+
+    def track_stream(self, endpoint, response, started):
+        """包装流式响应,在迭代过程中记录首token耗时和请求结果"""
+        return TrackedStream(self, endpoint, response, started)
+
+
+class TrackedStream:
+    """流式响应的包装: 读完、出错或调用close()时释放端点,且只释放一次
+
+    与生成器不同,即使从未迭代,close()也会释放端点的进行中计数并关闭底层响应。
+    """
+
+    def __init__(self, pool, endpoint, response, started):
+        self.pool = pool
+        self.endpoint = endpoint
+        self.response = response
+        self.iterator = iter(response)
+        self.started = started
+        self.first_token = True
+        self.released = False
+        # 取消时close()可能在另一个线程中与读取线程同时调用
+        self.lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self.iterator)
+        except StopIteration:
+            self._release(error=False)
+            raise
+        except Exception:
+            self._release(error=True)
+            raise
+        if self.first_token:
+            self.pool.report_first_token(self.endpoint, time.perf_counter() - self.started)
+            self.first_token = False
+        return chunk
+
+    def _release(self, error):
+        with self.lock:
+            if self.released:
+                return
+            self.released = True
+        self.pool.release(self.endpoint, error=error)
+
+    def close(self):
+        """提前结束(取消或未读取)时释放端点并关闭底层响应"""
+        self._release(error=False)
+        close = getattr(self.response, 'close', None)
+        if close is not None:
+            close()
@@ -0,0 +1,163 @@
+import codecs
+import mmap
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from logger_manager import LoggerManager
+from tracing import Tracer
+
+
+def estimate_tokens(text):
+    """粗略估算token数: 中日韩等宽字符按1个token,其余按4个字符1个token"""
+    # UTF-8中宽字符占3字节,用编码后的长度差在C层面统计,避免逐字符循环
+    wide = (len(text.encode('utf-8')) - len(text)) // 2
+    return wide + (len(text) - wide) // 4 + 1
+
+
+def format_size(size):
+    """格式化文件大小"""
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def is_text_file(path, sample_size=8192):
+    """根据文件开头判断是否为文本文件: 含NUL字节或不是有效的UTF-8时视为二进制"""
+    with open(path, 'rb') as f:
+        sample = f.read(sample_size)
+    if b'\0' in sample:
+        return False
+    try:
+        # 增量解码,允许样本末尾截断的多字节字符
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+class FileAttachment:
+    """文本文件附件,通过内存映射读取并按token上限分段
+
+    temporary为True表示文件是程序生成的临时文件(如粘贴的超长文本),发送或移除后调用cleanup删除。
+    """
+
+    def __init__(self, path, name=None, temporary=False):
+        self.path = path
+        self.name = name or os.path.basename(path)
+        self.size = os.path.getsize(path)
+        self.temporary = temporary
+
+    def describe(self):
+        return f"{self.name} ({format_size(self.size)})"
+
+    def cleanup(self):
+        """删除临时文件,普通文件不受影响"""
+        if not self.temporary:
+            return
+        self.temporary = False
+        try:
+            os.remove(self.path)
+        except OSError as e:
+            LoggerManager.get_logger().warning(f"删除临时附件失败: {str(e)}")
+
+    def read_text(self):
+        """读取完整文本"""
+        return "".join(self.iter_chunks(1 << 20))
+
+    def iter_chunks(self, max_tokens):
+        """按token上限逐段产出文本,尽量在换行处切分"""
+        if self.size == 0:
+            return
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 0
+            while start < self.size:
+                end = min(start + max_tokens * 4, self.size)
+                while True:
+                    cut = self._find_cut(mm, start, end)
+                    text = mm[start:cut].decode('utf-8', errors='replace')
+                    tokens = estimate_tokens(text)
+                    if tokens <= max_tokens or cut - start <= 64:
+                        break
+                    # 超出上限时按比例缩小范围后重新切分
+                    end = start + max(64, (cut - start) * max_tokens // tokens)
+                yield text
+                start = cut
+
+    def _find_cut(self, mm, start, end):
+        """在[start, end)内寻找切分位置: 优先换行,其次UTF-8字符边界"""
+        if end >= self.size:
+            return self.size
+        newline = mm.rfind(b'\n', start, end)
+        if newline > start:
+            return newline + 1
+        while end > start + 1 and (mm[end] & 0xC0) == 0x80:
+            end -= 1
+        return end
+
+
+def map_file_chunks(chat_client, attachment, question, history, model, pool,
+                    chunk_tokens, max_concurrency, message_callback, cancel_event=None, usage_recorder=None,
+                    resume_callback=None):
+    """把文件各段分别发送请求,并发数有上限;各段结果按顺序合并后流式回调,返回合并结果
+
+    history为本轮之前的对话消息(以system消息开头),每段请求都以它为前缀,使回答能结合上下文;
+    usage_recorder和resume_callback的含义与ChatClient.complete_with_resume相同。
+    """
+    logger = LoggerManager.get_logger()
+    tracer = Tracer.get_tracer()
+    results = []
+    lock = threading.Lock()
+    # 同时在途的段数不超过并发上限,避免把整个大文件一次性读入内存
+    slots = threading.Semaphore(max_concurrency)
+
+    def render():
+        with lock:
+            text = "\n\n".join(
+                f"【{attachment.name} 第{index + 1}段】\n{result if result is not None else '处理中...'}"
+                for index, result in enumerate(results)
+            )
+        message_callback(text)
+
+    def run(index, chunk, trace_id):
+        if trace_id is not None:
+            tracer.async_end("file_chunk_wait", trace_id)
+        try:
+            messages = history + [
+                {"role": "user", "content": f"{question}\n\n以下是文件 {attachment.name} 的第{index + 1}段:\n{chunk}"}
+            ]
+            def update(text):
+                results[index] = text
+                render()
+            result = chat_client.complete_with_resume(
+                messages, model, update, pool=pool, cancel_event=cancel_event,
+                usage_recorder=usage_recorder, resume_callback=resume_callback
+            )
+            results[index] = result
+            render()
+        except Exception as e:
+            results[index] = f"错误: {str(e)}"
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        for index, chunk in enumerate(attachment.iter_chunks(chunk_tokens)):
+            slots.acquire()
+            if cancel_event is not None and cancel_event.is_set():
+                slots.release()
+                break
+            with lock:
+                results.append(None)
+            trace_id = None
+            if tracer.enabled:
+                trace_id = tracer.new_id()
+                tracer.async_begin("file_chunk_wait", trace_id, index=index)
+            executor.submit(run, index, chunk, trace_id)
+
+    logger.info(f"文件 {attachment.name} 已分 {len(results)} 段处理完成")
+    render()
+    with lock:
+        return "\n\n".join(
+            f"【{attachment.name} 第{index + 1}段】\n{result or ''}" for index, result in enumerate(results)
+        )
@@ -0,0 +1,226 @@
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+from logger_manager import LoggerManager
+
+
+def content_size(content):
+    """估算消息内容在内存中占用的字节数"""
+    if isinstance(content, str):
+        return sys.getsizeof(content)
+    size = 0
+    for part in content:
+        if part['type'] == 'text':
+            size += sys.getsizeof(part['text'])
+        else:
+            size += sys.getsizeof(part['image_url']['url'])
+    return size
+
+
+class HistoryStore:
+    """有内存预算的对话内容存储
+
+    最近使用的轮次保留在内存中(LRU),超出预算时把最久未用的轮次写入只追加的磁盘文件并释放,
+    再次访问时按记录编号读回。轮次内容创建后不再改变,因此每个轮次最多写入一次。
+    文件只作为本进程的内存溢出区,放在spill目录下以进程号命名,关闭时删除;
+    对话重置或消息移除后失效的记录超过阈值时,把仍有效的记录复制到新文件,回收磁盘空间。
+    """
+
+    def __init__(self, directory, budget_bytes, compact_min_bytes=4 * 1024 * 1024):
+        self.directory = directory
+        self.budget_bytes = budget_bytes
+        self.compact_min_bytes = compact_min_bytes
+        self.logger = LoggerManager.get_logger()
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.generation = 0
+        self.path = self.spill_path(self.generation)
+        self.file = open(self.path, 'w+b')
+        self.end = 0
+        # 记录编号 -> (偏移, 长度);压缩时只改这里的位置,持有编号的轮次和消息不受影响
+        self.records = {}
+        self.next_record = 0
+        self.live_bytes = 0
+        # 属于当前对话树轮次的记录,对话树重置时一起失效
+        self.turn_records = set()
+        # 内存中的轮次,按最近使用排序
+        self.hot = OrderedDict()
+        self.hot_bytes = 0
+        self.spills = 0
+        self.loads = 0
+        self.compactions = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """根据配置创建存储,预算为0时返回None(全部保留在内存中)"""
+        history_config = config.get('history', {})
+        budget_mb = history_config.get('ram_budget_mb', 32)
+        if not budget_mb:
+            return None
+        return cls(history_config.get('spill_dir', 'history_spill'), int(budget_mb * 1024 * 1024))
+
+    def spill_path(self, generation):
+        """本进程的溢出文件路径,同时运行的多个实例互不覆盖"""
+        return os.path.join(self.directory, f"spill_{os.getpid()}_{generation}.jsonl")
+
+    def write(self, value):
+        """把一个JSON值追加到文件末尾,返回记录编号;不再需要时应调用free"""
+        data = json.dumps(value, ensure_ascii=False).encode('utf-8') + b'\n'
+        with self.lock:
+            return self._write(data)
+
+    def _write(self, data):
+        self.file.seek(self.end)
+        self.file.write(data)
+        record = self.next_record
+        self.next_record += 1
+        self.records[record] = (self.end, len(data))
+        self.end += len(data)
+        self.live_bytes += len(data)
+        return record
+
+    def read(self, record):
+        """按write返回的记录编号读回JSON值"""
+        with self.lock:
+            return self._read(record)
+
+    def _read(self, record):
+        offset, length = self.records[record]
+        self.file.seek(offset)
+        return json.loads(self.file.read(length))
+
+    def free(self, record):
+        """标记记录不再使用,其空间在下次压缩时回收"""
+        with self.lock:
+            self._free(record)
+            self._compact_if_needed()
+
+    def _free(self, record):
+        _, length = self.records.pop(record)
+        self.live_bytes -= length
+
+    def add(self, turn):
+        """登记新创建的轮次,其内容当前在内存中"""
+        with self.lock:
+            self.hot[turn] = None
+            self.hot_bytes += turn.size
+            self._evict()
+
+    def get(self, turn):
+        """返回轮次的请求负载,已溢出到磁盘时读回并放入内存"""
+        with self.lock:
+            message = turn.cached
+            if message is None:
+                message = self._read(turn.ref)
+                turn.cached = message
+                self.hot_bytes += turn.size
+                self.loads += 1
+            self.hot[turn] = None
+            self.hot.move_to_end(turn)
+            self._evict()
+            return message
+
+    def get_many(self, turns):
+        """返回一组轮次的请求负载,用于构造整条分支的请求
+
+        已溢出的轮次按文件顺序成段读回,且只用于本次请求、不放回内存:
+        否则读回较早的前缀会把最近的轮次挤出内存,下次发送时又要全部重新读取。
+        """
+        with self.lock:
+            messages = [turn.cached for turn in turns]
+            cold = sorted(
+                (self.records[turn.ref], index) for index, turn in enumerate(turns) if messages[index] is None
+            )
+            start = 0
+            while start < len(cold):
+                # 合并文件中相邻的记录,一次读取
+                stop = start + 1
+                while stop < len(cold) and cold[stop][0][0] == sum(cold[stop - 1][0]):
+                    stop += 1
+                offset = cold[start][0][0]
+                self.file.seek(offset)
+                data = self.file.read(sum(cold[stop - 1][0]) - offset)
+                for (record_offset, length), index in cold[start:stop]:
+                    messages[index] = json.loads(data[record_offset - offset:record_offset - offset + length])
+                start = stop
+            self.loads += len(cold)
+            for turn in turns:
+                if turn in self.hot:
+                    self.hot.move_to_end(turn)
+            return messages
+
+    def _evict(self):
+        """把最久未用的轮次写入磁盘,直到内存占用回到预算以内;最近使用的轮次总是保留"""
+        while self.hot_bytes > self.budget_bytes and len(self.hot) > 1:
+            turn, _ = self.hot.popitem(last=False)
+            if turn.ref is None:
+                data = json.dumps(turn.cached, ensure_ascii=False).encode('utf-8') + b'\n'
+                turn.ref = self._write(data)
+                self.turn_records.add(turn.ref)
+                self.spills += 1
+            turn.cached = None
+            self.hot_bytes -= turn.size
+
+    def release(self):
+        """对话树重置时不再跟踪旧的轮次,其磁盘记录全部失效"""
+        with self.lock:
+            self.hot.clear()
+            self.hot_bytes = 0
+            for record in self.turn_records:
+                self._free(record)
+            self.turn_records.clear()
+            self._compact_if_needed()
+
+    def _compact_if_needed(self):
+        """失效的空间超过阈值且不少于有效数据时压缩,保证压缩的复制开销按写入量均摊"""
+        dead_bytes = self.end - self.live_bytes
+        if dead_bytes >= self.compact_min_bytes and dead_bytes >= self.live_bytes:
+            self._compact()
+
+    def _compact(self):
+        """把有效记录按原顺序复制到新文件,替换旧文件"""
+        generation = self.generation + 1
+        path = self.spill_path(generation)
+        new_file = open(path, 'w+b')
+        records = {}
+        end = 0
+        try:
+            for record, (offset, length) in sorted(self.records.items(), key=lambda item: item[1][0]):
+                self.file.seek(offset)
+                new_file.write(self.file.read(length))
+                records[record] = (end, length)
+                end += length
+        except OSError as e:
+            # 复制失败时继续使用旧文件
+            self.logger.error(f"压缩历史溢出文件失败: {str(e)}")
+            new_file.close()
+            os.remove(path)
+            return
+        self.records = records
+        old_file, old_path = self.file, self.path
+        self.file, self.path, self.end, self.generation = new_file, path, end, generation
+        old_file.close()
+        os.remove(old_path)
+        self.compactions += 1
+        self.logger.info(f"已压缩历史溢出文件,有效数据 {end / 1024:.1f} KB")
+
+    def stats_text(self):
+        """内存与磁盘占用统计"""
+        with self.lock:
+            return (
+                f"内存中轮次: {len(self.hot)} ({self.hot_bytes / 1024:.1f} KB / "
+                f"预算 {self.budget_bytes / 1024:.0f} KB), "
+                f"磁盘: {self.end / 1024:.1f} KB (有效 {self.live_bytes / 1024:.1f} KB), "
+                f"写出 {self.spills} 次, 读回 {self.loads} 次, 压缩 {self.compactions} 次"
+            )
+
+    def close(self):
+        """关闭并删除本进程的溢出文件"""
+        with self.lock:
+            self.file.close()
+            try:
+                os.remove(self.path)
+            except OSError as e:
+                self.logger.warning(f"删除历史溢出文件失败: {str(e)}")
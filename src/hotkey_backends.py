@@ -0,0 +1,419 @@
+import os
+import sys
+from collections import namedtuple
+import threading
+from logger_manager import LoggerManager
+
+MODIFIER_NAMES = ('ctrl', 'alt', 'shift', 'win')
+
+# linux/input-event-codes.h中的事件类型,与evdev.ecodes中的值相同
+EV_SYN = 0x00
+EV_KEY = 0x01
+EV_MSC = 0x04
+MSC_SCAN = 0x04
+
+# 未安装evdev时基准测试使用的输入事件,字段与evdev.InputEvent相同
+InputEvent = namedtuple('InputEvent', 'sec usec type code value')
+
+# 热键字符串中修饰键的别名
+KEY_ALIASES = {
+    'control': 'ctrl',
+    'windows': 'win',
+    'super': 'win',
+    'cmd': 'win',
+    'meta': 'win',
+    'escape': 'esc',
+    'return': 'enter',
+}
+
+
+def normalize_key_name(name):
+    """统一按键名称,左右修饰键视为同一个键"""
+    name = name.lower()
+    if name.startswith('key_'):
+        name = name[4:]
+    for side in ('left', 'right'):
+        if name.startswith(side) and name[len(side):] in ('ctrl', 'alt', 'shift', 'meta'):
+            name = name[len(side):]
+    return KEY_ALIASES.get(name, name)
+
+
+def parse_hotkey(hotkey):
+    """把"alt+z"形式的热键解析为(修饰键集合, 主键)"""
+    keys = [normalize_key_name(key.strip()) for key in hotkey.split('+') if key.strip()]
+    if not keys:
+        raise ValueError(f"无效的热键: {hotkey}")
+    modifiers = frozenset(keys[:-1])
+    unknown = modifiers - set(MODIFIER_NAMES)
+    if unknown:
+        raise ValueError(f"无效的修饰键: {', '.join(sorted(unknown))}")
+    return modifiers, keys[-1]
+
+
+class HotkeyBackend:
+    """全局热键后端的基类"""
+
+    name = 'base'
+
+    def __init__(self):
+        self.logger = LoggerManager.get_logger()
+
+    def register(self, hotkey, callback):
+        """注册热键,失败时抛出异常"""
+        raise NotImplementedError
+
+    def unregister_all(self):
+        """移除本后端注册的所有热键"""
+        raise NotImplementedError
+
+    def benchmark_handler(self, hotkey, callback):
+        """返回每个按键事件在Python中执行的处理函数handler(name, down),用于基准测试
+
+        返回None表示普通按键不进入Python(系统原生处理)。handler可带有flush(),
+        测量结束前调用,用于等待后台线程处理完已分发的事件。
+        """
+        raise NotImplementedError
+
+
+class KeyboardBackend(HotkeyBackend):
+    """基于keyboard库的全局钩子,可屏蔽热键,但每次按键都会在Python中处理"""
+
+    name = 'keyboard'
+
+    def __init__(self):
+        super().__init__()
+        self.handle = None
+
+    def register(self, hotkey, callback):
+        import keyboard
+        self.unregister_all()
+        self.handle = keyboard.add_hotkey(hotkey, callback, suppress=True)
+
+    def unregister_all(self):
+        if self.handle is None:
+            return
+        import keyboard
+        # 只移除自己注册的热键,不影响其他钩子
+        keyboard.remove_hotkey(self.handle)
+        self.handle = None
+
+    def benchmark_handler(self, hotkey, callback):
+        """把模拟的KeyboardEvent送入keyboard库的监听分发(direct_callback),热键以suppress注册
+
+        与keyboard库自带测试的做法相同,用进程内的假系统层替换keyboard._os_keyboard,
+        不安装系统钩子、不需要root;扫描码由假系统层分配,不依赖dumpkeys。
+        这依赖keyboard库的内部接口,库升级后可能失效;替换是全局的,只应在基准测试进程中调用。
+        返回的handler带有flush(),等待处理线程处理完已分发的事件。
+        """
+        import keyboard
+        from keyboard import KEY_DOWN, KEY_UP, KeyboardEvent
+
+        listener = keyboard._listener
+        if listener.listening:
+            raise RuntimeError("当前进程已安装keyboard钩子,无法替换为模拟系统层")
+
+        names = [chr(code) for code in range(ord('a'), ord('z') + 1)] + list(MODIFIER_NAMES)
+        modifiers, key = parse_hotkey(hotkey)
+        os_layer = _BenchmarkOsKeyboard(names + [key])
+        keyboard._os_keyboard = os_layer
+        keyboard._modifier_scan_codes = set()
+        keyboard.add_hotkey(hotkey, callback, suppress=True)
+
+        codes = os_layer.codes
+        direct_callback = listener.direct_callback
+
+        def handler(name, down):
+            direct_callback(KeyboardEvent(KEY_DOWN if down else KEY_UP, codes[name], name))
+
+        handler.flush = listener.queue.join
+        return handler
+
+
+class _BenchmarkOsKeyboard:
+    """keyboard库系统层的替身: 不安装钩子,只提供按键名称与扫描码的映射"""
+
+    def __init__(self, names):
+        self.codes = {}
+        for name in names:
+            self.codes.setdefault(name, len(self.codes) + 1)
+        # keyboard库内部使用的名称: 左右修饰键和windows,映射到同一个扫描码
+        for name in ('ctrl', 'alt', 'shift'):
+            self.codes['left ' + name] = self.codes['right ' + name] = self.codes[name]
+        self.codes['windows'] = self.codes['left windows'] = self.codes['right windows'] = self.codes['win']
+
+    def init(self):
+        pass
+
+    def listen(self, callback):
+        # 事件由基准测试直接送入direct_callback,监听线程立即结束
+        pass
+
+    def map_name(self, name):
+        if name not in self.codes:
+            raise KeyError(name)
+        yield self.codes[name], ()
+
+    def press(self, scan_code):
+        pass
+
+    def release(self, scan_code):
+        pass
+
+
+class Win32Backend(HotkeyBackend):
+    """通过RegisterHotKey向系统注册热键,只有热键触发时才会回调,普通按键没有Python开销"""
+
+    name = 'win32'
+
+    MODIFIER_FLAGS = {'alt': 0x0001, 'ctrl': 0x0002, 'shift': 0x0004, 'win': 0x0008}
+    MOD_NOREPEAT = 0x4000
+    WM_HOTKEY = 0x0312
+    WM_QUIT = 0x0012
+    NAMED_KEYS = {
+        'space': 0x20, 'enter': 0x0D, 'tab': 0x09, 'esc': 0x1B, 'backspace': 0x08,
+        'insert': 0x2D, 'delete': 0x2E, 'home': 0x24, 'end': 0x23,
+        'page up': 0x21, 'page down': 0x22, 'left': 0x25, 'up': 0x26, 'right': 0x27, 'down': 0x28,
+        '`': 0xC0, '-': 0xBD, '=': 0xBB, '[': 0xDB, ']': 0xDD, ';': 0xBA, "'": 0xDE,
+        ',': 0xBC, '.': 0xBE, '/': 0xBF, '\\': 0xDC,
+    }
+
+    def __init__(self):
+        super().__init__()
+        self.thread = None
+        self.thread_id = None
+
+    @classmethod
+    def virtual_key(cls, key):
+        """主键名称转换为Windows虚拟键码"""
+        if len(key) == 1 and key.isalnum():
+            return ord(key.upper())
+        if key.startswith('f') and key[1:].isdigit() and 1 <= int(key[1:]) <= 24:
+            return 0x70 + int(key[1:]) - 1
+        if key in cls.NAMED_KEYS:
+            return cls.NAMED_KEYS[key]
+        raise ValueError(f"不支持的按键: {key}")
+
+    def register(self, hotkey, callback):
+        import ctypes
+        from ctypes import wintypes
+
+        self.unregister_all()
+        modifiers, key = parse_hotkey(hotkey)
+        flags = self.MOD_NOREPEAT
+        for name in modifiers:
+            flags |= self.MODIFIER_FLAGS[name]
+        vk = self.virtual_key(key)
+
+        ready = threading.Event()
+        result = {}
+
+        def message_loop():
+            # RegisterHotKey的消息投递到注册线程,因此在专用线程中注册并运行消息循环
+            user32 = ctypes.windll.user32
+            result['ok'] = user32.RegisterHotKey(None, 1, flags, vk)
+            self.thread_id = ctypes.windll.kernel32.GetCurrentThreadId()
+            ready.set()
+            if not result['ok']:
+                return
+            msg = wintypes.MSG()
+            while user32.GetMessageW(ctypes.byref(msg), None, 0, 0) > 0:
+                if msg.message == self.WM_HOTKEY:
+                    callback()
+            user32.UnregisterHotKey(None, 1)
+
+        self.thread = threading.Thread(target=message_loop, name="Win32Hotkey", daemon=True)
+        self.thread.start()
+        ready.wait()
+        if not result['ok']:
+            self.thread = None
+            raise OSError(f"RegisterHotKey失败,热键可能已被其他程序占用: {hotkey}")
+
+    def unregister_all(self):
+        if self.thread is None:
+            return
+        import ctypes
+        ctypes.windll.user32.PostThreadMessageW(self.thread_id, self.WM_QUIT, 0, 0)
+        self.thread.join(timeout=1)
+        self.thread = None
+
+    def benchmark_handler(self, hotkey, callback):
+        return None
+
+
+class EvdevBackend(HotkeyBackend):
+    """Linux下直接读取evdev输入设备,只做最少的按键匹配,不安装全局屏蔽钩子"""
+
+    name = 'evdev'
+
+    def __init__(self):
+        super().__init__()
+        self.thread = None
+        self.stop_fds = None
+        self.modifiers = frozenset()
+        self.key = None
+        self.callback = None
+        self.pressed = set()
+        self.code_names = {}
+
+    @staticmethod
+    def load_code_names():
+        """建立键码到统一按键名称的映射,读取事件时只做一次字典查找"""
+        import evdev
+
+        code_names = {}
+        for code, names in evdev.ecodes.KEY.items():
+            name = names[0] if isinstance(names, list) else names
+            code_names[code] = normalize_key_name(name)
+        return code_names
+
+    @staticmethod
+    def keyboard_devices():
+        """打开所有具有字母键的输入设备;没有读取权限的设备跳过"""
+        import evdev
+
+        keyboards = []
+        for path in evdev.list_devices():
+            try:
+                device = evdev.InputDevice(path)
+            except OSError:
+                continue
+            if evdev.ecodes.KEY_A in device.capabilities().get(evdev.ecodes.EV_KEY, []):
+                keyboards.append(device)
+            else:
+                device.close()
+        return keyboards
+
+    @classmethod
+    def available(cls):
+        """evdev已安装且当前用户至少能读取一个键盘设备时返回True"""
+        try:
+            keyboards = cls.keyboard_devices()
+        except (ImportError, OSError):
+            return False
+        for device in keyboards:
+            device.close()
+        return bool(keyboards)
+
+    def set_hotkey(self, hotkey, callback):
+        """设置要匹配的热键"""
+        self.modifiers, self.key = parse_hotkey(hotkey)
+        self.callback = callback
+        self.pressed = set()
+
+    def process_event(self, name, down):
+        """处理一个按键事件,name为统一后的按键名称"""
+        if name in MODIFIER_NAMES:
+            if down:
+                self.pressed.add(name)
+            else:
+                self.pressed.discard(name)
+        elif down and name == self.key and self.pressed == self.modifiers:
+            self.callback()
+
+    def dispatch(self, events):
+        """处理从设备读出的一批输入事件,读取循环和基准测试共用"""
+        code_names = self.code_names
+        for event in events:
+            # value: 1按下, 0松开, 2自动重复(忽略)
+            if event.type == EV_KEY and event.value != 2:
+                name = code_names.get(event.code)
+                if name:
+                    self.process_event(name, event.value == 1)
+
+    def register(self, hotkey, callback):
+        import selectors
+
+        self.unregister_all()
+        self.set_hotkey(hotkey, callback)
+
+        keyboards = self.keyboard_devices()
+        if not keyboards:
+            raise OSError("未找到可读取的键盘设备,请确认当前用户有/dev/input的读取权限")
+
+        self.code_names = self.load_code_names()
+
+        self.stop_fds = os.pipe()
+        selector = selectors.DefaultSelector()
+        for device in keyboards:
+            selector.register(device, selectors.EVENT_READ)
+        selector.register(self.stop_fds[0], selectors.EVENT_READ)
+
+        def read_loop():
+            try:
+                while True:
+                    for key, _ in selector.select():
+                        if key.fileobj == self.stop_fds[0]:
+                            return
+                        self.dispatch(key.fileobj.read())
+            finally:
+                selector.close()
+                for device in keyboards:
+                    device.close()
+
+        self.thread = threading.Thread(target=read_loop, name="EvdevHotkey", daemon=True)
+        self.thread.start()
+        self.logger.info(f"evdev热键监听已启动,设备数: {len(keyboards)}")
+
+    def unregister_all(self):
+        if self.thread is None:
+            return
+        os.write(self.stop_fds[1], b'x')
+        self.thread.join(timeout=1)
+        for fd in self.stop_fds:
+            os.close(fd)
+        self.thread = None
+        self.stop_fds = None
+
+    def benchmark_handler(self, hotkey, callback):
+        """每个按键构造一次设备读出的事件批(MSC_SCAN、EV_KEY、SYN_REPORT)并交给dispatch
+
+        包含事件对象构造、类型过滤和键码查找,不含select/read系统调用。
+        安装了evdev时使用其键码表和InputEvent,否则使用同结构的模拟键码表。
+        """
+        backend = EvdevBackend()
+        backend.set_hotkey(hotkey, callback)
+        try:
+            import evdev
+            backend.code_names = self.load_code_names()
+            event_class = evdev.InputEvent
+        except ImportError:
+            backend.code_names = {code: name for code, name in enumerate(
+                [chr(code) for code in range(ord('a'), ord('z') + 1)] + list(MODIFIER_NAMES), 1)}
+            event_class = InputEvent
+        codes = {}
+        for code, name in backend.code_names.items():
+            codes.setdefault(name, code)
+        dispatch = backend.dispatch
+
+        def handler(name, down):
+            code = codes[name]
+            value = 1 if down else 0
+            dispatch([event_class(0, 0, EV_MSC, MSC_SCAN, code),
+                      event_class(0, 0, EV_KEY, code, value),
+                      event_class(0, 0, EV_SYN, 0, 0)])
+
+        return handler
+
+
+BACKENDS = {
+    KeyboardBackend.name: KeyboardBackend,
+    Win32Backend.name: Win32Backend,
+    EvdevBackend.name: EvdevBackend,
+}
+
+
+def create_backends(name='auto'):
+    """按名称返回依次尝试的热键后端类
+
+    auto时Windows使用原生注册;Linux在evdev可用(已安装且能读取键盘设备)时优先evdev,
+    注册失败再退回keyboard库;其余平台使用keyboard库。
+    """
+    if name != 'auto':
+        if name not in BACKENDS:
+            raise ValueError(f"未知的热键后端: {name}")
+        return [BACKENDS[name]]
+    if sys.platform == 'win32':
+        return [Win32Backend]
+    if sys.platform.startswith('linux') and EvdevBackend.available():
+        return [EvdevBackend, KeyboardBackend]
+    return [KeyboardBackend]
@@ -1,43 +1,90 @@
-import keyboard
-import time
+import threading
+from hotkey_backends import create_backends
 from logger_manager import LoggerManager
+from tracing import Tracer
 
 class HotkeyManager:
     def __init__(self, config, callback):
         self.config = config
         self.callback = callback
         self.logger = LoggerManager.get_logger()
-        
+        self.tracer = Tracer.get_tracer()
+
+        # 按配置选择热键后端,默认按平台选择开销最低的实现;注册失败(OSError)时依次退回后面的后端
+        backend_name = self.config['hotkeys'].get('backend', 'auto')
+        self.backend_classes = create_backends(backend_name)
+        self.backend = self.backend_classes[0]()
+        self.logger.info(f"使用热键后端: {self.backend.name}")
+
+        # 注册在后台线程中重试,新的注册或清理会取消之前仍在等待的重试
+        self.lock = threading.Lock()
+        self.retry_cancel = threading.Event()
+
     def setup_global_hotkey(self):
-        """设置全局热键"""
+        """设置全局热键,注册和重试在后台线程中进行,不阻塞UI线程"""
+        with self.lock:
+            self.retry_cancel.set()
+            self.retry_cancel = threading.Event()
+            cancel = self.retry_cancel
+        hotkey = self.config['hotkeys']['show_window']
+        threading.Thread(
+            target=self.register_with_retries, args=(hotkey, cancel), name="HotkeySetup", daemon=True
+        ).start()
+
+    def register_with_retries(self, hotkey, cancel):
+        """注册热键,失败时间隔一段时间重试;cancel被设置时放弃"""
         max_retries = 10  # 最大重试次数
         retry_delay = 2   # 每次重试间隔秒数
-        
-        hotkey = self.config['hotkeys']['show_window']
+
         self.logger.info(f"开始注册全局热键: {hotkey}")
-        
+
         for attempt in range(max_retries):
-            try:
-                # 先移除所有已存在的热键
-                keyboard.unhook_all()
-                self.logger.debug("已清除所有已存在的热键绑定")
-                
-                # 添加新的热键
-                keyboard.add_hotkey(hotkey, self.callback, suppress=True)
-                self.logger.info(f"全局热键注册成功,尝试次数: {attempt + 1}")
-                return
-            except Exception as e:
-                self.logger.warning(f"设置全局热键失败 (尝试 {attempt + 1}/{max_retries}): {str(e)}")
-                if attempt < max_retries - 1:  # 如果不是最后一次尝试
-                    self.logger.debug(f"等待 {retry_delay} 秒后重试...")
-                    time.sleep(retry_delay)     # 等待一段时间后重试
-                else:
-                    self.logger.error("全局热键注册失败,已达到最大重试次数")
-                    
+            with self.lock:
+                if cancel.is_set():
+                    return
+                try:
+                    # 注册新的热键,后端会先移除自己之前注册的热键
+                    self.backend.register(hotkey, self.on_hotkey)
+                    self.logger.info(f"全局热键注册成功({self.backend.name}),尝试次数: {attempt + 1}")
+                    return
+                except ValueError as e:
+                    # 热键格式错误,重试没有意义
+                    self.logger.error(f"全局热键格式错误: {str(e)}")
+                    return
+                except OSError as e:
+                    if self.fall_back(e):
+                        continue
+                    self.logger.warning(f"设置全局热键失败 (尝试 {attempt + 1}/{max_retries}): {str(e)}")
+                except Exception as e:
+                    self.logger.warning(f"设置全局热键失败 (尝试 {attempt + 1}/{max_retries}): {str(e)}")
+            if attempt < max_retries - 1:  # 如果不是最后一次尝试
+                self.logger.debug(f"等待 {retry_delay} 秒后重试...")
+                if cancel.wait(retry_delay):
+                    return
+            else:
+                self.logger.error("全局热键注册失败,已达到最大重试次数")
+
+    def fall_back(self, error):
+        """当前后端无法使用时切换到下一个后端,没有可用的后端时返回False;在lock内调用"""
+        names = [backend_class.name for backend_class in self.backend_classes]
+        index = names.index(self.backend.name)
+        if index + 1 >= len(self.backend_classes):
+            return False
+        self.logger.warning(f"热键后端 {self.backend.name} 不可用({str(error)}),改用 {names[index + 1]}")
+        self.backend = self.backend_classes[index + 1]()
+        return True
+
+    def on_hotkey(self):
+        """热键回调,在后端的线程中执行"""
+        with self.tracer.span("hotkey_callback", backend=self.backend.name):
+            self.callback()
+
     def cleanup(self):
         """清理热键绑定"""
+        self.retry_cancel.set()
         try:
-            keyboard.unhook_all()
+            with self.lock:
+                self.backend.unregister_all()
             self.logger.info("已清理所有热键绑定")
         except Exception as e:
             self.logger.error(f"清理热键绑定时发生错误: {str(e)}")
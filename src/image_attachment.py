@@ -0,0 +1,114 @@
+import base64
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from logger_manager import LoggerManager
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.webp')
+
+
+def is_image_file(path):
+    """根据扩展名判断是否为图片文件"""
+    return os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS
+
+
+def encode_image(source, max_side):
+    """缩放并重新编码图片,返回data URL。在子进程中执行,不能依赖wx
+
+    source为('file', 文件内容)或('raw', 宽, 高, RGB数据)。
+    """
+    from PIL import Image
+
+    if source[0] == 'raw':
+        _, width, height, data = source
+        image = Image.frombytes('RGB', (width, height), data)
+    else:
+        image = Image.open(io.BytesIO(source[1]))
+        image.load()
+
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    if has_alpha:
+        image.save(buffer, format='PNG', optimize=True)
+        mime = 'image/png'
+    else:
+        image.save(buffer, format='JPEG', quality=85)
+        mime = 'image/jpeg'
+    return f"data:{mime};base64,{base64.b64encode(buffer.getvalue()).decode('ascii')}"
+
+
+class ImageAttachment:
+    """已编码完成的图片附件"""
+
+    def __init__(self, name, digest, data_url):
+        self.name = name
+        self.digest = digest
+        self.data_url = data_url
+
+    def to_content_part(self):
+        """转换为chat completions消息中的图片内容"""
+        return {"type": "image_url", "image_url": {"url": self.data_url}}
+
+
+class ImageEncoder:
+    """在进程池中缩放编码图片,并按内容哈希缓存编码结果"""
+
+    def __init__(self, cache_size=32, max_workers=2):
+        self.logger = LoggerManager.get_logger()
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+        self.max_workers = max_workers
+        self.process_pool = None
+        # 读取文件和计算哈希也放到后台线程,避免占用UI线程
+        self.thread_pool = ThreadPoolExecutor(max_workers=2)
+
+    @staticmethod
+    def max_side_for_model(config, model):
+        """获取模型允许的最大图片边长"""
+        images_config = config.get('images', {})
+        return images_config.get('model_max_side', {}).get(model, images_config.get('max_side', 1024))
+
+    def encode_file(self, path, max_side):
+        """异步编码图片文件,返回Future[ImageAttachment]"""
+        def load():
+            with open(path, 'rb') as f:
+                return ('file', f.read())
+        return self.thread_pool.submit(self._encode, os.path.basename(path), load, max_side)
+
+    def encode_raw(self, name, width, height, data, max_side):
+        """异步编码剪贴板中的RGB图像数据,返回Future[ImageAttachment]"""
+        return self.thread_pool.submit(self._encode, name, lambda: ('raw', width, height, data), max_side)
+
+    def _encode(self, name, load, max_side):
+        source = load()
+        digest = hashlib.sha256(source[-1]).hexdigest()
+        key = (digest, max_side)
+
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.logger.debug(f"图片编码缓存命中: {name}")
+                return ImageAttachment(name, digest, self.cache[key])
+            if self.process_pool is None:
+                self.process_pool = ProcessPoolExecutor(max_workers=self.max_workers)
+
+        data_url = self.process_pool.submit(encode_image, source, max_side).result()
+        with self.lock:
+            self.cache[key] = data_url
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        self.logger.info(f"图片已编码: {name}, {len(data_url) // 1024} KB")
+        return ImageAttachment(name, digest, data_url)
+
+    def shutdown(self):
+        """关闭后台线程池和进程池"""
+        self.thread_pool.shutdown(wait=False, cancel_futures=True)
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=False, cancel_futures=True)
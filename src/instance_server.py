@@ -0,0 +1,224 @@
+import getpass
+import hmac
+import json
+import os
+import secrets
+import socket
+import stat
+import tempfile
+import threading
+from logger_manager import LoggerManager
+
+# 该模块只依赖标准库,第二个实例和命令行客户端可以在不加载wx/openai的情况下使用
+
+
+def _runtime_dir():
+    """返回仅当前用户可访问的目录,用于存放通信地址
+
+    优先使用$XDG_RUNTIME_DIR(规范要求权限为0700);没有时在临时目录下建立当前用户私有的子目录,
+    并检查它确实属于当前用户且其他用户无权访问,避免被他人预先创建同名文件抢占或窃听。
+    """
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return runtime_dir
+    path = os.path.join(tempfile.gettempdir(), f"fastchatlauncher-{getpass.getuser()}")
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    if hasattr(os, 'getuid'):
+        info = os.lstat(path)
+        if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+            raise OSError(f"通信目录不属于当前用户或权限过宽: {path}")
+    return path
+
+
+def get_instance_address():
+    """获取本机常驻实例的通信地址
+
+    支持Unix域套接字的平台使用私有目录中的套接字文件;否则退化为本机回环TCP端口,
+    端口号和连接令牌写在私有目录中,其他用户即使连上端口也无法通过令牌校验。
+    """
+    if hasattr(socket, 'AF_UNIX'):
+        return os.path.join(_runtime_dir(), "fastchatlauncher.sock")
+    return os.path.join(_runtime_dir(), "fastchatlauncher.port")
+
+
+def _read_port_file(address):
+    """读取TCP模式的端口文件,返回(端口, 令牌);内容损坏时抛出ValueError"""
+    with open(address, 'r', encoding='utf-8') as f:
+        info = json.loads(f.read())
+    if not isinstance(info, dict) or not isinstance(info.get('port'), int) or not info.get('token'):
+        raise ValueError(f"端口文件内容无效: {address}")
+    return info['port'], info['token']
+
+
+def _connect(timeout):
+    """连接到常驻实例,返回(套接字, 令牌);连接失败时抛出OSError,端口文件损坏时抛出ValueError"""
+    address = get_instance_address()
+    if hasattr(socket, 'AF_UNIX'):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(address)
+        except OSError:
+            sock.close()
+            raise
+        return sock, None
+
+    port, token = _read_port_file(address)
+    return socket.create_connection(('127.0.0.1', port), timeout=timeout), token
+
+
+def send_request(request, timeout=2.0):
+    """向常驻实例发送一条请求,逐条产出回复;没有运行中的实例时抛出OSError,端口文件损坏时抛出ValueError"""
+    sock, token = _connect(timeout)
+    if token:
+        request = dict(request, token=token)
+    try:
+        sock.sendall((json.dumps(request, ensure_ascii=False) + '\n').encode('utf-8'))
+        # 流式回复可能间隔较长,连接建立后不再设置超时
+        sock.settimeout(None)
+        with sock.makefile('r', encoding='utf-8') as reader:
+            for line in reader:
+                yield json.loads(line)
+    finally:
+        sock.close()
+
+
+def forward_to_running_instance(args):
+    """把命令行参数转发给已运行的实例,成功返回True"""
+    try:
+        for reply in send_request({'command': 'activate', 'args': list(args)}):
+            return bool(reply.get('ok'))
+    except (OSError, ValueError):
+        return False
+    return False
+
+
+class InstanceServer:
+    """常驻实例的本地IPC服务,同时作为单实例锁"""
+
+    def __init__(self):
+        self.logger = LoggerManager.get_logger()
+        self.address = None
+        # TCP模式下客户端需要携带的令牌,Unix域套接字依靠目录权限隔离
+        self.token = None
+        self.handlers = {}
+        self.sock = None
+        self.running = False
+
+    def register(self, command, handler):
+        """注册命令处理函数,handler(request, reply)在连接线程中调用"""
+        self.handlers[command] = handler
+
+    def start(self):
+        """开始监听,已有其他实例在运行时返回False"""
+        try:
+            self.address = get_instance_address()
+            if hasattr(socket, 'AF_UNIX'):
+                self.sock = self._bind_unix()
+            else:
+                self.sock = self._bind_tcp()
+        except OSError as e:
+            self.logger.warning(f"实例通信服务启动失败: {str(e)}")
+            return False
+        if self.sock is None:
+            self.logger.warning("已有其他实例在运行,不再监听")
+            return False
+
+        self.sock.listen(8)
+        self.running = True
+        threading.Thread(target=self._accept_loop, name="InstanceServer", daemon=True).start()
+        self.logger.info(f"实例通信服务已启动: {self.address}")
+        return True
+
+    def _instance_alive(self):
+        """检查是否已有实例在监听"""
+        try:
+            _connect(0.5)[0].close()
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def _bind_unix(self):
+        if os.path.exists(self.address):
+            if self._instance_alive():
+                return None
+            # 上次异常退出遗留的套接字文件
+            os.unlink(self.address)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # 套接字文件在bind时即以0600创建,不存在权限过宽的窗口
+        old_umask = os.umask(0o177)
+        try:
+            sock.bind(self.address)
+        except OSError:
+            sock.close()
+            raise
+        finally:
+            os.umask(old_umask)
+        return sock
+
+    def _bind_tcp(self):
+        if os.path.exists(self.address) and self._instance_alive():
+            return None
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        self.token = secrets.token_hex(16)
+        temp_path = self.address + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'port': sock.getsockname()[1], 'token': self.token}, f)
+        os.replace(temp_path, self.address)
+        return sock
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._handle_connection, args=(conn,), daemon=True).start()
+
+    def _handle_connection(self, conn):
+        """读取一条请求并分发给对应的处理函数"""
+        lock = threading.Lock()
+
+        def reply(message):
+            data = (json.dumps(message, ensure_ascii=False) + '\n').encode('utf-8')
+            with lock:
+                conn.sendall(data)
+
+        try:
+            with conn.makefile('r', encoding='utf-8') as reader:
+                line = reader.readline()
+            if not line:
+                return
+            request = json.loads(line)
+            if self.token and not hmac.compare_digest(str(request.get('token', '')), self.token):
+                reply({'error': "连接令牌无效"})
+                return
+            handler = self.handlers.get(request.get('command'))
+            if handler is None:
+                reply({'error': f"未知命令: {request.get('command')}"})
+                return
+            handler(request, reply)
+        except Exception as e:
+            self.logger.error(f"处理实例请求时发生错误: {str(e)}")
+            try:
+                reply({'error': str(e)})
+            except OSError:
+                pass
+        finally:
+            conn.close()
+
+    def close(self):
+        """停止监听并清理通信地址"""
+        self.running = False
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+            try:
+                os.unlink(self.address)
+            except OSError:
+                pass
+            self.logger.info("实例通信服务已关闭")
@@ -1,8 +1,11 @@
+import sys
+import time
 import wx
 import wx.lib.scrolledpanel as scrolled
+from tracing import Tracer
 
 class MessagePanel(scrolled.ScrolledPanel):
-    def __init__(self, parent):
+    def __init__(self, parent, store=None, text_budget=8 * 1024 * 1024):
         super().__init__(parent, style=wx.SUNKEN_BORDER | wx.VSCROLL | wx.WANTS_CHARS)
         self.history_sizer = wx.BoxSizer(wx.VERTICAL)
         self.SetSizer(self.history_sizer)
@@ -13,9 +16,29 @@ class MessagePanel(scrolled.ScrolledPanel):
         # 记录最新的消息文本框
         self.latest_message_text = None
         
+        # 所有消息文本框,按显示顺序排列
+        self.message_texts = []
+        
+        # 窗口尺寸变化后等待空闲时重排的消息,以及每次空闲处理的时间预算(秒)
+        self.pending_reflow = []
+        self.reflow_width = None
+        self.reflow_budget = 0.008
+        
+        # 屏幕外已完成消息的文本超出预算时写入存储并从文本框中释放,滚动回来时再读回
+        self.store = store
+        self.text_budget = text_budget
+        self.visibility_changed = False
+        
+        self.tracer = Tracer.get_tracer()
+        
         # 绑定鼠标滚轮事件处理函数
         self.Bind(wx.EVT_MOUSEWHEEL, self.OnMouseWheel)
         
+        # 绑定尺寸变化和空闲事件,用于延迟重排
+        self.Bind(wx.EVT_SIZE, self.OnSize)
+        self.Bind(wx.EVT_IDLE, self.OnIdle)
+        self.Bind(wx.EVT_SCROLLWIN, self.OnScroll)
+        
     def OnMouseWheel(self, event):
         """处理鼠标滚轮事件"""
         # 获取滚轮旋转方向和位置
@@ -32,6 +55,7 @@ class MessagePanel(scrolled.ScrolledPanel):
             
             # 设置新的滚动位置
             self.Scroll(-1, int(new_position))
+            self.visibility_changed = True
         else:
             # 如果鼠标不在窗口内,则跳过处理
             event.Skip()
@@ -52,6 +76,16 @@ class MessagePanel(scrolled.ScrolledPanel):
         # 设置文本框的宽度为父窗口的宽度减去边距
         message_text.SetMinSize((self.GetSize()[0] - 40, -1))
         
+        # 记录发送者标签和对应的对话轮次(由ChatFrame设置)
+        message_text.sender = sender
+        message_text.sender_text = sender_text
+        message_text.turn = None
+        
+        # 文本释放后在存储中的记录编号
+        message_text.text_ref = None
+        message_text.text_size = None
+        message_text.unloaded = False
+        
         # 绑定消息文本框的滚轮事件处理函数
         message_text.Bind(wx.EVT_MOUSEWHEEL, self.OnMouseWheel)
         
@@ -66,21 +100,16 @@ class MessagePanel(scrolled.ScrolledPanel):
         
         # 更新最新的消息文本框引用
         self.latest_message_text = message_text
+        self.message_texts.append(message_text)
+        self.visibility_changed = True
         
         return message_text
         
-    def update_message_text_size(self, message_text, text):
-        """更新消息文本框大小"""
-        if not message_text:
-            return
-            
-        # 计算文本需要的高度和宽度
+    def calculate_text_height(self, message_text, text, text_width):
+        """计算文本在给定宽度下换行后所需的高度"""
         dc = wx.ClientDC(message_text)
         dc.SetFont(message_text.GetFont())
         
-        # 获取文本框的宽度（减去边距）
-        text_width = message_text.GetSize().width - 20
-        
         # 计算所需的总高度
         text_height = 0
         line_height = dc.GetCharHeight()
@@ -104,6 +133,20 @@ class MessagePanel(scrolled.ScrolledPanel):
                     text_height += line_height
                     current_width = width
             text_height += line_height
+            
+        return text_height
+        
+    def update_message_text_size(self, message_text, text):
+        """更新消息文本框大小"""
+        if not message_text:
+            return
+        with self.tracer.span("update_message_text_size", chars=len(text)):
+            self._update_message_text_size(message_text, text)
+            
+    def _update_message_text_size(self, message_text, text):
+        # 获取文本框的宽度（减去边距）
+        text_width = message_text.GetSize().width - 20
+        text_height = self.calculate_text_height(message_text, text, text_width)
         
         # 设置新的大小
         message_text.SetMinSize((text_width, text_height + 10))  # 添加一些边距
@@ -114,6 +157,170 @@ class MessagePanel(scrolled.ScrolledPanel):
         self.FitInside()
         self.scroll_to_bottom()
         
+    def reflow_message(self, message_text, width):
+        """按新的面板宽度重新计算单条消息的大小,不触发整体布局"""
+        text_width = width - 40
+        text_height = self.calculate_text_height(message_text, self.get_message_value(message_text), text_width - 20)
+        message_text.SetMinSize((text_width, text_height + 10))
+        message_text.GetParent().Layout()
+        
+    def is_message_visible(self, message_text, margin=0):
+        """判断消息当前是否在可见区域内,margin为上下额外扩展的高度"""
+        rect = message_text.GetParent().GetRect()
+        client_size = self.GetClientSize()
+        return rect.Intersects(wx.Rect(0, -margin, client_size.width, client_size.height + 2 * margin))
+        
+    def get_message_value(self, message_text):
+        """获取消息文本,已释放的消息从存储中读取"""
+        if message_text.unloaded:
+            return self.store.read(message_text.text_ref)
+        return message_text.GetValue()
+        
+    def unload_message(self, message_text):
+        """把消息文本写入存储并清空文本框,保留原有高度"""
+        if message_text.text_ref is None:
+            message_text.text_ref = self.store.write(message_text.GetValue())
+        message_text.ChangeValue("")
+        message_text.unloaded = True
+        
+    def free_message_texts(self, message_texts):
+        """释放被移除的消息在存储中的文本记录"""
+        if self.store is None:
+            return
+        for message_text in message_texts:
+            if message_text.text_ref is not None:
+                self.store.free(message_text.text_ref)
+                message_text.text_ref = None
+        
+    def load_message(self, message_text):
+        """从存储中读回已释放的消息文本"""
+        message_text.ChangeValue(self.store.read(message_text.text_ref))
+        message_text.unloaded = False
+        
+    def update_loaded_messages(self):
+        """读回可见区域附近的消息,并在超出预算时释放离可见区域最远的已完成消息"""
+        client_height = self.GetClientSize().height
+        loaded_bytes = 0
+        offscreen = []
+        for message_text in self.message_texts:
+            near = self.is_message_visible(message_text, margin=client_height)
+            if message_text.unloaded:
+                if near:
+                    self.load_message(message_text)
+                else:
+                    continue
+            # 已关联轮次的消息内容不再变化,大小只计算一次;仍在接收的消息不释放
+            if message_text.turn is None:
+                loaded_bytes += sys.getsizeof(message_text.GetValue())
+                continue
+            if message_text.text_size is None:
+                message_text.text_size = sys.getsizeof(message_text.GetValue())
+            size = message_text.text_size
+            loaded_bytes += size
+            if not near:
+                y = message_text.GetParent().GetPosition().y
+                offscreen.append((-y if y < 0 else y - client_height, size, message_text))
+                
+        offscreen.sort(key=lambda item: item[0])
+        while loaded_bytes > self.text_budget and offscreen:
+            _, size, message_text = offscreen.pop()
+            self.unload_message(message_text)
+            loaded_bytes -= size
+        
+    def is_scrolled_to_bottom(self):
+        """判断当前是否停留在底部"""
+        view_y = self.GetViewStart()[1] * self.GetScrollPixelsPerUnit()[1]
+        return view_y + self.GetClientSize()[1] >= self.GetVirtualSize()[1] - 1
+        
+    def scroll_anchor(self):
+        """返回可见区域顶部的消息及其相对可见区域顶部的偏移(像素),用于重排后恢复阅读位置"""
+        # 消息按显示顺序排列,二分查找第一条底边进入可见区域的消息
+        low, high = 0, len(self.message_texts)
+        while low < high:
+            middle = (low + high) // 2
+            if self.message_texts[middle].GetParent().GetRect().GetBottom() < 0:
+                low = middle + 1
+            else:
+                high = middle
+        if low == len(self.message_texts):
+            return None
+        message_text = self.message_texts[low]
+        return message_text, message_text.GetParent().GetPosition().y
+        
+    def scroll_to_anchor(self, anchor):
+        """滚动到使锚点消息回到重排前相对可见区域顶部的位置"""
+        message_text, offset = anchor
+        pixels_per_unit = self.GetScrollPixelsPerUnit()[1]
+        if not pixels_per_unit:
+            return
+        view_y = self.GetViewStart()[1] * pixels_per_unit
+        anchor_y = message_text.GetParent().GetPosition().y + view_y
+        self.Scroll(-1, max(0, round((anchor_y - offset) / pixels_per_unit)))
+        
+    def finish_reflow(self, was_at_bottom):
+        """重排后统一更新一次布局;停留在底部时保持在底部,否则保持可见区域顶部的消息位置不变"""
+        anchor = None if was_at_bottom else self.scroll_anchor()
+        self.Layout()
+        self.FitInside()
+        if was_at_bottom:
+            self.scroll_to_bottom()
+        elif anchor is not None:
+            self.scroll_to_anchor(anchor)
+            
+    def OnSize(self, event):
+        """窗口尺寸变化: 立即重排可见消息,其余消息放到空闲时分批处理"""
+        event.Skip()
+        width = self.GetClientSize().width
+        if width <= 40 or width == self.reflow_width:
+            return
+        self.reflow_width = width
+        
+        visible = []
+        offscreen = []
+        client_height = self.GetClientSize().height
+        for message_text in self.message_texts:
+            if self.is_message_visible(message_text):
+                visible.append(message_text)
+            else:
+                # 按与可见区域的距离排序,离得近的优先重排
+                y = message_text.GetParent().GetPosition().y
+                distance = -y if y < 0 else y - client_height
+                offscreen.append((distance, message_text))
+                
+        was_at_bottom = self.is_scrolled_to_bottom()
+        for message_text in visible:
+            self.reflow_message(message_text, width)
+        if visible:
+            self.finish_reflow(was_at_bottom)
+            
+        # 新的尺寸事件会替换掉之前尚未完成的重排队列
+        offscreen.sort(key=lambda item: item[0], reverse=True)
+        self.pending_reflow = [message_text for _, message_text in offscreen]
+        
+    def OnScroll(self, event):
+        """滚动后在空闲时读回进入可见区域的消息"""
+        event.Skip()
+        self.visibility_changed = True
+        
+    def OnIdle(self, event):
+        """在空闲时按时间预算分批重排屏幕外的消息"""
+        event.Skip()
+        if self.store is not None and self.visibility_changed:
+            self.visibility_changed = False
+            self.update_loaded_messages()
+        if not self.pending_reflow:
+            return
+            
+        was_at_bottom = self.is_scrolled_to_bottom()
+        deadline = time.perf_counter() + self.reflow_budget
+        while self.pending_reflow and time.perf_counter() < deadline:
+            message_text = self.pending_reflow.pop()
+            self.reflow_message(message_text, self.reflow_width)
+        self.finish_reflow(was_at_bottom)
+        
+        if self.pending_reflow:
+            event.RequestMore()
+            
     def add_message(self, sender, message):
         """添加消息到历史记录"""
         if sender == "AI":
@@ -122,6 +329,42 @@ class MessagePanel(scrolled.ScrolledPanel):
         message_text = self.create_message_panel(sender)
         message_text.SetValue(message)
         self.update_message_text_size(message_text, message)
+        return message_text
+        
+    def set_message_label(self, message_text, label):
+        """更新消息的发送者标签,如显示分支序号"""
+        message_text.sender_text.SetLabel(f"{label}:")
+        
+    def remove_messages_from(self, turns):
+        """移除从关联turns中任一轮次的第一条消息开始的所有消息,用于只重建分支不同的部分
+
+        按对象匹配轮次,之前对话(如切换agent前)留下的消息不会被误删。
+        """
+        turns = set(turns)
+        for index, message_text in enumerate(self.message_texts):
+            if message_text.turn in turns:
+                break
+        else:
+            return
+            
+        removed = self.message_texts[index:]
+        self.message_texts = self.message_texts[:index]
+        self.free_message_texts(removed)
+        for message_text in removed:
+            panel = message_text.GetParent()
+            self.history_sizer.Detach(panel)
+            panel.Destroy()
+        self.pending_reflow = [text for text in self.pending_reflow if text in self.message_texts]
+        self.latest_message_text = self.message_texts[-1] if self.message_texts else None
+        self.Layout()
+        self.FitInside()
+        
+    def unbind_turns(self):
+        """对话树重置后解除已有消息与旧轮次的关联,这些消息只保留显示,不能再编辑或切换分支"""
+        for message_text in self.message_texts:
+            if message_text.turn is not None:
+                message_text.turn = None
+                self.set_message_label(message_text, message_text.sender)
         
     def scroll_to_bottom(self):
         """确保滚动到底部"""
@@ -141,11 +384,15 @@ class MessagePanel(scrolled.ScrolledPanel):
         
         # 强制刷新显示
         self.Refresh()
+        self.visibility_changed = True
         
     def clear_history(self):
         """清空历史记录"""
+        self.free_message_texts(self.message_texts)
         for child in self.GetChildren():
             child.Destroy()
         self.history_sizer.Clear()
         self.latest_message_text = None
+        self.message_texts = []
+        self.pending_reflow = []
         self.Layout()
@@ -0,0 +1,318 @@
+import json
+import math
+import os
+import re
+import shutil
+import threading
+import zlib
+import numpy as np
+from logger_manager import LoggerManager
+
+
+class RetrievalIndex:
+    """基于字符n-gram的本地TF-IDF检索索引
+
+    文档向量以CSR格式追加写入磁盘(indices/data/indptr),indptr最后写入作为提交点。
+    查询使用按桶组织的倒排表,只访问与查询共享n-gram桶的文档。倒排表、idf和文档范数
+    属于同一个快照,文档和查询使用同一份idf加权并各自归一化,得分是余弦相似度;
+    快照之后新增的少量文档直接按正排扫描,累积到一定比例后重建快照。
+    n-gram经crc32哈希到固定维度,因此新增文档无需重建词表。
+    """
+
+    DIMENSION = 1 << 18
+    NGRAM_RANGE = (2, 3)
+    # 快照之后新增的文档超过该比例(且不少于MIN_DELTA篇)时重建倒排表
+    REBUILD_RATIO = 0.1
+    MIN_DELTA = 64
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        self.logger = LoggerManager.get_logger()
+        self.lock = threading.Lock()
+        # 查询时按桶查找查询权重的稠密表,只分配一次,每次查询后清零用过的位置
+        self.query_factors = np.zeros(self.DIMENSION, dtype=np.float32)
+
+        if not os.path.exists(index_dir):
+            os.makedirs(index_dir)
+
+        self.indptr_path = os.path.join(index_dir, 'indptr.bin')
+        self.indices_path = os.path.join(index_dir, 'indices.bin')
+        self.data_path = os.path.join(index_dir, 'data.bin')
+        self.docs_path = os.path.join(index_dir, 'docs.jsonl')
+        self.offsets_path = os.path.join(index_dir, 'offsets.bin')
+        self.snapshot_meta_path = os.path.join(index_dir, 'snapshot.json')
+
+        if not os.path.exists(self.indptr_path):
+            np.zeros(1, dtype=np.uint64).tofile(self.indptr_path)
+
+        self._recover()
+        self._load()
+        self.logger.info(f"检索索引已加载: {self.doc_count()} 条文档, 目录: {index_dir}")
+
+    @classmethod
+    def from_config(cls, config):
+        """根据配置创建索引,未启用时返回None"""
+        retrieval_config = config.get('retrieval', {})
+        if not retrieval_config.get('enabled', False):
+            return None
+        return cls(retrieval_config.get('index_dir', 'retrieval_index'))
+
+    @staticmethod
+    def _truncate(path, size):
+        """文件超出size字节时截断"""
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            os.truncate(path, size)
+
+    def _recover(self):
+        """丢弃最后一次提交(indptr)之后写入的残留数据,避免之后的文档错位"""
+        indptr = np.fromfile(self.indptr_path, dtype=np.uint64)
+        doc_count = len(indptr) - 1
+        nnz = int(indptr[-1])
+        self._truncate(self.indices_path, nnz * 4)
+        self._truncate(self.data_path, nnz * 4)
+        if os.path.exists(self.offsets_path) and os.path.getsize(self.offsets_path) > doc_count * 8:
+            # 未提交文档的原文从它的偏移处截掉
+            orphan = np.fromfile(self.offsets_path, dtype=np.uint64)[doc_count]
+            self._truncate(self.docs_path, int(orphan))
+            self._truncate(self.offsets_path, doc_count * 8)
+        # 旧版本的范数和文档频率文件已改为加载时计算
+        for name in ('norms.bin', 'df.bin'):
+            path = os.path.join(self.index_dir, name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _load(self):
+        """建立正排矩阵的内存映射,从已提交的文档计算文档频率并加载倒排快照"""
+        self.indptr = np.fromfile(self.indptr_path, dtype=np.uint64).astype(np.int64)
+        nnz = int(self.indptr[-1])
+        if nnz:
+            self.indices = self._map(self.indices_path, np.uint32, nnz)
+            self.data = self._map(self.data_path, np.float32, nnz)
+        else:
+            self.indices = np.zeros(0, dtype=np.uint32)
+            self.data = np.zeros(0, dtype=np.float32)
+        # 每篇文档的桶互不重复,文档频率就是各桶出现的次数
+        self.df = np.bincount(self.indices, minlength=self.DIMENSION).astype(np.int64)
+
+        if not self._load_snapshot():
+            self._rebuild()
+            return
+        self.delta_norms = self._norms(self.covered, self.doc_count()).tolist()
+        if self._needs_rebuild():
+            self._rebuild()
+
+    def _load_snapshot(self):
+        """加载倒排快照,快照不存在或与已提交的文档不一致时返回False"""
+        try:
+            with open(self.snapshot_meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return False
+        covered = meta['doc_count']
+        snapshot_dir = os.path.join(self.index_dir, meta['dir'])
+        if covered > self.doc_count() or meta['nnz'] != int(self.indptr[covered]):
+            return False
+        try:
+            self.postings_ptr = np.fromfile(os.path.join(snapshot_dir, 'ptr.bin'), dtype=np.int64)
+            self.idf = np.fromfile(os.path.join(snapshot_dir, 'idf.bin'), dtype=np.float32)
+            self.norms = np.fromfile(os.path.join(snapshot_dir, 'norms.bin'), dtype=np.float32)
+            if meta['nnz']:
+                self.postings_docs = self._map(os.path.join(snapshot_dir, 'docs.bin'), np.uint32, meta['nnz'])
+                self.postings_data = self._map(os.path.join(snapshot_dir, 'data.bin'), np.float32, meta['nnz'])
+            else:
+                self.postings_docs = np.zeros(0, dtype=np.uint32)
+                self.postings_data = np.zeros(0, dtype=np.float32)
+        except (OSError, ValueError):
+            return False
+        if len(self.postings_ptr) != self.DIMENSION + 1 or len(self.norms) != covered:
+            return False
+        self.covered = covered
+        self.snapshot_dir = meta['dir']
+        return True
+
+    @staticmethod
+    def _map(path, dtype, count):
+        """只读内存映射,转为普通ndarray视图以避免memmap子类在切片时的开销"""
+        return np.asarray(np.memmap(path, dtype=dtype, mode='r', shape=(count,)))
+
+    def _norms(self, start, end):
+        """按快照的idf计算[start, end)范围内文档的向量范数"""
+        if end <= start:
+            return np.zeros(0, dtype=np.float32)
+        begin, finish = self.indptr[start], self.indptr[end]
+        weights = self.data[begin:finish] * self.idf[self.indices[begin:finish]]
+        return np.sqrt(np.add.reduceat(weights * weights, self.indptr[start:end] - begin)).astype(np.float32)
+
+    def _needs_rebuild(self):
+        delta = self.doc_count() - self.covered
+        return delta >= max(self.MIN_DELTA, self.covered * self.REBUILD_RATIO)
+
+    def _rebuild(self):
+        """用当前文档频率重新计算idf和范数,并把全部已提交文档转置为按桶的倒排表"""
+        doc_count = self.doc_count()
+        nnz = int(self.indptr[-1])
+        self.idf = (np.log((doc_count + 1) / (self.df + 1)) + 1).astype(np.float32)
+        self.covered = doc_count
+        norms = self._norms(0, doc_count)
+
+        # 按桶稳定排序,每个桶内的文档id保持递增
+        order = np.argsort(self.indices, kind='stable')
+        doc_ids = np.repeat(np.arange(doc_count, dtype=np.uint32), np.diff(self.indptr))
+        postings_ptr = np.zeros(self.DIMENSION + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.indices, minlength=self.DIMENSION), out=postings_ptr[1:])
+
+        # 写入新的快照目录,最后替换snapshot.json指向它,再删除旧快照
+        snapshot_name = f'snapshot_{doc_count}'
+        snapshot_dir = os.path.join(self.index_dir, snapshot_name)
+        if os.path.exists(snapshot_dir):
+            shutil.rmtree(snapshot_dir)
+        os.makedirs(snapshot_dir)
+        postings_ptr.tofile(os.path.join(snapshot_dir, 'ptr.bin'))
+        self.idf.tofile(os.path.join(snapshot_dir, 'idf.bin'))
+        norms.tofile(os.path.join(snapshot_dir, 'norms.bin'))
+        doc_ids[order].tofile(os.path.join(snapshot_dir, 'docs.bin'))
+        np.asarray(self.data)[order].tofile(os.path.join(snapshot_dir, 'data.bin'))
+        temp_path = self.snapshot_meta_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'dir': snapshot_name, 'doc_count': doc_count, 'nnz': nnz}, f)
+        os.replace(temp_path, self.snapshot_meta_path)
+        for name in os.listdir(self.index_dir):
+            if name.startswith('snapshot_') and name != snapshot_name:
+                shutil.rmtree(os.path.join(self.index_dir, name), ignore_errors=True)
+
+        self._load_snapshot()
+        self.delta_norms = []
+        self.logger.info(f"检索索引倒排表已重建: {doc_count} 条文档")
+
+    def doc_count(self):
+        """返回已索引的文档数量"""
+        return len(self.indptr) - 1
+
+    @classmethod
+    def _tokenize(cls, text):
+        """把文本切分为字符n-gram并哈希到固定维度,返回{桶: 词频}"""
+        text = re.sub(r'\s+', ' ', text.lower()).strip()
+        counts = {}
+        low, high = cls.NGRAM_RANGE
+        # 过短的文本退化为单字
+        if len(text) < low:
+            low = 1
+        for n in range(low, high + 1):
+            for i in range(len(text) - n + 1):
+                gram = text[i:i + n]
+                if gram.isspace():
+                    continue
+                bucket = zlib.crc32(gram.encode('utf-8')) & (cls.DIMENSION - 1)
+                counts[bucket] = counts.get(bucket, 0) + 1
+        return counts
+
+    @staticmethod
+    def _tf_weights(counts, buckets):
+        """对数词频,避免长文本中的重复片段主导得分"""
+        return np.array([1.0 + math.log(counts[b]) for b in buckets.tolist()], dtype=np.float32)
+
+    def add_document(self, text):
+        """追加一条文档到索引"""
+        counts = self._tokenize(text)
+        if not counts:
+            return
+
+        buckets = np.fromiter(sorted(counts), dtype=np.uint32, count=len(counts))
+        weights = self._tf_weights(counts, buckets)
+
+        with self.lock:
+            with open(self.docs_path, 'ab') as f:
+                offset = f.tell()
+                f.write((json.dumps({'text': text}, ensure_ascii=False) + '\n').encode('utf-8'))
+            with open(self.offsets_path, 'ab') as f:
+                np.array([offset], dtype=np.uint64).tofile(f)
+            with open(self.indices_path, 'ab') as f:
+                buckets.tofile(f)
+            with open(self.data_path, 'ab') as f:
+                weights.tofile(f)
+
+            # indptr最后写入,作为本条文档的提交点;之前中断留下的残留数据在加载时截掉
+            with open(self.indptr_path, 'ab') as f:
+                np.array([int(self.indptr[-1]) + len(buckets)], dtype=np.uint64).tofile(f)
+
+            # 提交之后才更新内存中的状态
+            nnz = int(self.indptr[-1]) + len(buckets)
+            self.indptr = np.append(self.indptr, nnz)
+            self.indices = self._map(self.indices_path, np.uint32, nnz)
+            self.data = self._map(self.data_path, np.float32, nnz)
+            self.df[buckets] += 1
+            doc_weights = weights * self.idf[buckets]
+            self.delta_norms.append(float(np.sqrt(np.dot(doc_weights, doc_weights))))
+            if self._needs_rebuild():
+                self._rebuild()
+
+    def _read_document(self, doc_id):
+        """按偏移量读取单条文档原文"""
+        with open(self.offsets_path, 'rb') as f:
+            f.seek(doc_id * 8)
+            offset = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+        with open(self.docs_path, 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.readline().decode('utf-8'))['text']
+
+    def search(self, query, top_k=3, min_score=0.1):
+        """检索与查询最相关的文档,返回[(余弦相似度, 文本)]"""
+        counts = self._tokenize(query)
+        if not counts:
+            return []
+
+        with self.lock:
+            doc_count = self.doc_count()
+            if doc_count == 0:
+                return []
+
+            buckets = np.fromiter(sorted(counts), dtype=np.int64, count=len(counts))
+            idf = self.idf[buckets]
+            query_weights = self._tf_weights(counts, buckets) * idf
+            query_weights /= np.sqrt(np.dot(query_weights, query_weights))
+            # 文档侧的idf合并进查询权重,倒排表中只保存文档的对数词频
+            factors = query_weights * idf
+
+            starts = self.postings_ptr[buckets]
+            lengths = self.postings_ptr[buckets + 1] - starts
+            hit = np.flatnonzero(lengths)
+            doc_parts = [self.postings_docs[start:start + length] for start, length in
+                         zip(starts[hit].tolist(), lengths[hit].tolist())]
+            weight_parts = [self.postings_data[start:start + length] for start, length in
+                            zip(starts[hit].tolist(), lengths[hit].tolist())]
+            factor_parts = [np.repeat(factors[hit], lengths[hit])]
+
+            # 快照之后新增的文档直接扫描正排数据
+            if doc_count > self.covered:
+                begin = self.indptr[self.covered]
+                self.query_factors[buckets] = factors
+                delta_factors = self.query_factors[self.indices[begin:]]
+                self.query_factors[buckets] = 0
+                matched = np.flatnonzero(delta_factors)
+                delta_docs = np.repeat(
+                    np.arange(self.covered, doc_count, dtype=np.uint32), np.diff(self.indptr[self.covered:])
+                )
+                doc_parts.append(delta_docs[matched])
+                weight_parts.append(self.data[begin:][matched])
+                factor_parts.append(delta_factors[matched])
+
+            if not doc_parts:
+                return []
+            doc_ids = np.concatenate(doc_parts)
+            if len(doc_ids) == 0:
+                return []
+            weights = np.concatenate(weight_parts) * np.concatenate(factor_parts)
+            scores = np.bincount(doc_ids, weights=weights, minlength=doc_count)
+            scores /= np.concatenate([self.norms, np.array(self.delta_norms, dtype=np.float32)])
+
+            top_k = min(top_k, doc_count)
+            candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+            candidates = candidates[np.argsort(-scores[candidates])]
+
+            results = []
+            for doc_id in candidates.tolist():
+                score = float(scores[doc_id])
+                if score < min_score:
+                    break
+                results.append((score, self._read_document(doc_id)))
+            return results
@@ -0,0 +1,156 @@
+import threading
+from logger_manager import LoggerManager
+from tracing import Tracer
+
+# 发送请求的状态
+QUEUED = 'queued'
+STREAMING = 'streaming'
+DONE = 'done'
+CANCELLED = 'cancelled'
+
+
+class SendRequest:
+    """一次待发送的用户消息"""
+
+    def __init__(self, message, attachments=None, parts=None, message_text=None, edit_of=None,
+                 reply_text=None, conversation=None):
+        self.message = message
+        self.attachments = attachments or []  # 附件列表: 图片编码的Future或文件附件
+        self.parts = parts or [self]  # 合并发送时包含被合并的原始请求
+        self.message_text = message_text  # 界面上显示该消息的文本框
+        self.reply_text = reply_text  # 紧跟在该消息之后、显示回复的文本框
+        self.edit_of = edit_of  # 编辑重发时被替换的历史轮次
+        self.conversation = conversation  # 提交时的对话编号,新建对话后旧请求的结果不再写入历史
+        self.state = QUEUED
+        self.cancel_event = threading.Event()
+        self.trace_id = None  # 开启追踪时排队等待的异步span id
+        self.response = None  # 正在接收的流式响应,取消时关闭
+        self.lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def attach_response(self, response):
+        """记录正在接收的流式响应;已取消时直接关闭"""
+        with self.lock:
+            self.response = response
+            cancelled = self.cancelled
+        if cancelled:
+            self._close(response)
+
+    def cancel(self):
+        """取消请求并关闭正在接收的响应,阻塞在读取上的工作线程随即结束"""
+        with self.lock:
+            self.cancel_event.set()
+            response = self.response
+        if response is not None:
+            self._close(response)
+
+    def _close(self, response):
+        close = getattr(response, 'close', None)
+        if close is None:
+            return
+        try:
+            close()
+        except Exception as e:
+            LoggerManager.get_logger().debug(f"关闭已取消的响应时发生错误: {str(e)}")
+
+    def set_state(self, state):
+        for part in self.parts:
+            part.state = state
+        self.state = state
+
+
+class SendQueue:
+    """按会话顺序发送消息的队列
+
+    单个工作线程依次处理请求,下一条消息在上一条回复写入历史之后才开始构建,
+    保证历史顺序正确。开启merge后,排队中的多条消息会合并为一轮发送以减少往返次数。
+    """
+
+    def __init__(self, handler, merge=False):
+        self.handler = handler  # handler(request)在工作线程中执行
+        self.merge = merge
+        self.logger = LoggerManager.get_logger()
+        self.tracer = Tracer.get_tracer()
+        self.condition = threading.Condition()
+        self.pending = []
+        self.current = None
+        threading.Thread(target=self._run, name="SendQueue", daemon=True).start()
+
+    def submit(self, message, attachments=None, message_text=None, edit_of=None, reply_text=None, conversation=None):
+        """加入一条消息,返回对应的请求对象"""
+        request = SendRequest(
+            message, attachments, message_text=message_text, edit_of=edit_of,
+            reply_text=reply_text, conversation=conversation
+        )
+        if self.tracer.enabled:
+            request.trace_id = self.tracer.new_id()
+            self.tracer.async_begin("send_queue_wait", request.trace_id)
+        with self.condition:
+            self.pending.append(request)
+            self.logger.debug(f"消息已排队,当前排队数: {len(self.pending)}")
+            self.condition.notify()
+        return request
+
+    def cancel_all(self):
+        """取消所有排队中的消息,并中断正在流式接收的回复"""
+        with self.condition:
+            for request in self.pending:
+                request.set_state(CANCELLED)
+            cancelled = len(self.pending)
+            self.pending = []
+            if self.current is not None:
+                self.current.cancel()
+                cancelled += 1
+        if cancelled:
+            self.logger.info(f"已取消 {cancelled} 条消息")
+
+    def is_idle(self):
+        """没有排队和正在处理的消息时返回True"""
+        with self.condition:
+            return self.current is None and not self.pending
+
+    def _next_request(self):
+        """取出下一条要发送的请求,必要时合并排队中的消息"""
+        with self.condition:
+            while not self.pending:
+                self.condition.wait()
+            # 编辑重发会改变历史的分支位置,只能作为合并的第一条;之后的编辑消息留到下一轮
+            count = 1
+            while self.merge and count < len(self.pending) and self.pending[count].edit_of is None:
+                count += 1
+            if count > 1:
+                parts = self.pending[:count]
+                self.pending = self.pending[count:]
+                request = SendRequest(
+                    "\n\n".join(part.message for part in parts if part.message),
+                    [attachment for part in parts for attachment in part.attachments],
+                    parts,
+                    edit_of=parts[0].edit_of,
+                    reply_text=parts[-1].reply_text,
+                    conversation=parts[0].conversation
+                )
+                self.logger.info(f"已将 {len(parts)} 条排队消息合并为一轮发送")
+            else:
+                request = self.pending.pop(0)
+            request.set_state(STREAMING)
+            self.current = request
+            for part in request.parts:
+                if part.trace_id is not None:
+                    self.tracer.async_end("send_queue_wait", part.trace_id, merged=len(request.parts))
+            return request
+
+    def _run(self):
+        while True:
+            request = self._next_request()
+            try:
+                with self.tracer.span("send_request", parts=len(request.parts)):
+                    self.handler(request)
+            except Exception as e:
+                self.logger.error(f"处理发送请求时发生错误: {str(e)}")
+            self.tracer.flush()
+            with self.condition:
+                request.set_state(CANCELLED if request.cancelled else DONE)
+                self.current = None
@@ -0,0 +1,107 @@
+import heapq
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime
+from logger_manager import LoggerManager
+
+
+class StallWatchdog:
+    """UI线程卡顿看门狗
+
+    后台线程定期向主事件循环投递一个回调,超过阈值仍未执行时,
+    通过sys._current_frames抓取主线程当前的Python调用栈并记录卡顿时长。
+    """
+
+    def __init__(self, post, threshold_ms=200, interval_ms=100, keep_worst=10):
+        self.post = post  # 把回调投递到UI线程执行的函数,如wx.CallAfter
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self.keep_worst = keep_worst
+        self.logger = LoggerManager.get_logger()
+        self.main_thread_id = threading.main_thread().ident
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        # 卡顿统计: 最严重的若干次(小顶堆)、总次数和总时长
+        self.worst_stalls = []
+        self.stall_count = 0
+        self.total_stall_time = 0.0
+
+    @classmethod
+    def from_config(cls, config, post, enabled=False):
+        """根据配置创建看门狗,未启用时返回None"""
+        watchdog_config = config.get('watchdog', {})
+        if not (enabled or watchdog_config.get('enabled', False)):
+            return None
+        return cls(
+            post,
+            threshold_ms=watchdog_config.get('threshold_ms', 200),
+            interval_ms=watchdog_config.get('interval_ms', 100)
+        )
+
+    def start(self):
+        """启动看门狗线程"""
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="StallWatchdog", daemon=True)
+        self.thread.start()
+        self.logger.info(f"UI卡顿看门狗已启动,阈值 {self.threshold * 1000:.0f}ms")
+
+    def stop(self):
+        """停止看门狗线程并输出本次会话的卡顿汇总"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=1)
+            self.thread = None
+        self.logger.info(f"UI卡顿汇总:\n{self.summary()}")
+
+    def _capture_main_stack(self):
+        """抓取主线程当前的调用栈"""
+        frame = sys._current_frames().get(self.main_thread_id)
+        if frame is None:
+            return "(无法获取主线程调用栈)"
+        return "".join(traceback.format_stack(frame))
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            responded = threading.Event()
+            started = time.perf_counter()
+            try:
+                self.post(responded.set)
+            except Exception:
+                # 事件循环已退出
+                break
+
+            if not responded.wait(self.threshold):
+                stack = self._capture_main_stack()
+                # 继续等待主线程恢复,以得到完整的卡顿时长
+                while not responded.wait(0.1):
+                    if self.stop_event.is_set():
+                        return
+                self._record_stall(time.perf_counter() - started, stack)
+
+            self.stop_event.wait(self.interval)
+
+    def _record_stall(self, duration, stack):
+        """记录一次卡顿"""
+        self.stall_count += 1
+        self.total_stall_time += duration
+        entry = (duration, self.stall_count, datetime.now().strftime("%H:%M:%S"), stack)
+        if len(self.worst_stalls) < self.keep_worst:
+            heapq.heappush(self.worst_stalls, entry)
+        else:
+            heapq.heappushpop(self.worst_stalls, entry)
+        self.logger.warning(f"UI线程卡顿 {duration * 1000:.0f}ms, 主线程调用栈:\n{stack}")
+
+    def summary(self):
+        """返回本次会话最严重卡顿的汇总文本"""
+        if not self.stall_count:
+            return "本次会话未检测到UI卡顿"
+        lines = [f"共检测到 {self.stall_count} 次卡顿, 累计 {self.total_stall_time * 1000:.0f}ms"]
+        for duration, _, timestamp, stack in sorted(self.worst_stalls, reverse=True):
+            # 只保留最内层几帧,便于快速定位
+            frames = stack.strip().splitlines()[-4:]
+            lines.append(f"[{timestamp}] {duration * 1000:.0f}ms")
+            lines.extend(f"    {line.strip()}" for line in frames)
+        return "\n".join(lines)
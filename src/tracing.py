@@ -0,0 +1,156 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from logger_manager import LoggerManager
+
+
+class _NullSpan:
+    """未开启追踪时使用的空span,几乎没有开销"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter_ns()
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.emit({
+            'name': self.name, 'ph': 'X',
+            'ts': self.tracer.timestamp(self.start),
+            'dur': (end - self.start) / 1000,
+            'args': self.args
+        })
+        return False
+
+
+class Tracer:
+    """请求生命周期追踪,以Chrome trace event格式写入每次会话一个的JSON文件
+
+    生成的文件可在chrome://tracing或ui.perfetto.dev中打开,按线程查看各阶段耗时。
+    事件边产生边写入,程序异常退出时文件缺少结尾的"]",两种查看器都能正常加载。
+    """
+
+    _instance = None
+
+    def __init__(self):
+        self.enabled = False
+        self.file = None
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter_ns()
+        self.pid = os.getpid()
+        self.named_threads = set()
+        self.next_id = 0
+
+    @classmethod
+    def get_tracer(cls):
+        """获取进程内唯一的追踪器,未调用start时所有记录操作都是空操作"""
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def start(self, trace_dir='traces'):
+        """开始写入追踪文件,返回文件路径"""
+        if self.enabled:
+            return self.file.name
+        if not os.path.exists(trace_dir):
+            os.makedirs(trace_dir)
+        path = os.path.join(trace_dir, f'trace_{datetime.now().strftime("%Y%m%d_%H%M%S")}_{self.pid}.json')
+        self.file = open(path, 'w', encoding='utf-8')
+        self.file.write('[\n')
+        self.first_event = True
+        self.enabled = True
+        LoggerManager.get_logger().info(f"请求追踪已开启,写入: {path}")
+        return path
+
+    def timestamp(self, ns):
+        """转换为相对会话开始的微秒数"""
+        return (ns - self.origin) / 1000
+
+    def emit(self, event):
+        """写入一个事件,补充进程和线程id"""
+        thread = threading.current_thread()
+        event['pid'] = self.pid
+        event['tid'] = thread.native_id
+        with self.lock:
+            if not self.enabled:
+                return
+            if thread.native_id not in self.named_threads:
+                # 每个线程第一次出现时写入线程名元数据
+                self.named_threads.add(thread.native_id)
+                self._write({
+                    'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': thread.native_id,
+                    'args': {'name': thread.name}
+                })
+            self._write(event)
+
+    def _write(self, event):
+        if not self.first_event:
+            self.file.write(',\n')
+        self.first_event = False
+        self.file.write(json.dumps(event, ensure_ascii=False))
+
+    def span(self, name, **args):
+        """记录一段同步执行的耗时: with tracer.span("name", key=value): ..."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def instant(self, name, **args):
+        """记录一个瞬时事件,如收到首个token"""
+        if self.enabled:
+            self.emit({'name': name, 'ph': 'i', 's': 't', 'ts': self.timestamp(time.perf_counter_ns()), 'args': args})
+
+    def new_id(self):
+        """分配异步span的id"""
+        with self.lock:
+            self.next_id += 1
+            return self.next_id
+
+    def async_begin(self, name, span_id, **args):
+        """开始一段跨线程的异步span,如消息在队列中等待"""
+        if self.enabled:
+            self.emit({
+                'name': name, 'cat': name, 'ph': 'b', 'id': span_id,
+                'ts': self.timestamp(time.perf_counter_ns()), 'args': args
+            })
+
+    def async_end(self, name, span_id, **args):
+        """结束async_begin开始的异步span,可以在另一个线程中调用"""
+        if self.enabled:
+            self.emit({
+                'name': name, 'cat': name, 'ph': 'e', 'id': span_id,
+                'ts': self.timestamp(time.perf_counter_ns()), 'args': args
+            })
+
+    def flush(self):
+        with self.lock:
+            if self.enabled:
+                self.file.flush()
+
+    def stop(self):
+        """结束写入并关闭文件"""
+        with self.lock:
+            if not self.enabled:
+                return
+            self.enabled = False
+            self.file.write('\n]\n')
+            self.file.close()
@@ -0,0 +1,153 @@
+import copy
+from file_attachment import estimate_tokens
+from history_store import content_size
+
+# 图片内容的token粗略计数
+IMAGE_TOKENS = 765
+
+
+def content_tokens(content):
+    """估算消息内容的token数,支持纯文本和多段内容"""
+    if isinstance(content, str):
+        return estimate_tokens(content)
+    return sum(
+        estimate_tokens(part['text']) if part['type'] == 'text' else IMAGE_TOKENS
+        for part in content
+    )
+
+
+def content_to_text(content):
+    """把消息内容转换为用于显示的文本"""
+    if isinstance(content, str):
+        return content
+    return "\n".join(part['text'] if part['type'] == 'text' else "[图片]" for part in content)
+
+
+class Turn:
+    """对话树中的一个轮次,创建后内容不再改变
+
+    请求负载和截至本轮的累计token数在创建时计算一次,所有共享该前缀的分支直接复用。
+    有存储时负载可能被写出到磁盘,访问message或content时透明读回。
+    """
+
+    __slots__ = ('role', 'parent', 'depth', 'tokens', 'children', 'store', 'cached', 'ref', 'size')
+
+    def __init__(self, role, content, parent=None, store=None):
+        self.role = role
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent else 0
+        self.tokens = (parent.tokens if parent else 0) + content_tokens(content)
+        self.children = []
+        self.store = store
+        self.cached = {"role": role, "content": content}
+        self.ref = None  # 写出到磁盘后的记录编号
+        self.size = content_size(content)
+        if store is not None:
+            store.add(self)
+
+    @property
+    def message(self):
+        if self.store is None:
+            return self.cached
+        return self.store.get(self)
+
+    @property
+    def content(self):
+        return self.message['content']
+
+
+class TurnTree:
+    """以共享前缀的树保存对话历史,支持从任意一轮编辑后生成新分支"""
+
+    def __init__(self, system_prompt, store=None):
+        self.store = store  # 有内存预算的存储,为None时所有轮次保留在内存中
+        self.reset(system_prompt)
+
+    def reset(self, system_prompt):
+        """以新的system prompt开始一棵新的对话树"""
+        if self.store is not None:
+            self.store.release()
+        self.root = Turn("system", system_prompt, store=self.store)
+        self.leaf = self.root
+        # 每个轮次最近一次选中的子轮次,切换分支时沿此向下
+        self.selected = {}
+
+    def append(self, role, content):
+        """在当前分支末尾追加一轮"""
+        turn = Turn(role, content, self.leaf, self.store)
+        self.leaf.children.append(turn)
+        self.selected[self.leaf] = turn
+        self.leaf = turn
+        return turn
+
+    def contains(self, turn):
+        """turn是否属于当前的对话树;重置之前的轮次不属于,不能再用于编辑或切换分支"""
+        while turn.parent is not None:
+            turn = turn.parent
+        return turn is self.root
+
+    def rewind_to(self, turn):
+        """把当前分支末尾移动到turn,之后追加的轮次成为turn的新子分支"""
+        self.leaf = turn
+
+    def path(self):
+        """当前分支从根到末尾的所有轮次"""
+        turns = []
+        turn = self.leaf
+        while turn is not None:
+            turns.append(turn)
+            turn = turn.parent
+        turns.reverse()
+        return turns
+
+    def messages(self):
+        """当前分支的请求消息列表
+
+        返回各轮负载的副本,调用方插入或修改消息不会改动历史;文本本身不可变,不会被复制。
+        有存储时已溢出的轮次成批读回,不打乱内存中最近使用的轮次。
+        """
+        path = self.path()
+        if self.store is None:
+            payloads = [turn.cached for turn in path]
+        else:
+            payloads = self.store.get_many(path)
+        return [self.copy_message(message) for message in payloads]
+
+    def resident_messages(self):
+        """当前分支中仍在内存里的负载,已溢出到磁盘的轮次不读回;用于诊断内存占用"""
+        return [turn.cached for turn in self.path() if turn.cached is not None]
+
+    @staticmethod
+    def copy_message(message):
+        """复制消息的字典和多段内容的容器"""
+        content = message['content']
+        if isinstance(content, str):
+            return dict(message)
+        return dict(message, content=copy.deepcopy(content))
+
+    def tokens(self):
+        """当前分支的累计token估算"""
+        return self.leaf.tokens
+
+    def siblings(self, turn):
+        """与turn同属一个父轮次的所有分支"""
+        if turn.parent is None:
+            return [turn]
+        return turn.parent.children
+
+    def switch_to(self, turn):
+        """切换到turn所在的分支,并沿最近选中的子轮次走到末尾"""
+        self.selected[turn.parent] = turn
+        while turn in self.selected:
+            turn = self.selected[turn]
+        self.leaf = turn
+
+    @staticmethod
+    def divergence(old_path, new_path):
+        """返回两条分支开始不同的位置"""
+        index = 0
+        for old_turn, new_turn in zip(old_path, new_path):
+            if old_turn is not new_turn:
+                break
+            index += 1
+        return index
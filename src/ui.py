@@ -206,10 +206,47 @@ class AgentConfigDialog(wx.Dialog):
         self.EndModal(wx.ID_OK)
 
 
+class UsageDialog(wx.Dialog):
+    """按日期、agent和模型显示token用量汇总"""
+
+    def __init__(self, parent, usage_ledger, agents):
+        super().__init__(parent, title="用量统计", size=(820, 450))
+        self.usage_ledger = usage_ledger
+        self.agents = agents
+        self.InitUI()
+        
+    def InitUI(self):
+        panel = wx.Panel(self)
+        vbox = wx.BoxSizer(wx.VERTICAL)
+        
+        # 各agent今日、本月用量与预算
+        summary = wx.StaticText(panel, label=self.usage_ledger.summary_text(self.agents))
+        
+        usage_list = wx.ListCtrl(panel, style=wx.LC_REPORT)
+        for index, (label, width) in enumerate((
+            ("日期", 90), ("Agent", 90), ("模型", 150), ("请求数", 60),
+            ("输入", 80), ("输出", 80), ("缓存", 70), ("估算", 50), ("续写", 50), ("续写节省", 70)
+        )):
+            usage_list.InsertColumn(index, label, width=width)
+        for row in self.usage_ledger.rows():
+            index = usage_list.GetItemCount()
+            usage_list.InsertItem(index, row[0])
+            for column, value in enumerate(row[1:], start=1):
+                usage_list.SetItem(index, column, str(value))
+                
+        close_btn = wx.Button(panel, wx.ID_CANCEL, "关闭")
+        
+        vbox.Add(summary, 0, wx.EXPAND|wx.ALL, 5)
+        vbox.Add(usage_list, 1, wx.EXPAND|wx.ALL, 5)
+        vbox.Add(close_btn, 0, wx.ALIGN_RIGHT|wx.ALL, 5)
+        panel.SetSizer(vbox)
+
+
 class ConfigDialog(wx.Dialog):
-    def __init__(self, parent, config):
+    def __init__(self, parent, config, usage_ledger=None):
         super().__init__(parent, title="配置", size=(400, 500))
         self.config = config
+        self.usage_ledger = usage_ledger
         self.InitUI()
         
     def InitUI(self):
@@ -236,6 +273,11 @@ class ConfigDialog(wx.Dialog):
         save_btn.Bind(wx.EVT_BUTTON, self.OnSave)
         cancel_btn.Bind(wx.EVT_BUTTON, self.OnCancel)
         
+        # 用量统计(启用用量账本时)
+        if self.usage_ledger:
+            usage_btn = wx.Button(panel, -1, '用量统计(&U)', pos=(15, 260))
+            usage_btn.Bind(wx.EVT_BUTTON, self.OnUsage)
+        
         # 绑定ESC键事件
         self.Bind(wx.EVT_CHAR_HOOK, self.OnKeyDown)
 
@@ -258,6 +300,21 @@ class ConfigDialog(wx.Dialog):
     
     def OnCancel(self, event):
         self.EndModal(wx.ID_CANCEL)
+        
+    def OnUsage(self, event):
+        dlg = UsageDialog(self, self.usage_ledger, self.config['agents'])
+        dlg.ShowModal()
+        dlg.Destroy()
+
+class AttachmentDropTarget(wx.FileDropTarget):
+    """输入框的文件拖放目标"""
+    def __init__(self, frame):
+        super().__init__()
+        self.frame = frame
+        
+    def OnDropFiles(self, x, y, filenames):
+        self.frame.attach_files(filenames)
+        return True
 
 class ChatTrayIcon(TaskBarIcon):
     def __init__(self, frame):
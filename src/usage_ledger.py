@@ -0,0 +1,135 @@
+import json
+import os
+import threading
+import time
+from logger_manager import LoggerManager
+
+# 每条汇总记录的字段顺序
+FIELDS = ('requests', 'prompt_tokens', 'completion_tokens', 'cached_tokens', 'estimated', 'resumes', 'saved_tokens')
+
+
+def usage_counts(usage):
+    """从SDK的usage对象或SSE中的usage字典提取(输入, 输出, 缓存)token数"""
+    if not isinstance(usage, dict):
+        usage = usage.model_dump()
+    details = usage.get('prompt_tokens_details') or {}
+    return (
+        usage.get('prompt_tokens') or 0,
+        usage.get('completion_tokens') or 0,
+        details.get('cached_tokens') or 0,
+    )
+
+
+class UsageLedger:
+    """按日期、agent和模型汇总的token用量账本
+
+    只保存汇总后的计数,每个(日期, agent, 模型)一条记录,文件大小与请求次数无关。
+    每次记录后原子地重写文件。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.logger = LoggerManager.get_logger()
+        self.lock = threading.Lock()
+        # (日期, agent, 模型) -> [请求数, 输入, 输出, 缓存, 估算的请求数, 续写次数, 续写节省的token数]
+        self.totals = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    for row in json.load(f):
+                        # 旧版本的记录字段较少,缺少的计数补0
+                        counts = row[3:]
+                        self.totals[tuple(row[:3])] = counts + [0] * (len(FIELDS) - len(counts))
+            except (OSError, ValueError) as e:
+                self.logger.error(f"读取用量账本失败: {str(e)}")
+
+    @classmethod
+    def from_config(cls, config):
+        """根据配置创建账本,未启用时返回None"""
+        usage_config = config.get('usage', {})
+        if not usage_config.get('enabled', True):
+            return None
+        return cls(usage_config.get('path', 'usage_ledger.json'))
+
+    def record(self, agent, model, prompt_tokens, completion_tokens, cached_tokens=0, estimated=False):
+        """记录一次请求的用量;estimated表示服务端未返回用量,计数为本地估算"""
+        self._add(agent, model, (1, prompt_tokens, completion_tokens, cached_tokens, int(estimated)))
+        self.logger.debug(
+            f"用量: {agent}/{model} 输入 {prompt_tokens}, 输出 {completion_tokens}, 缓存 {cached_tokens}"
+            + (" (估算)" if estimated else "")
+        )
+
+    def record_resume(self, agent, model, saved_tokens):
+        """记录一次断线续写,saved_tokens为已收到、无需重新生成的token数"""
+        self._add(agent, model, (0, 0, 0, 0, 0, 1, saved_tokens))
+        
+    def _add(self, agent, model, values):
+        key = (time.strftime('%Y-%m-%d'), agent, model)
+        with self.lock:
+            row = self.totals.setdefault(key, [0] * len(FIELDS))
+            for index, value in enumerate(values):
+                row[index] += value
+            self._save()
+            
+    def _save(self):
+        rows = [list(key) + row for key, row in sorted(self.totals.items())]
+        temp_path = self.path + '.tmp'
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(rows, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            self.logger.error(f"保存用量账本失败: {str(e)}")
+
+    def agent_tokens(self, agent, since):
+        """agent自since日期(含)以来的输入与输出token总数"""
+        with self.lock:
+            return sum(
+                row[1] + row[2] for (day, name, _), row in self.totals.items()
+                if name == agent and day >= since
+            )
+
+    def check_budget(self, agent, budget):
+        """发送前检查agent的预算,返回(是否允许发送, 提示文本)
+
+        budget为agent配置中的token_budget: {"daily_tokens", "monthly_tokens", "mode": "soft"|"hard"},
+        soft模式超出预算时只提示,hard模式拒绝发送。
+        """
+        if not budget:
+            return True, None
+        limits = (
+            ("今日", budget.get('daily_tokens'), time.strftime('%Y-%m-%d')),
+            ("本月", budget.get('monthly_tokens'), time.strftime('%Y-%m-01')),
+        )
+        for label, limit, since in limits:
+            if not limit:
+                continue
+            used = self.agent_tokens(agent, since)
+            if used >= limit:
+                hard = budget.get('mode', 'soft') == 'hard'
+                text = f"agent {agent} {label}已用 {used} tokens,超出预算 {limit}" + (",已停止发送" if hard else "")
+                return not hard, text
+        return True, None
+
+    def rows(self):
+        """按日期倒序返回所有汇总记录: (日期, agent, 模型, 请求数, 输入, 输出, 缓存, 估算的请求数, 续写次数, 节省token数)"""
+        with self.lock:
+            return [key + tuple(row) for key, row in sorted(self.totals.items(), reverse=True)]
+
+    def summary_text(self, agents):
+        """各agent今日与本月的用量,以及配置的预算"""
+        today = time.strftime('%Y-%m-%d')
+        month = time.strftime('%Y-%m-01')
+        lines = []
+        for name, agent in agents.items():
+            budget = agent.get('token_budget') or {}
+            line = f"{name}: 今日 {self.agent_tokens(name, today)}"
+            if budget.get('daily_tokens'):
+                line += f"/{budget['daily_tokens']}"
+            line += f", 本月 {self.agent_tokens(name, month)}"
+            if budget.get('monthly_tokens'):
+                line += f"/{budget['monthly_tokens']}"
+            if budget:
+                line += f" ({'硬' if budget.get('mode', 'soft') == 'hard' else '软'}限制)"
+            lines.append(line)
+        return "\n".join(lines)
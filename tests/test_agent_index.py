@@ -0,0 +1,24 @@
+import logging
+from agent_index import AgentIndex
+
+
+def test_double_at_is_plain_text():
+    assert AgentIndex.parse("@@property 是什么") == (None, "@property 是什么")
+    assert AgentIndex.parse("@coder 写个函数") == ("coder", "写个函数")
+
+
+def test_unrelated_nickname_has_no_suggestions():
+    index = AgentIndex(["default", "coder", "translator"])
+    nickname, _ = AgentIndex.parse("@property 是什么")
+    assert index.resolve(nickname) is None
+    assert index.complete(nickname, limit=3) == []
+
+
+def test_case_collision_warns_and_keeps_exact_match(caplog):
+    with caplog.at_level(logging.WARNING):
+        index = AgentIndex(["Coder", "coder", "default"])
+    assert "只有大小写不同" in caplog.text
+    assert index.resolve("Coder") == "Coder"
+    assert index.resolve("coder") == "coder"
+    assert index.resolve("CODER") == "Coder"
+    assert index.complete("cod") == ["Coder"]
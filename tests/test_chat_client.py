@@ -0,0 +1,119 @@
+from openai import OpenAI
+from chat_client import RESUMABLE_ERRORS, ChatClient, FastStream, splice_continuation
+from diagnostics import MockChatServer
+
+
+class FakeManager:
+    def __init__(self):
+        self.exits = 0
+
+    def __exit__(self, *args):
+        self.exits += 1
+
+
+def test_unread_fast_stream_closes_response():
+    manager = FakeManager()
+    stream = FastStream(manager, iter(["never read"]))
+    stream.close()
+    stream.close()
+    assert manager.exits == 1
+
+
+def test_fast_stream_closes_after_exhaustion():
+    manager = FakeManager()
+    assert list(FastStream(manager, iter(["a", "b"]))) == ["a", "b"]
+    assert manager.exits == 1
+
+
+def test_fast_and_sdk_streams_match():
+    server = MockChatServer(reply="你好,世界" * 20, chunk_size=3)
+    try:
+        client = OpenAI(api_key="mock", base_url=server.base_url)
+        replies = []
+        for fast_stream in (False, True):
+            chat_client = ChatClient(client, fast_stream=fast_stream)
+            response = chat_client.get_chat_completion([{"role": "user", "content": "hi"}], "mock")
+            replies.append(chat_client.process_stream_response(response, lambda text: None))
+        assert replies[0] == replies[1] == "你好,世界" * 20
+    finally:
+        server.close()
+
+
+def test_rejected_stream_options_are_dropped():
+    server = MockChatServer(reply="你好" * 10, reject_stream_options=True)
+    try:
+        client = OpenAI(api_key="mock", base_url=server.base_url, max_retries=0)
+        for fast_stream in (False, True):
+            chat_client = ChatClient(client, fast_stream=fast_stream, stream_usage=True)
+            response = chat_client.get_chat_completion([{"role": "user", "content": "hi"}], "mock")
+            assert chat_client.process_stream_response(response, lambda text: None) == "你好" * 10
+            assert not chat_client.stream_usage
+        # 每个客户端只被拒绝一次,之后的请求直接不带stream_options
+        assert ['stream_options' in request for request in server.requests] == [True, False, True, False]
+    finally:
+        server.close()
+
+
+def test_failed_stream_reports_partial_text_for_estimate():
+    def broken_stream():
+        yield "已收到的部分"
+        raise RuntimeError("服务端错误")
+
+    reported = []
+    chat_client = ChatClient(None)
+    result = chat_client.process_stream_response(
+        broken_stream(), lambda text: None, usage_callback=lambda usage, text: reported.append((usage, text))
+    )
+    assert result.startswith("错误: ")
+    assert reported == [(None, "已收到的部分")]
+
+
+def test_splice_removes_overlap_at_resume_point():
+    partial = "第一段内容已经输出完毕。第二段从这里开始被截"
+    continuation = "第二段从这里开始被截断,后面是新的内容。"
+    assert splice_continuation(partial, continuation) == "第一段内容已经输出完毕。第二段从这里开始被截断,后面是新的内容。"
+
+
+def test_splice_keeps_repeated_text():
+    partial = "哈" * 30
+    continuation = "哈" * 20 + "结束"
+    assert splice_continuation(partial, continuation) == "哈" * 50 + "结束"
+    partial = "列表: " + "- 项目\n" * 10
+    continuation = "- 项目\n" * 5 + "完"
+    assert splice_continuation(partial, continuation) == partial + continuation
+
+
+def failing_stream(text, error):
+    yield text
+    raise error
+
+
+def test_non_resumable_error_keeps_current_attempt():
+    chat_client = ChatClient(None)
+    chat_client.get_chat_completion = lambda messages, model, pool=None: failing_stream(
+        "已收到的部分回复", ValueError("解析失败")
+    )
+    shown = []
+    result = chat_client.complete_with_resume([{"role": "user", "content": "hi"}], "mock", shown.append)
+    assert result == "已收到的部分回复\n\n[错误: 解析失败]"
+    assert shown[-1] == result
+
+
+def test_transport_error_during_read_is_resumed():
+    transport_error = RESUMABLE_ERRORS[-1]
+    assert transport_error.__name__ == 'TransportError'
+    responses = iter([
+        failing_stream("前半部分的回复内容,", transport_error("peer closed connection")),
+        iter(["后半部分。"]),
+    ])
+    requests = []
+
+    def get_chat_completion(messages, model, pool=None):
+        requests.append(messages)
+        return next(responses)
+
+    chat_client = ChatClient(None)
+    chat_client.get_chat_completion = get_chat_completion
+    result = chat_client.complete_with_resume([{"role": "user", "content": "hi"}], "mock", lambda text: None)
+    assert result == "前半部分的回复内容,后半部分。"
+    assert requests[1][-2] == {"role": "assistant", "content": "前半部分的回复内容,"}
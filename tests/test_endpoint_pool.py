@@ -0,0 +1,88 @@
+from types import SimpleNamespace
+from chat_client import ChatClient
+from endpoint_pool import Endpoint, EndpointPool
+
+
+def fake_client(calls, name, fail=False):
+    """只实现chat.completions.create的假客户端,记录调用顺序"""
+    def create(**kwargs):
+        calls.append(name)
+        if fail:
+            raise RuntimeError(f"{name} connection refused")
+        return iter([])
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+
+def test_failover_tries_each_endpoint_once():
+    calls = []
+    failing = Endpoint("a", fake_client(calls, "a", fail=True))
+    slow = Endpoint("b", fake_client(calls, "b"))
+    # b的首token耗时比a失败一次后的错误惩罚还高,不排除已尝试的端点时会再次选择a
+    slow.ttft = 2.0
+    pool = EndpointPool([failing, slow])
+
+    response = ChatClient(None).get_chat_completion([], "model", pool=pool)
+    assert not isinstance(response, str)
+    assert calls == ["a", "b"]
+    list(response)
+    assert failing.in_flight == 0 and slow.in_flight == 0
+
+
+class FakeResponse:
+    def __init__(self):
+        self.closed = 0
+
+    def __iter__(self):
+        return iter(["chunk"])
+
+    def close(self):
+        self.closed += 1
+
+
+def test_unread_stream_releases_endpoint_on_close():
+    endpoint = Endpoint("a", None)
+    pool = EndpointPool([endpoint])
+    assert pool.acquire() is endpoint
+    response = FakeResponse()
+    stream = pool.track_stream(endpoint, response, 0.0)
+    assert endpoint.in_flight == 1
+    # 从未迭代也要释放进行中计数,重复close只释放一次
+    stream.close()
+    stream.close()
+    assert endpoint.in_flight == 0
+    assert response.closed == 2
+
+
+def test_agents_share_pools_and_endpoint_health(tmp_path, monkeypatch):
+    import json
+    from config_manager import ConfigManager
+
+    shared = {"name": "主线路", "api_key": "key-1", "base_url": "http://127.0.0.1:1/v1"}
+    backup = {"name": "备用线路", "api_key": "key-2", "base_url": "http://127.0.0.1:2/v1"}
+    agent = {"nickname": "", "role_system": "", "model": "m"}
+    config = {
+        "openai": {"api_key": "key-0", "base_url": "http://127.0.0.1:0/v1", "endpoints": [shared, backup]},
+        "hotkeys": {"show_window": "alt+z"},
+        "agents": {
+            "default": dict(agent),
+            "coder": dict(agent),
+            "writer": dict(agent, endpoints=[dict(shared), {"api_key": "key-3", "base_url": "http://127.0.0.1:3/v1"}]),
+        },
+    }
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "config.json").write_text(json.dumps(config), encoding="utf-8")
+    manager = ConfigManager()
+
+    default_pool = manager.get_endpoint_pool("default")
+    assert manager.get_endpoint_pool("coder") is default_pool
+    writer_pool = manager.get_endpoint_pool("writer")
+    assert writer_pool is not default_pool
+    assert writer_pool.endpoints[0] is default_pool.endpoints[0]
+    assert writer_pool.lock is default_pool.lock
+
+    # 一个agent的请求把共享端点剔除后,其他agent的池也不再选择它
+    endpoint = default_pool.endpoints[0]
+    for _ in range(default_pool.eject_after):
+        assert default_pool.acquire(exclude=default_pool.endpoints[1:]) is endpoint
+        default_pool.release(endpoint, error=True)
+    assert writer_pool.acquire() is writer_pool.endpoints[1]
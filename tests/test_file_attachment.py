@@ -0,0 +1,45 @@
+from file_attachment import FileAttachment, is_text_file, map_file_chunks
+
+
+def test_text_detection(tmp_path):
+    text = tmp_path / "notes.md"
+    text.write_text("中文内容\nplain text\n" * 1000, encoding='utf-8')
+    binary = tmp_path / "archive.bin"
+    binary.write_bytes(b"PK\x03\x04\x00\x00" + bytes(range(256)))
+    latin1 = tmp_path / "legacy.txt"
+    latin1.write_bytes("caf\xe9 au lait".encode('latin-1'))
+    assert is_text_file(text)
+    assert not is_text_file(binary)
+    assert not is_text_file(latin1)
+
+
+def test_temporary_attachment_is_removed_once(tmp_path):
+    path = tmp_path / "paste.txt"
+    path.write_text("pasted", encoding='utf-8')
+    FileAttachment(str(path)).cleanup()
+    assert path.exists()
+    attachment = FileAttachment(str(path), temporary=True)
+    attachment.cleanup()
+    attachment.cleanup()
+    assert not path.exists()
+
+
+class RecordingClient:
+    def __init__(self):
+        self.requests = []
+
+    def complete_with_resume(self, messages, model, callback, **kwargs):
+        self.requests.append(messages)
+        return "ok"
+
+
+def test_map_chunks_include_history(tmp_path):
+    path = tmp_path / "big.txt"
+    path.write_text("line\n" * 2000, encoding='utf-8')
+    history = [{"role": "system", "content": "sys"}, {"role": "user", "content": "之前的问题"},
+               {"role": "assistant", "content": "之前的回答"}]
+    client = RecordingClient()
+    map_file_chunks(client, FileAttachment(str(path)), "总结", history, "model", None, 500, 2, lambda text: None)
+    assert len(client.requests) > 1
+    for messages in client.requests:
+        assert messages[:3] == history and messages[3]['role'] == 'user'
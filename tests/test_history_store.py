@@ -0,0 +1,66 @@
+import os
+from history_store import HistoryStore
+from turn_tree import TurnTree
+
+
+def test_spill_file_is_per_process(tmp_path):
+    first = HistoryStore(str(tmp_path / "spill"), 1024)
+    second = HistoryStore(str(tmp_path / "spill"), 1024)
+    record = first.write("第一个实例")
+    assert first.read(record) == "第一个实例"
+    assert first.path.startswith(str(tmp_path / "spill"))
+    assert str(os.getpid()) in os.path.basename(first.path)
+    second.close()
+    first.close()
+    assert not os.path.exists(first.path)
+
+
+def test_messages_read_cold_prefix_without_evicting_recent_turns(tmp_path):
+    store = HistoryStore(str(tmp_path), 2000)
+    tree = TurnTree("sys", store=store)
+    for index in range(20):
+        tree.append("user" if index % 2 == 0 else "assistant", f"第{index}轮 " + "x" * 200)
+    hot_before = list(store.hot)
+    messages = tree.messages()
+    assert [message['content'] for message in messages[1:]] == [f"第{index}轮 " + "x" * 200 for index in range(20)]
+    assert list(store.hot) == hot_before
+    assert store.spills > 0
+    # 再次发送只读回相同的冷轮次,不会把最近的轮次写出
+    spills = store.spills
+    tree.messages()
+    assert store.spills == spills
+    store.close()
+
+
+def test_reset_compacts_spill_file(tmp_path):
+    store = HistoryStore(str(tmp_path), 500, compact_min_bytes=1000)
+    tree = TurnTree("sys", store=store)
+    for index in range(20):
+        tree.append("user", "y" * 200)
+    text_record = store.write("屏幕外的消息")
+    size_before = store.end
+    old_path = store.path
+    tree.reset("sys")
+    assert store.compactions == 1
+    assert store.end < size_before
+    assert not os.path.exists(old_path)
+    assert store.read(text_record) == "屏幕外的消息"
+
+    # 新对话的轮次仍可正常写出和读回
+    for index in range(10):
+        tree.append("user", f"新{index}" + "z" * 200)
+    assert [message['content'] for message in tree.messages()[1:]] == [f"新{index}" + "z" * 200 for index in range(10)]
+    store.free(text_record)
+    assert store.live_bytes == sum(length for _, length in store.records.values())
+    store.close()
+
+
+def test_resident_messages_do_not_read_spilled_turns(tmp_path):
+    store = HistoryStore(str(tmp_path), 1000)
+    tree = TurnTree("sys", store=store)
+    for index in range(10):
+        tree.append("user", f"{index}" + "w" * 200)
+    resident = tree.resident_messages()
+    assert 0 < len(resident) < 11
+    assert store.loads == 0
+    store.close()
@@ -0,0 +1,31 @@
+import pytest
+from hotkey_backends import EV_KEY, EV_SYN, EvdevBackend, InputEvent, KeyboardBackend
+
+
+def test_evdev_dispatch_matches_hotkey_and_ignores_repeats():
+    hits = []
+    backend = EvdevBackend()
+    backend.set_hotkey('alt+z', lambda: hits.append(1))
+    backend.code_names = {56: 'alt', 44: 'z', 30: 'a'}
+
+    backend.dispatch([InputEvent(0, 0, EV_KEY, 56, 1), InputEvent(0, 0, EV_SYN, 0, 0)])
+    backend.dispatch([InputEvent(0, 0, EV_KEY, 44, 1), InputEvent(0, 0, EV_KEY, 44, 2)])
+    assert hits == [1]
+
+    backend.dispatch([InputEvent(0, 0, EV_KEY, 44, 0), InputEvent(0, 0, EV_KEY, 56, 0)])
+    backend.dispatch([InputEvent(0, 0, EV_KEY, 44, 1), InputEvent(0, 0, EV_KEY, 999, 1)])
+    assert hits == [1]
+
+
+@pytest.mark.parametrize('backend_class', [EvdevBackend, KeyboardBackend])
+def test_benchmark_handler_fires_hotkey(backend_class):
+    if backend_class is KeyboardBackend:
+        pytest.importorskip('keyboard')
+    hits = []
+    handler = backend_class().benchmark_handler('alt+z', lambda: hits.append(1))
+    for name, down in [('a', True), ('a', False), ('alt', True), ('z', True), ('z', False), ('alt', False)]:
+        handler(name, down)
+    flush = getattr(handler, 'flush', None)
+    if flush is not None:
+        flush()
+    assert hits == [1]
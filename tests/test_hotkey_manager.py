@@ -0,0 +1,36 @@
+import threading
+import hotkey_manager
+from hotkey_backends import HotkeyBackend
+from hotkey_manager import HotkeyManager
+
+registered = threading.Event()
+
+
+class UnreadableBackend(HotkeyBackend):
+    name = 'unreadable'
+
+    def register(self, hotkey, callback):
+        raise OSError("permission denied")
+
+    def unregister_all(self):
+        pass
+
+
+class WorkingBackend(HotkeyBackend):
+    name = 'working'
+
+    def register(self, hotkey, callback):
+        registered.set()
+
+    def unregister_all(self):
+        pass
+
+
+def test_falls_back_to_next_backend_off_the_calling_thread(monkeypatch):
+    monkeypatch.setattr(hotkey_manager, 'create_backends', lambda name: [UnreadableBackend, WorkingBackend])
+    registered.clear()
+    manager = HotkeyManager({'hotkeys': {'show_window': 'alt+z'}}, lambda: None)
+    manager.setup_global_hotkey()
+    assert registered.wait(2)
+    assert manager.backend.name == 'working'
+    manager.cleanup()
@@ -0,0 +1,55 @@
+import json
+import os
+import socket
+import pytest
+import instance_server
+from instance_server import InstanceServer, get_instance_address, send_request
+
+
+@pytest.fixture
+def runtime_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_RUNTIME_DIR', str(tmp_path))
+    return tmp_path
+
+
+def echo_server():
+    server = InstanceServer()
+    server.register('echo', lambda request, reply: reply({'echo': request['text']}))
+    assert server.start()
+    return server
+
+
+def test_second_instance_is_refused(runtime_dir):
+    server = echo_server()
+    try:
+        assert list(send_request({'command': 'echo', 'text': '你好'})) == [{'echo': '你好'}]
+        assert not InstanceServer().start()
+        if hasattr(socket, 'AF_UNIX'):
+            assert os.stat(get_instance_address()).st_mode & 0o077 == 0
+    finally:
+        server.close()
+
+
+def test_tcp_mode_requires_token(runtime_dir, monkeypatch):
+    monkeypatch.delattr(socket, 'AF_UNIX', raising=False)
+    server = echo_server()
+    try:
+        assert list(send_request({'command': 'echo', 'text': 'hi'})) == [{'echo': 'hi'}]
+        # 不带令牌直接连接端口的请求被拒绝
+        with open(get_instance_address(), 'r', encoding='utf-8') as f:
+            port = json.load(f)['port']
+        with socket.create_connection(('127.0.0.1', port)) as sock:
+            sock.sendall(b'{"command": "echo", "text": "hi"}\n')
+            reply = json.loads(sock.makefile('r', encoding='utf-8').readline())
+        assert 'error' in reply
+    finally:
+        server.close()
+
+
+def test_corrupt_port_file_raises_value_error(runtime_dir, monkeypatch):
+    monkeypatch.delattr(socket, 'AF_UNIX', raising=False)
+    with open(get_instance_address(), 'w', encoding='utf-8') as f:
+        f.write('12345')
+    with pytest.raises(ValueError):
+        list(send_request({'command': 'echo', 'text': 'hi'}))
+    assert not instance_server.forward_to_running_instance([])
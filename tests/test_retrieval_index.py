@@ -0,0 +1,73 @@
+import numpy as np
+from retrieval_index import RetrievalIndex
+
+DOCS = [
+    "Q: 如何配置全局热键\nA: 在设置菜单中修改热键组合",
+    "Q: how do I export the chat history\nA: use the save button in the toolbar",
+    "Q: 为什么流式输出中断\nA: 网络连接断开后会自动续写",
+]
+
+
+def build(path, docs=DOCS):
+    index = RetrievalIndex(str(path))
+    for text in docs:
+        index.add_document(text)
+    return index
+
+
+def test_self_match_is_cosine_one(tmp_path):
+    index = build(tmp_path)
+    for text in DOCS:
+        score, found = index.search(text, top_k=1)[0]
+        assert found == text
+        assert abs(score - 1.0) < 1e-5
+
+
+def cosine(index, query, text):
+    """按快照的idf直接计算两段文本的余弦相似度"""
+    vectors = []
+    for counts in (index._tokenize(query), index._tokenize(text)):
+        vector = np.zeros(RetrievalIndex.DIMENSION)
+        for bucket, count in counts.items():
+            vector[bucket] = (1 + np.log(count)) * index.idf[bucket]
+        vectors.append(vector / np.linalg.norm(vector))
+    return float(np.dot(*vectors))
+
+
+def test_snapshot_and_delta_scores_are_cosine(tmp_path, monkeypatch):
+    """倒排快照中的文档和快照之后新增的文档都按同一份idf计算余弦相似度"""
+    monkeypatch.setattr(RetrievalIndex, 'MIN_DELTA', 1000)
+    docs = [f"document {i} about topic {i % 5} with shared words" for i in range(20)]
+    index = build(tmp_path, docs[:12])
+    index._rebuild()
+    for text in docs[12:]:
+        index.add_document(text)
+    assert index.covered == 12 and index.doc_count() == 20
+
+    query = "shared words about topic 3"
+    results = index.search(query, top_k=20, min_score=0)
+    assert len(results) == 20
+    for score, text in results:
+        assert abs(score - cosine(index, query, text)) < 1e-5
+
+
+def test_uncommitted_tail_is_truncated_on_load(tmp_path):
+    index = build(tmp_path)
+    # 模拟写入indptr之前中断: 正排数据和原文有残留,但没有提交
+    with open(index.indices_path, 'ab') as f:
+        np.array([1, 2, 3], dtype=np.uint32).tofile(f)
+    with open(index.data_path, 'ab') as f:
+        np.array([1, 1, 1], dtype=np.float32).tofile(f)
+    with open(index.docs_path, 'ab') as f:
+        offset = f.tell()
+        f.write(b'{"text": "orphan"}\n')
+    with open(index.offsets_path, 'ab') as f:
+        np.array([offset], dtype=np.uint64).tofile(f)
+
+    reloaded = RetrievalIndex(str(tmp_path))
+    assert reloaded.doc_count() == len(DOCS)
+    reloaded.add_document("a new document after recovery")
+    score, found = reloaded.search("a new document after recovery", top_k=1)[0]
+    assert found == "a new document after recovery"
+    assert abs(score - 1.0) < 1e-5
+    assert (reloaded.df == np.bincount(reloaded.indices, minlength=RetrievalIndex.DIMENSION)).all()
@@ -0,0 +1,98 @@
+import threading
+from send_queue import SendQueue
+
+
+class BlockingResponse:
+    """在close()之前一直阻塞读取的流式响应"""
+
+    def __init__(self):
+        self.closed = threading.Event()
+
+    def __iter__(self):
+        self.closed.wait(5)
+        if self.closed.is_set():
+            raise ConnectionError("response closed")
+        yield "never"
+
+    def close(self):
+        self.closed.set()
+
+
+def test_cancel_closes_streaming_response():
+    started = threading.Event()
+    finished = threading.Event()
+    response = BlockingResponse()
+
+    def handler(request):
+        request.attach_response(response)
+        started.set()
+        try:
+            list(response)
+        except ConnectionError:
+            pass
+        finished.set()
+
+    queue = SendQueue(handler)
+    request = queue.submit("hello", conversation=1)
+    queued = queue.submit("queued", conversation=1)
+    assert started.wait(2)
+    queue.cancel_all()
+    # 阻塞在读取上的工作线程因响应被关闭而立即结束,不必等到下一块数据
+    assert finished.wait(1)
+    assert request.cancelled and response.closed.is_set()
+    assert queued.state == 'cancelled'
+
+
+def test_merged_request_replies_in_last_placeholder():
+    started = threading.Event()
+    release = threading.Event()
+    done = threading.Event()
+    handled = []
+
+    def handler(request):
+        started.set()
+        release.wait(2)
+        handled.append(request)
+        if len(handled) == 2:
+            done.set()
+
+    queue = SendQueue(handler, merge=True)
+    queue.submit("first", reply_text="reply-0", conversation=3)
+    assert started.wait(2)
+    # 第一条正在发送时排队的两条消息合并为一轮,回复显示在最后一条的占位面板中
+    queue.submit("second", reply_text="reply-1", conversation=3)
+    queue.submit("third", reply_text="reply-2", conversation=3)
+    release.set()
+    assert done.wait(2)
+    merged = handled[1]
+    assert [part.message for part in merged.parts] == ["second", "third"]
+    assert merged.reply_text == "reply-2"
+    assert merged.conversation == 3
+
+
+def test_edit_is_never_merged_behind_other_messages():
+    started = threading.Event()
+    release = threading.Event()
+    handled = []
+
+    def handler(request):
+        started.set()
+        release.wait(2)
+        handled.append(request)
+
+    queue = SendQueue(handler, merge=True)
+    queue.submit("first")
+    assert started.wait(2)
+    queue.submit("second")
+    edit = object()
+    queue.submit("edited", edit_of=edit)
+    queue.submit("after edit")
+    release.set()
+    for _ in range(200):
+        if len(handled) == 3:
+            break
+        threading.Event().wait(0.01)
+    assert [part.message for part in handled[1].parts] == ["second"]
+    assert handled[1].edit_of is None
+    assert [part.message for part in handled[2].parts] == ["edited", "after edit"]
+    assert handled[2].edit_of is edit
@@ -0,0 +1,14 @@
+import os
+import sys
+import pytest
+
+wx = pytest.importorskip('wx')
+
+if sys.platform.startswith('linux') and not os.environ.get('DISPLAY') and not os.environ.get('WAYLAND_DISPLAY'):
+    pytest.skip("需要图形界面环境", allow_module_level=True)
+
+from diagnostics import run_soak
+
+
+def test_soak_through_chat_frame():
+    assert run_soak(5, turns_per_cycle=3, warmup=2, max_growth_kb=512)
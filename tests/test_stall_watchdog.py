@@ -0,0 +1,48 @@
+import threading
+import time
+from stall_watchdog import StallWatchdog
+
+
+def busy_ui_handler(state):
+    """模拟在UI线程中执行的耗时处理,忙等期间不调用其他函数,调用栈最内层就是本函数"""
+    deadline = time.perf_counter() + 2
+    while not state['resumed'] and time.perf_counter() < deadline:
+        pass
+
+
+def test_delayed_ping_is_recorded_with_main_stack():
+    calls = []
+    state = {'resumed': False}
+
+    def post(callback):
+        calls.append(callback)
+        if len(calls) == 1:
+            # 第一次投递的回调延迟执行,相当于UI线程被占用
+            threading.Timer(0.3, callback).start()
+        else:
+            state['resumed'] = True
+            callback()
+
+    watchdog = StallWatchdog(post, threshold_ms=50, interval_ms=10)
+    watchdog.start()
+    try:
+        busy_ui_handler(state)
+    finally:
+        watchdog.stop()
+
+    assert watchdog.stall_count == 1
+    duration, _, _, stack = watchdog.worst_stalls[0]
+    assert duration >= 0.25
+    assert "busy_ui_handler" in stack
+    summary = watchdog.summary()
+    assert summary.startswith("共检测到 1 次卡顿")
+    assert "busy_ui_handler" in summary
+
+
+def test_responsive_loop_has_no_stalls():
+    watchdog = StallWatchdog(lambda callback: callback(), threshold_ms=50, interval_ms=5)
+    watchdog.start()
+    time.sleep(0.1)
+    watchdog.stop()
+    assert watchdog.stall_count == 0
+    assert watchdog.summary() == "本次会话未检测到UI卡顿"
@@ -0,0 +1,33 @@
+from turn_tree import TurnTree, content_tokens
+
+
+def test_messages_are_copies():
+    tree = TurnTree("sys")
+    tree.append("user", [{"type": "text", "text": "看图"}, {"type": "image_url", "image_url": {"url": "data:"}}])
+    messages = tree.messages()
+    messages[0]['content'] = "changed"
+    messages[1]['content'][0]['text'] = "changed"
+    messages.insert(1, {"role": "system", "content": "检索片段"})
+    again = tree.messages()
+    assert again[0]['content'] == "sys"
+    assert again[1]['content'][0]['text'] == "看图"
+    assert len(again) == 2
+
+
+def test_turns_from_reset_tree_are_not_contained():
+    tree = TurnTree("sys")
+    old_user = tree.append("user", "旧问题")
+    tree.append("assistant", "旧回答")
+    assert tree.contains(old_user)
+    tree.reset("新的system")
+    new_user = tree.append("user", "新问题")
+    assert not tree.contains(old_user)
+    assert tree.contains(new_user) and tree.contains(tree.root)
+
+
+def test_leaf_tokens_match_request_estimate():
+    tree = TurnTree("sys")
+    tree.append("user", "第一个问题")
+    tree.append("assistant", "回答" * 50)
+    user_turn = tree.append("user", [{"type": "text", "text": "看图"}, {"type": "image_url", "image_url": {"url": "x"}}])
+    assert user_turn.tokens == sum(content_tokens(message['content']) for message in tree.messages())
@@ -0,0 +1,62 @@
+import json
+import time
+import pytest
+from usage_ledger import FIELDS, UsageLedger
+
+
+@pytest.fixture
+def today(monkeypatch):
+    """把账本使用的当前日期固定为2026-10-01(月初)"""
+    strftime = time.strftime
+    fixed = time.strptime('2026-10-01 09:00', '%Y-%m-%d %H:%M')
+    monkeypatch.setattr(time, 'strftime', lambda fmt, t=None: strftime(fmt, fixed if t is None else t))
+    return '2026-10-01'
+
+
+def write_ledger(path, rows):
+    path.write_text(json.dumps(rows), encoding='utf-8')
+    return UsageLedger(str(path))
+
+
+def test_loads_older_rows_with_fewer_fields(tmp_path, today):
+    ledger = write_ledger(tmp_path / 'usage.json', [
+        ['2026-09-30', 'default', 'm', 2, 100, 50],
+        ['2026-10-01', 'default', 'm', 1, 10, 5, 0, 1],
+    ])
+    assert ledger.totals[('2026-09-30', 'default', 'm')] == [2, 100, 50] + [0] * (len(FIELDS) - 3)
+
+    ledger.record_resume('default', 'm', saved_tokens=7)
+    assert ledger.totals[('2026-10-01', 'default', 'm')] == [1, 10, 5, 0, 1, 1, 7]
+    reloaded = UsageLedger(ledger.path)
+    assert reloaded.rows() == ledger.rows()
+    assert all(len(row) == 3 + len(FIELDS) for row in reloaded.rows())
+
+
+def test_month_boundary_excludes_previous_month(tmp_path, today):
+    ledger = write_ledger(tmp_path / 'usage.json', [
+        ['2026-09-30', 'default', 'm', 1, 900, 100],
+        ['2026-10-01', 'default', 'm', 1, 30, 20],
+        ['2026-10-01', 'other', 'm', 1, 5000, 0],
+    ])
+    assert ledger.agent_tokens('default', '2026-10-01') == 50
+
+    allowed, text = ledger.check_budget('default', {'monthly_tokens': 100, 'mode': 'hard'})
+    assert allowed and text is None
+
+    ledger.record('default', 'm', 40, 10)
+    allowed, text = ledger.check_budget('default', {'monthly_tokens': 100, 'mode': 'hard'})
+    assert not allowed
+    assert "本月已用 100" in text
+
+
+@pytest.mark.parametrize('mode, allowed', [('soft', True), ('hard', False)])
+def test_daily_budget_mode(tmp_path, today, mode, allowed):
+    ledger = write_ledger(tmp_path / 'usage.json', [['2026-10-01', 'default', 'm', 1, 80, 20]])
+
+    result, text = ledger.check_budget('default', {'daily_tokens': 100, 'mode': mode})
+    assert result is allowed
+    assert "今日已用 100" in text
+    assert ("已停止发送" in text) is (not allowed)
+
+    assert ledger.check_budget('default', {'daily_tokens': 101, 'mode': mode}) == (True, None)
+    assert ledger.check_budget('default', None) == (True, None)